@@ -3,26 +3,126 @@ import uuid
 import threading
 import time
 import traceback # Import traceback for detailed error logging
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import config # Import config settings
 import pipeline # Import your main processing logic
+import batch # Catalog batch processing
+import transcription # For model warm-up and registry stats
+import audio_processing # For Demucs registry stats
+import long_form # Long-form transcription worker pool
+import encoders # Encoder probe at startup
+import renditions # Output resolution ladder
+import ingest # Streaming upload ingest
+from result_cache import RESULT_CACHE
+from stage_history import STAGE_HISTORY
+from metrics import METRICS, TaskProfile
+from job_queue import JobScheduler, QueueFullError
+from task_events import TASK_EVENTS, TERMINAL_STATUSES, sse_message
+from task_store import open_task_store
 
 app = Flask(__name__)
+app.request_class = ingest.IngestRequest # File parts are written to UPLOADS_DIR as they arrive
 app.config['UPLOAD_FOLDER'] = config.UPLOADS_DIR
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_MB * 1024 * 1024
 app.config['OUTPUT_FOLDER'] = config.OUTPUTS_DIR
 # <<< Add this config to potentially get better error details >>>
 app.config['PROPAGATE_EXCEPTIONS'] = True
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-TASK_STATUS = {} # Simplified status
-
-def format_timestamp(seconds):
-    """Convert seconds to MM:SS format"""
-    minutes = int(seconds // 60)
-    secs = int(seconds % 60)
-    return f"{minutes:02d}:{secs:02d}"
+# Set by create_app() in the serving process. Nothing is started at import time:
+# render and transcription worker processes (spawn) re-import this module.
+TASK_STORE = None # Task status, logs and retry info (input_path, output_path, options)
+SCHEDULER = None
+_SERVER_LOCK = None # Open lock file held for the life of the serving process
+
+# --- Model Warm-up ---
+def warm_up_models():
+    encoders.probe_encoders()
+    if config.WARMUP_WHISPER_MODEL:
+        transcription.warm_up_whisper_model(config.WHISPER_MODEL)
+    if config.PRELOAD_ALIGN_LANGUAGES:
+        transcription.preload_align_models(config.PRELOAD_ALIGN_LANGUAGES)
+    if config.LONG_FORM_ENABLED and config.WARMUP_LONG_FORM_POOL:
+        long_form.start_worker_pool(config.WHISPER_MODEL)
+
+def start_model_warmup():
+    """Loads the default models in the background so the first job starts immediately."""
+    thread_warmup = threading.Thread(target=warm_up_models, daemon=True)
+    thread_warmup.start()
+
+def claim_server_lock():
+    """
+    Makes this the only process serving the app. The job queue (queue
+    positions, cancelling) lives in the scheduler of the process that accepted
+    the job, so a second web worker sharing the task store would report other
+    workers' tasks as not queued. Raises RuntimeError if another process holds
+    config.SERVER_LOCK_PATH. No-op where fcntl is unavailable (Windows).
+    """
+    global _SERVER_LOCK
+    try:
+        import fcntl
+    except ImportError:
+        return
+    os.makedirs(os.path.dirname(config.SERVER_LOCK_PATH) or '.', exist_ok=True)
+    lock_file = open(config.SERVER_LOCK_PATH, 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(f"Another server process holds {config.SERVER_LOCK_PATH}. "
+                           f"Run a single worker process (e.g. gunicorn -w 1 --threads 8).")
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _SERVER_LOCK = lock_file
+
+def create_app():
+    """
+    Opens the task store, starts the job scheduler and the model warm-up.
+    Call once in the single process that serves requests (WSGI servers:
+    "app:create_app()" with one worker process; see claim_server_lock).
+    """
+    global TASK_STORE, SCHEDULER
+    if SCHEDULER is not None:
+        return app
+    claim_server_lock()
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+    ingest.remove_stale_parts(app.config['UPLOAD_FOLDER'])
+    transcription.set_torch_threads()
+    TASK_STORE = open_task_store(on_expire=pipeline.remove_task_dir) # Failed tasks keep checkpoints until they expire
+    SCHEDULER = JobScheduler(config.MAX_PIPELINE_WORKERS, config.MAX_QUEUED_JOBS, policy=config.SCHEDULING_POLICY,
+                             aging=config.SCHEDULER_AGING, unknown_cost=config.SCHEDULER_UNKNOWN_COST)
+    fail_interrupted_tasks()
+    start_model_warmup()
+    return app
+
+def process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True # Exists, but belongs to another user
+    return True
+
+def fail_interrupted_tasks():
+    """
+    Marks unfinished tasks whose server process is gone (a restart or crash)
+    as failed, so they can be retried instead of staying queued forever. Tasks
+    owned by another live process sharing the store are left alone.
+    """
+    for status in ('pending', 'queued', 'processing'):
+        for task_id in TASK_STORE.ids_with_status(status):
+            pid = (TASK_STORE.get(task_id) or {}).get('worker_pid')
+            # This process's scheduler is new, so a task recorded under its pid is from an earlier process
+            if SCHEDULER.position(task_id) is None and (pid == os.getpid() or not process_alive(pid)):
+                update_task(task_id, status='failed', error='Interrupted by a server restart.')
+                make_log_callback(task_id)(f"[Task {task_id}]: Interrupted while {status}; it can be retried.")
 
 def is_allowed_file(filename):
     allowed_extensions = set(config.VIDEO_EXTENSIONS + config.AUDIO_EXTENSIONS)
@@ -33,46 +133,107 @@ def is_allowed_file(filename):
     return ext in allowed_extensions
 
 
+# --- Task Status Updates ---
+# All writes to a task's status go through these helpers so /events streams are woken up.
+def make_log_callback(task_id):
+    """Log callback for a task: prints the message and appends it to the task's log."""
+    def log_callback(message):
+        print(message)
+        if TASK_STORE.append_log(task_id, message):
+            TASK_EVENTS.notify(task_id)
+    return log_callback
+
+def make_progress_callback(task_id, profile=None):
+    """
+    Pipeline progress callback: records the current stage and the share of
+    stages done, plus the task's timing profile after every finished stage.
+    """
+    def progress_callback(stage, stage_state, done, total):
+        fields = {'stage': stage, 'stage_state': stage_state, 'progress': round(done / total, 3) if total else 0.0}
+        if stage_state == 'running':
+            fields['stage_started'] = time.time()
+        elif profile is not None:
+            fields['profile'] = profile.summary()
+        update_task(task_id, **fields)
+    return progress_callback
+
+def update_task(task_id, **fields):
+    """Sets fields on a task's status; a None value removes the field."""
+    if TASK_STORE.update(task_id, **fields):
+        TASK_EVENTS.notify(task_id)
+
+def estimate_remaining(task_id, task_data):
+    """
+    Predicted seconds until the task finishes, from the per-stage estimates
+    made when it was queued (see stage_history.py). Queued tasks also wait for
+    the predicted work ahead of them, spread over the scheduler's workers.
+    """
+    estimates = task_data.get('stage_estimates')
+    status = task_data.get('status')
+    if not estimates or status not in ('queued', 'processing'):
+        return None
+    stages = list(estimates)
+    remaining = sum(estimates.values())
+    if status == 'queued':
+        return remaining + (SCHEDULER.cost_ahead(task_id) or 0) / SCHEDULER.max_workers
+    stage = task_data.get('stage')
+    if stage in estimates:
+        remaining = sum(estimates[name] for name in stages[stages.index(stage) + 1:])
+        if task_data.get('stage_state') == 'running':
+            elapsed = time.time() - task_data.get('stage_started', time.time())
+            remaining += max(estimates[stage] - elapsed, 0)
+    return remaining
+
+def status_summary(task_id, task_data):
+    """The small, frequently changing part of a task's status (no log, no segments)."""
+    summary = {key: task_data[key] for key in ('status', 'stage', 'stage_state', 'progress', 'error') if key in task_data}
+    if task_data.get('status') == 'queued':
+        summary['queue_position'] = SCHEDULER.position(task_id)
+    eta = estimate_remaining(task_id, task_data)
+    if eta is not None:
+        summary['eta_seconds'] = int(round(eta))
+    return summary
+
+
 # --- Background Processing ---
 def start_processing_thread(task_id, input_path, output_path, options, log_callback):
     """Function to run the main pipeline in a separate thread."""
+    profile = TaskProfile()
     try:
         # Ensure task exists before starting
-        if task_id not in TASK_STATUS:
+        task_data = TASK_STORE.get(task_id)
+        if task_data is None or task_data.get('status') == 'cancelled':
              print(f"[Thread {task_id}]: Task cancelled or removed before starting.")
              return
+        update_task(task_id, status='processing')
         log_callback(f"[Task {task_id}]: Pipeline thread started.")
-        segments = pipeline.run_pipeline(input_path, output_path, options, log_callback)
+        segments = pipeline.run_pipeline(input_path, output_path, options, log_callback, task_id=task_id,
+                                         progress_callback=make_progress_callback(task_id, profile), profile=profile)
 
         # Save transcript data and create text file
-        if task_id in TASK_STATUS and segments:
-            TASK_STATUS[task_id]['segments'] = segments
-
+        if segments:
             # Create transcript text file
-            transcript_filename = TASK_STATUS[task_id]['output_filename'].replace('.mp4', '_transcript.txt')
+            transcript_filename = task_data['output_filename'].replace('.mp4', '_transcript.txt')
             transcript_path = os.path.join(app.config['OUTPUT_FOLDER'], transcript_filename)
 
-            with open(transcript_path, 'w', encoding='utf-8') as f:
-                for seg in segments:
-                    # Format: [timestamp] text
-                    start_time = seg.get('start', 0)
-                    text = seg.get('text', '').strip()
-                    f.write(f"[{format_timestamp(start_time)}] {text}\n")
+            pipeline.write_transcript(segments, transcript_path)
 
-            TASK_STATUS[task_id]['transcript_filename'] = transcript_filename
+            update_task(task_id, segments=segments, transcript_filename=transcript_filename)
             log_callback(f"[Task {task_id}]: Transcript saved to {transcript_filename}")
 
-        # Check again if task still exists before marking complete
-        if task_id in TASK_STATUS:
-             TASK_STATUS[task_id]['status'] = 'complete'
+        if options.get('render_video', True):
+            update_task(task_id, renditions=renditions.list_renditions(output_path))
+
+        # update_task is a no-op if the task was removed meanwhile
+        update_task(task_id, status='complete', progress=1.0, profile=profile.summary())
+        METRICS.inc('tasks_total', status='complete')
         log_callback(f"[Task {task_id}]: Processing complete.")
     except Exception as e:
         tb_str = traceback.format_exc()
         error_message = f"ERROR in pipeline: {e}\nTraceback:\n{tb_str}"
         log_callback(f"[Task {task_id}]: {error_message}")
-        if task_id in TASK_STATUS:
-             TASK_STATUS[task_id]['status'] = 'failed'
-             TASK_STATUS[task_id]['error'] = str(e) # Store simpler error for UI
+        update_task(task_id, status='failed', error=str(e), profile=profile.summary()) # Store simpler error for UI
+        METRICS.inc('tasks_total', status='failed')
     finally:
         log_callback(f"[Task {task_id}]: Main pipeline thread finished.")
 
@@ -91,27 +252,25 @@ def upload_file():
     # Define a preliminary log_callback for early errors
     def early_log(message):
         print(message)
-        # Don't assume TASK_STATUS[task_id] exists yet
-        if task_id in TASK_STATUS and 'log' in TASK_STATUS[task_id]:
-            TASK_STATUS[task_id]['log'].append(message)
+        # Don't assume the task exists in TASK_STORE yet
+        if TASK_STORE.append_log(task_id, message):
+            TASK_EVENTS.notify(task_id)
 
     early_log(f"[Task {task_id}]: Entering upload route.")
 
     try:
         # Initialize status only after task_id is confirmed valid
-        TASK_STATUS[task_id] = {'status': 'pending', 'log': []}
+        TASK_STORE.create(task_id, {'status': 'pending', 'worker_pid': os.getpid()})
 
         # Define the main log_callback for this task
-        def log_callback(message):
-            print(message)
-            task_data = TASK_STATUS.get(task_id)
-            if task_data:
-                task_data['log'].append(message)
+        log_callback = make_log_callback(task_id)
 
         log_callback(f"[Task {task_id}]: Received upload request.")
 
         # --- File Handling ---
+        # The body is parsed (and file parts streamed to disk, see ingest.py) on the first access to request.files
         input_path = None
+        upload = None
         original_filename = "unknown_file"
         # <<< Add check for request.files existence >>>
         if not request.files:
@@ -124,7 +283,8 @@ def upload_file():
             if file and is_allowed_file(original_filename):
                 filename = secure_filename(f"{task_id}_{original_filename}")
                 input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                try: file.save(input_path); log_callback(f"[Task {task_id}]: File saved to {input_path}")
+                try: upload = ingest.save_upload(file, input_path)
+                except HTTPException: raise
                 except Exception as e:
                      raise ValueError(f"Error saving file: {e}") # Raise to be caught by main try/except
             else:
@@ -135,38 +295,65 @@ def upload_file():
              log_callback(f"[Task {task_id}]: Processing recorded audio blob.")
              filename = secure_filename(f"{task_id}_{original_filename}")
              input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-             try: blob.save(input_path); log_callback(f"Recorded audio saved to {input_path}")
+             try: upload = ingest.save_upload(blob, input_path)
+             except HTTPException: raise
              except Exception as e:
                   raise ValueError(f"Error saving blob: {e}")
         else:
             raise ValueError("No file part or audio blob found in the request.")
+        media = upload['media'] or {}
+        log_callback(f"[Task {task_id}]: Saved {upload['size'] / 1e6:.1f} MB to {input_path} "
+                     f"(duration {media.get('duration') or 0:.1f}s, audio {media.get('audio_codec')}, "
+                     f"video {media.get('video_codec')}, sha256 {upload['sha256'][:12]})")
 
         # --- Options & Output Path ---
         options = {
             'model': request.form.get('model', config.WHISPER_MODEL),
             'do_separate_vocals': request.form.get('separate_vocals') == 'true',
             'do_wipe_text': request.form.get('wipe_text') == 'true',
+            'speculative_separation': request.form.get('speculative_separation', str(config.SPECULATIVE_SEPARATION).lower()) == 'true',
+            'render_engine': request.form.get('render_engine', config.RENDER_ENGINE),
+            'parallel_render': request.form.get('parallel_render', str(config.PARALLEL_RENDER).lower()) == 'true',
+            'smart_render': request.form.get('smart_render', str(config.SMART_RENDER).lower()) == 'true',
+            'renditions': renditions.parse_heights(request.form.get('renditions', ','.join(map(str, config.RENDITIONS)))),
+            'input_hash': upload['sha256'],
+            'media_duration': media.get('duration'),
             'is_video': '.' in original_filename and \
                         f".{original_filename.rsplit('.', 1)[1].lower()}" in config.VIDEO_EXTENSIONS
         }
+        if options['render_engine'] not in config.RENDER_ENGINES:
+            raise ValueError(f"Unknown render engine: {options['render_engine']}")
         log_callback(f"[Task {task_id}]: Options: {options}")
 
         base_name = os.path.splitext(original_filename)[0]
         output_filename = secure_filename(f"{base_name}_lyrics_{task_id[:8]}.mp4")
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        TASK_STATUS[task_id]['output_filename'] = output_filename
-
-        # --- Start Background Thread ---
-        TASK_STATUS[task_id]['status'] = 'processing'
-        log_callback(f"[Task {task_id}]: Starting main processing pipeline thread...")
-        thread_pipeline = threading.Thread(
-            target=start_processing_thread,
-            args=(task_id, input_path, output_path, options, log_callback)
-        )
-        thread_pipeline.start()
 
-        log_callback(f"[Task {task_id}]: Background processing initiated.")
-        return jsonify({'status': 'Processing started', 'task_id': task_id})
+        # --- Queue Background Job ---
+        estimates = STAGE_HISTORY.predict_job(options, media.get('duration'), pipeline.stage_names())
+        update_task(task_id, output_filename=output_filename, status='queued', media=media,
+                    stage_estimates=estimates, owner=request.remote_addr)
+        TASK_STORE.set_job(task_id, (input_path, output_path, options))
+        try:
+            position = SCHEDULER.submit(
+                task_id, start_processing_thread,
+                task_id, input_path, output_path, options, log_callback,
+                cost=sum(estimates.values()) if estimates else None, owner=request.remote_addr
+            )
+        except QueueFullError as e:
+            log_callback(f"[Task {task_id}]: Rejected: {e}")
+            TASK_STORE.delete(task_id)
+            if os.path.exists(input_path): os.remove(input_path)
+            return jsonify({'error': 'Server is busy, please try again later.'}), 429
+
+        log_callback(f"[Task {task_id}]: Job queued at position {position}.")
+        return jsonify({'status': 'Processing queued', 'task_id': task_id, 'queue_position': position})
+
+    except HTTPException as e:
+        # IngestRejected, or the body parser's own refusals (e.g. RequestEntityTooLarge beyond MAX_CONTENT_LENGTH)
+        early_log(f"[Task {task_id}]: Upload rejected: {e.description}")
+        update_task(task_id, status='failed', error=e.description)
+        return jsonify({'error': e.description, 'task_id': task_id}), e.code
 
     except Exception as e:
         # Log the unexpected error using the preliminary logger
@@ -178,27 +365,269 @@ def upload_file():
         # Ensure a JSON error response is sent
         response_data = {'error': 'An unexpected server error occurred during upload.'}
         # Update status if task entry was created
-        if task_id in TASK_STATUS:
-             TASK_STATUS[task_id]['status'] = 'failed'
-             TASK_STATUS[task_id]['error'] = response_data['error']
+        if TASK_STORE.exists(task_id):
+             update_task(task_id, status='failed', error=response_data['error'])
              response_data['task_id'] = task_id
 
         return jsonify(response_data), 500
 
+    finally:
+        ingest.discard_uploads(request) # Unused or rejected file parts; accepted ones were moved already
+
 
 # Watcher thread function removed
 
 @app.route('/status/<task_id>')
 def task_status(task_id):
-    """Provides status updates for a given task."""
-    status_info = TASK_STATUS.get(task_id, {'status': 'not_found', 'log': ['Task ID not found.']})
-    if 'log' not in status_info: status_info['log'] = []
-    if 'song_info' in status_info: del status_info['song_info'] # Clean up old key if present
-    return jsonify(status_info)
+    """
+    Provides status updates for a given task. With ?since=N only the log lines
+    from index N on are returned (plus 'next_since' for the next request), and
+    segments are left out until the task is complete.
+    """
+    status_info = TASK_STORE.get(task_id)
+    if status_info is None:
+        return jsonify({'status': 'not_found', 'log': ['Task ID not found.']})
+    status_info.pop('song_info', None) # Clean up old key if present
+    response_data = dict(status_info)
+    response_data.update(status_summary(task_id, status_info))
+    since = request.args.get('since', type=int)
+    response_data['log'], response_data['next_since'] = TASK_STORE.read_log(task_id, since or 0)
+    if since is not None and status_info.get('status') != 'complete':
+        response_data.pop('segments', None)
+    return jsonify(response_data)
+
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    """
+    Server-Sent Events stream for a task:
+      'log'    - one new log line; its event id is the log cursor, so a reconnect resumes via Last-Event-ID
+      'status' - status, stage, progress and queue position, sent whenever they change
+      'done'   - the final status (with segments, without the log), after which the stream ends
+    ?since=N starts the log at line N.
+    """
+    if not TASK_STORE.exists(task_id):
+        return jsonify({'error': 'Task ID not found.'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    start = int(last_event_id) if last_event_id.isdigit() else request.args.get('since', 0, type=int)
+
+    # Writes from other web workers only show up in a shared store, so poll it as well
+    wait_seconds = config.STATUS_POLL_SECONDS if TASK_STORE.shared else config.STATUS_HEARTBEAT_SECONDS
+
+    def stream():
+        cursor, last_summary, version, last_sent = max(start, 0), None, None, time.time()
+        with TASK_EVENTS.subscribe(task_id):
+            while True:
+                task_data = TASK_STORE.get(task_id)
+                if task_data is None:
+                    yield sse_message('done', {'status': 'not_found'})
+                    return
+                lines, next_cursor = TASK_STORE.read_log(task_id, cursor)
+                for offset, line in enumerate(lines):
+                    yield sse_message('log', line, event_id=next_cursor - len(lines) + offset + 1)
+                sent = bool(lines)
+                cursor = max(cursor, next_cursor)
+                if task_data.get('status') in TERMINAL_STATUSES:
+                    yield sse_message('done', task_data)
+                    return
+                summary = status_summary(task_id, task_data)
+                if summary != last_summary:
+                    yield sse_message('status', summary)
+                    last_summary, sent = summary, True
+                if sent:
+                    last_sent = time.time()
+                elif time.time() - last_sent >= config.STATUS_HEARTBEAT_SECONDS:
+                    yield ": keep-alive\n\n" # Also lets the server notice a closed connection
+                    last_sent = time.time()
+                version = TASK_EVENTS.wait(task_id, version, wait_seconds)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    """Cancels a job that is still waiting in the queue."""
+    if not TASK_STORE.exists(task_id):
+        return jsonify({'error': 'Task ID not found.'}), 404
+    if not SCHEDULER.cancel(task_id):
+        return jsonify({'error': 'Task is not queued (already running or finished).'}), 409
+    update_task(task_id, status='cancelled')
+    make_log_callback(task_id)(f"[Task {task_id}]: Cancelled while queued.")
+    return jsonify({'status': 'cancelled', 'task_id': task_id})
+
+def start_batch_thread(task_id, entries, output_dir, log_callback):
+    """Runs a catalog batch on a scheduler worker and stores its report."""
+    try:
+        task_data = TASK_STORE.get(task_id)
+        if task_data is None or task_data.get('status') == 'cancelled':
+            return
+        update_task(task_id, status='processing')
+        report = batch.run_batch(entries, output_dir, log_callback)
+        update_task(task_id, batch_report=report, status='complete')
+        log_callback(f"[Batch {task_id}]: {report['completed']}/{report['total_files']} files completed.")
+    except Exception as e:
+        log_callback(f"[Batch {task_id}]: ERROR: {e}\n{traceback.format_exc()}")
+        update_task(task_id, status='failed', error=str(e))
+
+def predict_batch(entries):
+    """
+    {stage: predicted seconds} summed over a batch's entries (see predict_job),
+    or None if no entry's duration is known. Entries with an unknown duration
+    count as config.SCHEDULER_UNKNOWN_COST each.
+    """
+    stages = pipeline.stage_names()
+    totals, unknown = dict.fromkeys(stages, 0.0), 0
+    for entry in entries:
+        estimates = STAGE_HISTORY.predict_job(batch.entry_options(entry), audio_processing.probe_duration(entry['path']), stages)
+        if not estimates:
+            unknown += 1
+            continue
+        for stage, seconds in estimates.items():
+            totals[stage] += seconds
+    if unknown == len(entries):
+        return None
+    totals[stages[0]] += unknown * config.SCHEDULER_UNKNOWN_COST
+    return {stage: round(seconds, 1) for stage, seconds in totals.items()}
+
+@app.route('/batch', methods=['POST'])
+def start_batch():
+    """
+    Queues a batch over a directory or manifest under config.BATCH_INPUT_ROOT.
+    JSON body: {"source": "<relative path>", "model": ..., "separate_vocals": bool,
+    "wipe_text": bool, "transcripts_only": bool}. Progress and the final report
+    are available from /status/<task_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    source = data.get('source', '')
+    input_root = os.path.abspath(config.BATCH_INPUT_ROOT)
+    source_path = os.path.abspath(os.path.join(input_root, source))
+    if not source or os.path.commonpath([input_root, source_path]) != input_root or not os.path.exists(source_path):
+        return jsonify({'error': f"'source' must be an existing path under {config.BATCH_INPUT_ROOT}."}), 400
+
+    defaults = {
+        'model': data.get('model', config.WHISPER_MODEL),
+        'do_separate_vocals': bool(data.get('separate_vocals', False)),
+        'do_wipe_text': bool(data.get('wipe_text', False)),
+        'render_video': not data.get('transcripts_only', False),
+    }
+    try:
+        entries = batch.load_entries(source_path, defaults, input_root=input_root)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not entries:
+        return jsonify({'error': 'No supported media files found.'}), 400
+
+    task_id = str(uuid.uuid4())
+    output_dir = os.path.join(config.BATCH_OUTPUT_DIR, task_id[:8])
+    estimates = predict_batch(entries)
+    TASK_STORE.create(task_id, {'status': 'queued', 'batch_files': len(entries), 'output_dir': output_dir,
+                                'stage_estimates': estimates, 'owner': request.remote_addr, 'worker_pid': os.getpid()})
+
+    log_callback = make_log_callback(task_id)
+
+    try:
+        position = SCHEDULER.submit(task_id, start_batch_thread, task_id, entries, output_dir, log_callback,
+                                    cost=sum(estimates.values()) if estimates else None, owner=request.remote_addr)
+    except QueueFullError:
+        TASK_STORE.delete(task_id)
+        return jsonify({'error': 'Server is busy, please try again later.'}), 429
+    return jsonify({'status': 'Batch queued', 'task_id': task_id, 'files': len(entries), 'queue_position': position})
+
+@app.route('/retry/<task_id>', methods=['POST'])
+def retry_task(task_id):
+    """Re-queues a failed or cancelled task; the pipeline resumes after its last completed stage."""
+    task_data = TASK_STORE.get(task_id)
+    job = TASK_STORE.get_job(task_id)
+    if task_data is None or job is None:
+        return jsonify({'error': 'Task ID not found.'}), 404
+    if task_data.get('status') not in ('failed', 'cancelled'):
+        return jsonify({'error': f"Only failed or cancelled tasks can be retried (status: {task_data.get('status')})."}), 409
+
+    input_path, output_path, options = job
+    if not os.path.exists(input_path):
+        return jsonify({'error': 'Original upload is no longer available.'}), 410
+
+    log_callback = make_log_callback(task_id)
+    # A retry resumes after the last checkpoint, so only the stages still to run are estimated
+    estimates = task_data.get('stage_estimates')
+    if estimates and task_data.get('stage') in estimates:
+        stages = list(estimates)
+        estimates = {name: estimates[name] for name in stages[stages.index(task_data['stage']):]}
+    update_task(task_id, status='queued', error=None, stage_estimates=estimates, worker_pid=os.getpid())
+    try:
+        position = SCHEDULER.submit(
+            task_id, start_processing_thread,
+            task_id, input_path, output_path, options, log_callback,
+            cost=sum(estimates.values()) if estimates else None, owner=task_data.get('owner')
+        )
+    except QueueFullError:
+        update_task(task_id, status='failed')
+        return jsonify({'error': 'Server is busy, please try again later.'}), 429
+
+    log_callback(f"[Task {task_id}]: Retry queued at position {position}.")
+    return jsonify({'status': 'Retry queued', 'task_id': task_id, 'queue_position': position})
+
+@app.route('/models')
+def model_stats():
+    """Reports loaded models and cache hit/miss/load-time counters."""
+    return jsonify({
+        'whisper': transcription.WHISPER_MODELS.stats(),
+        'align': transcription.ALIGN_MODELS.stats(),
+        'demucs': audio_processing.DEMUCS_MODELS.stats(),
+        'scheduler': SCHEDULER.stats(),
+        'result_cache': RESULT_CACHE.stats(),
+        'task_store': TASK_STORE.stats(),
+        'stage_history': STAGE_HISTORY.stats(),
+        'encoders': {
+            'usable': encoders.probe_encoders(),
+            'selected': encoders.describe(encoders.encoder_candidates()[0]),
+        },
+    })
+
+def collect_app_metrics():
+    """Cache, model registry, scheduler and task store figures, read when /metrics is scraped."""
+    samples = []
+    cache = RESULT_CACHE.stats()
+    samples += [
+        ('result_cache_hits_total', 'counter', "Result cache lookups that hit.", {}, cache['hits']),
+        ('result_cache_misses_total', 'counter', "Result cache lookups that missed.", {}, cache['misses']),
+        ('result_cache_hit_ratio', 'gauge', "Share of result cache lookups that hit.", {}, cache['hit_rate']),
+    ]
+    for registry in (transcription.WHISPER_MODELS, transcription.ALIGN_MODELS, audio_processing.DEMUCS_MODELS):
+        stats = registry.stats()
+        labels = {'registry': stats['name']}
+        lookups = stats['hits'] + stats['misses']
+        samples += [
+            ('model_cache_hits_total', 'counter', "Model registry lookups served by a loaded model.", labels, stats['hits']),
+            ('model_cache_misses_total', 'counter', "Model registry lookups that loaded a model.", labels, stats['misses']),
+            ('model_cache_hit_ratio', 'gauge', "Share of model registry lookups served by a loaded model.", labels,
+             round(stats['hits'] / lookups, 3) if lookups else None),
+            ('model_load_seconds_total', 'counter', "Time spent loading models.", labels, stats['total_load_seconds']),
+            ('model_memory_bytes', 'gauge', "Estimated memory of loaded models.", labels, stats['memory_bytes']),
+        ]
+    scheduler = SCHEDULER.stats()
+    samples += [
+        ('scheduler_running_jobs', 'gauge', "Jobs running on scheduler workers.", {}, scheduler['running']),
+        ('scheduler_queued_jobs', 'gauge', "Jobs waiting for a scheduler worker.", {}, scheduler['queued']),
+    ]
+    for status, count in TASK_STORE.stats()['by_status'].items():
+        samples.append(('tasks', 'gauge', "Tasks in the task store by status.", {'status': status}, count))
+    return samples
+
+METRICS.add_collector(collect_app_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics: stage/step timings, peak RSS, encode fps, cache hit rates."""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/serve_video/<filename>')
 def serve_video(filename):
-    """Serves the processed video file for embedding."""
+    """Serves the processed video file for embedding. ?height=480 selects a rendition if one exists."""
+    height = request.args.get('height', type=int)
+    if height:
+        rendition = renditions.rendition_filename(filename, height)
+        if os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], rendition)):
+            filename = rendition
     print(f"[Server] Attempting to serve video: {filename}")
     try:
         return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=False, mimetype='video/mp4')
@@ -224,5 +653,8 @@ def serve_transcript(filename):
 
 
 if __name__ == '__main__':
+    # The debug reloader's parent process only watches files; the child it starts (WERKZEUG_RUN_MAIN) serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(debug=True, port=5001)
 
@@ -1,38 +1,214 @@
 import os
 import subprocess
 import shutil
-from pydub import AudioSegment
+import wave
+import threading
+from collections import deque
+import numpy as np
 import config
+from model_registry import ModelRegistry
+from metrics import timed
 
-def extract_audio(input_path, wav_path, log_callback):
+SAMPLE_RATE = 16000 # Whisper / WhisperX input rate
+RAW_AUDIO_SUFFIX = ".f32" # Headerless 16 kHz mono float32 little-endian samples
+
+def _ffmpeg_decode_command(input_path, sample_rate):
+    return [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", input_path,
+        "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate),
+        "-"
+    ]
+
+@timed('decode')
+def extract_audio(input_path, raw_path, log_callback, chunk_size=1024 * 1024):
     """
-    Extracts audio, standardizes it to 16kHz mono for Whisper,
-    and saves it as a temporary WAV file.
+    Decodes the input's audio track once with ffmpeg, streaming 16 kHz mono
+    float32 samples straight into raw_path (no WAV, no in-memory decode).
+    The file is opened with open_audio() as a memory-mapped array that
+    Whisper, WhisperX and Demucs consume directly.
+    Returns raw_path, or None on failure.
     """
     try:
         log_callback(f"Extracting audio from '{os.path.basename(input_path)}'...")
-        audio = AudioSegment.from_file(input_path)
-        audio = audio.set_channels(1).set_frame_rate(16000)
-        audio.export(wav_path, format="wav")
-        log_callback(f"Temporary WAV file created at '{wav_path}'.")
-        return wav_path
+        process = subprocess.Popen(
+            _ffmpeg_decode_command(input_path, SAMPLE_RATE),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        # Drained concurrently: ffmpeg blocks if a corrupt input fills the stderr pipe with decode errors
+        stderr_lines = deque(maxlen=20)
+        stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+        stderr_reader.start()
+        total_bytes = 0
+        with open(raw_path, 'wb') as f:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                f.write(chunk)
+                total_bytes += len(chunk)
+        stderr_reader.join()
+        stderr = b''.join(stderr_lines).decode('utf-8', errors='replace')
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.strip()}")
+        if total_bytes == 0:
+            raise RuntimeError("ffmpeg produced no audio samples.")
+        duration = total_bytes / 4 / SAMPLE_RATE
+        log_callback(f"Decoded {duration:.2f}s of 16 kHz audio to '{raw_path}'.")
+        return raw_path
     except Exception as e:
         log_callback(f"Error during audio extraction: {e}")
         return None
 
-def separate_vocals(audio_path, log_callback):
+def load_audio_array(input_path, sample_rate=SAMPLE_RATE):
+    """Decodes any ffmpeg-readable file to an in-memory mono float32 array."""
+    result = subprocess.run(_ffmpeg_decode_command(input_path, sample_rate), capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32).copy()
+
+def probe_duration(input_path):
+    """Media duration in seconds from ffprobe, or None if it can't be determined."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", input_path],
+            capture_output=True, text=True, check=True
+        )
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+
+def open_audio(path):
+    """
+    Returns something Whisper/WhisperX accept: a copy-on-write memory map for raw
+    extracted audio (no decode), or the path itself for regular audio files.
+    """
+    if path and path.endswith(RAW_AUDIO_SUFFIX):
+        return np.memmap(path, dtype=np.float32, mode='c')
+    return path
+
+# --- WAV helpers ---
+def read_wav(wav_path):
+    """Reads a 16-bit PCM WAV into a float32 array of shape (samples, channels) in [-1, 1]."""
+    with wave.open(wav_path, 'rb') as wf:
+        sample_rate = wf.getframerate()
+        channels = wf.getnchannels()
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"Unsupported WAV sample width: {wf.getsampwidth() * 8} bits")
+        frames = wf.readframes(wf.getnframes())
+    audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+    return audio.reshape(-1, channels), sample_rate
+
+def write_wav(wav_path, audio, sample_rate):
+    """Writes a float array of shape (samples,) or (samples, channels) as 16-bit PCM WAV."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim == 1:
+        audio = audio[:, None]
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767.0).astype(np.int16)
+    with wave.open(wav_path, 'wb') as wf:
+        wf.setnchannels(pcm.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+    return wav_path
+
+
+# --- In-process Demucs Engine ---
+def _load_demucs_model(model_name, device):
+    from demucs.pretrained import get_model # Imported lazily; demucs is optional
+    model = get_model(model_name)
+    model.to(device)
+    model.eval()
+    return model
+
+# One Demucs model stays resident (htdemucs_ft is a bag of four models)
+DEMUCS_MODELS = ModelRegistry("demucs", _load_demucs_model, max_entries=1, exclusive_use=True)
+
+def separate_vocals_array(audio, sample_rate, log_callback=print, model_name=None):
+    """
+    Separates vocals from an in-memory buffer using a resident Demucs model.
+    audio: float32 array shaped (samples,) or (samples, channels), at any sample rate
+    (e.g. the 16 kHz extraction or the original 44.1 kHz decode).
+    Returns (vocals, model_sample_rate) with vocals shaped (samples, channels).
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import convert_audio
+
+    model_name = model_name or config.DEMUCS_MODEL
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim == 1:
+        audio = audio[:, None]
+
+    with DEMUCS_MODELS.acquire((model_name, device), log_callback) as model:
+        wav = torch.from_numpy(np.ascontiguousarray(audio.T))
+        wav = convert_audio(wav, sample_rate, model.samplerate, model.audio_channels)
+        # Same normalization as `python -m demucs.separate`
+        ref = wav.mean(0)
+        ref_mean, ref_std = ref.mean(), ref.std() + 1e-8
+        wav = (wav - ref_mean) / ref_std
+
+        log_callback(f"Running Demucs '{model_name}' in-process on {device}...")
+        with torch.no_grad():
+            sources = apply_model(
+                model, wav[None], device=device, split=True,
+                segment=config.DEMUCS_SEGMENT, overlap=config.DEMUCS_OVERLAP, progress=False
+            )[0]
+        sources = sources * ref_std + ref_mean
+        vocals = sources[model.sources.index('vocals')]
+        return vocals.cpu().numpy().T, model.samplerate
+
+def to_whisper_audio(audio, sample_rate):
+    """Converts a (samples, channels) float array to 16 kHz mono float32, as Whisper/WhisperX take it."""
+    import torch
+    from demucs.audio import convert_audio
+    wav = torch.from_numpy(np.ascontiguousarray(np.asarray(audio, dtype=np.float32).T))
+    return convert_audio(wav, sample_rate, SAMPLE_RATE, 1)[0].numpy()
+
+def _separate_vocals_in_process(audio_path, final_vocal_path, log_callback):
+    if audio_path.endswith(RAW_AUDIO_SUFFIX):
+        audio, sample_rate = open_audio(audio_path), SAMPLE_RATE
+    else:
+        audio, sample_rate = read_wav(audio_path)
+    vocals, vocals_rate = separate_vocals_array(audio, sample_rate, log_callback)
+    write_wav(final_vocal_path, vocals, vocals_rate) # For the video's audio track, the checkpoint and the cache
+    log_callback(f"Successfully separated vocals: {final_vocal_path}")
+    return final_vocal_path, to_whisper_audio(vocals, vocals_rate)
+
+
+@timed('demucs')
+def separate_vocals(audio_path, log_callback, work_dir=None):
     """
     Uses Demucs to separate vocals from an audio file.
-    Returns the path to the separated vocals file, or None on failure.
+    Runs in-process with a resident model when config.DEMUCS_IN_PROCESS is set,
+    otherwise (or if that fails) via the `demucs.separate` command line.
+    Intermediate and output files go to work_dir (the task's scratch directory),
+    so concurrent jobs don't overwrite each other.
+    Returns (vocals file path, vocals as a 16 kHz mono float32 array), where
+    the array is None unless the in-process engine produced it; (None, None) on failure.
     """
-    output_dir = "temp_demucs_output"
+    work_dir = work_dir or config.UPLOADS_DIR
+    final_vocal_path = os.path.join(work_dir, "vocals_only.wav")
+    if config.DEMUCS_IN_PROCESS:
+        try:
+            log_callback("Starting vocal separation with in-process Demucs...")
+            return _separate_vocals_in_process(audio_path, final_vocal_path, log_callback)
+        except ImportError as e:
+            log_callback(f"In-process Demucs unavailable ({e}). Falling back to the Demucs CLI.")
+        except Exception as e:
+            log_callback(f"In-process Demucs failed: {e}. Falling back to the Demucs CLI.")
+
+    output_dir = os.path.join(work_dir, "demucs_output")
     try:
         log_callback("Starting vocal separation with Demucs (this will take a while)...")
+        if audio_path.endswith(RAW_AUDIO_SUFFIX):
+            # The Demucs CLI needs a real audio file
+            wav_input = os.path.join(work_dir, "audio.wav")
+            write_wav(wav_input, open_audio(audio_path), SAMPLE_RATE)
+            audio_path = wav_input
         
         # Build the command to run Demucs
         command = [
             "python", "-m", "demucs.separate",
-            "-n", "htdemucs_ft",
+            "-n", config.DEMUCS_MODEL,
             "--two-stems=vocals",
             "-o", output_dir,
             audio_path
@@ -51,16 +227,16 @@ def separate_vocals(audio_path, log_callback):
 
         # --- Find the separated vocal file ---
         # Demucs creates a nested folder structure, e.g.,
-        # temp_demucs_output/htdemucs_ft/temp_audio/vocals.wav
+        # <work_dir>/demucs_output/htdemucs_ft/audio/vocals.wav
         
         # Find the model-named folder (e.g., 'htdemucs_ft')
-        model_output_dir = os.path.join(output_dir, "htdemucs_ft")
+        model_output_dir = os.path.join(output_dir, config.DEMUCS_MODEL)
         if not os.path.exists(model_output_dir):
              model_output_dir = os.path.join(output_dir, "htdemucs") # Fallback for older demucs
              if not os.path.exists(model_output_dir):
                  raise Exception("Could not find Demucs output model folder.")
         
-        # Find the track-named folder (e.g., 'temp_audio')
+        # Find the track-named folder (e.g., 'audio')
         track_name = os.path.splitext(os.path.basename(audio_path))[0]  
         vocal_file_dir = os.path.join(model_output_dir, track_name)
         vocal_file_path = os.path.join(vocal_file_dir, "vocals.wav")
@@ -69,11 +245,10 @@ def separate_vocals(audio_path, log_callback):
             raise Exception(f"Could not find 'vocals.wav' in {vocal_file_dir}")
 
         # --- Move the file and clean up ---
-        final_vocal_path = os.path.join(config.UPLOADS_DIR, "vocals_only.wav")
         shutil.move(vocal_file_path, final_vocal_path)
         log_callback(f"Successfully separated vocals: {final_vocal_path}")
         
-        return final_vocal_path
+        return final_vocal_path, None
 
     except subprocess.CalledProcessError as e:
         log_callback("--- DEMUCS FAILED ---")
@@ -81,11 +256,11 @@ def separate_vocals(audio_path, log_callback):
         log_callback(f"STDOUT: {e.stdout}")
         log_callback(f"STDERR: {e.stderr}")
         log_callback("Please ensure 'demucs' is installed (`pip install demucs`) and that you have enough RAM.")
-        return None
+        return None, None
     except Exception as e:
         log_callback(f"--- DEMUCS FAILED (Post-processing) ---")
         log_callback(f"Error finding/moving Demucs output: {e}")
-        return None
+        return None, None
     finally:
         # Clean up the entire demucs output directory
         if os.path.exists(output_dir):
@@ -0,0 +1,256 @@
+"""
+Batch processing of a whole catalog of audio/video files.
+
+Usage:
+    python batch.py path/to/catalog_dir --model small.en --separate-vocals
+    python batch.py manifest.json --output-dir outputs/batch --transcripts-only
+
+A manifest is either a text file with one path per line, or JSON: a list of
+paths / objects like {"path": "...", "model": "...", "separate_vocals": true,
+"wipe_text": false, "render_engine": "ffmpeg"}. Per-file settings override the command-line defaults.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import config
+import pipeline
+from audio_processing import probe_duration
+from renditions import parse_heights, list_renditions
+from transcription import warm_up_whisper_model, set_torch_threads
+
+def _is_media_file(path):
+    ext = os.path.splitext(path)[1].lower()
+    return ext in config.VIDEO_EXTENSIONS or ext in config.AUDIO_EXTENSIONS
+
+def _manifest_path(base_dir, path, input_root):
+    """A manifest entry as an absolute path; relative entries are relative to the manifest."""
+    path = os.path.abspath(os.path.join(base_dir, path))
+    if input_root and os.path.commonpath([input_root, path]) != input_root:
+        raise ValueError(f"Manifest entry '{path}' is outside {input_root}.")
+    return path
+
+def load_entries(source, defaults, input_root=None):
+    """
+    Builds batch entries from a directory (all supported media files, recursively)
+    or a manifest file. Each entry is {'path', 'model', 'do_separate_vocals',
+    'do_wipe_text', 'render_video', 'render_engine', 'render_workers',
+    'smart_render', 'renditions'}. With input_root, a manifest entry outside
+    that directory raises ValueError, as does an invalid manifest entry.
+    """
+    input_root = os.path.abspath(input_root) if input_root else None
+    raw_entries = []
+    if os.path.isdir(source):
+        for dirpath, _, filenames in os.walk(source):
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if _is_media_file(path):
+                    raw_entries.append({'path': path})
+    elif source.endswith('.json'):
+        with open(source, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('files', [])
+        if not isinstance(data, list):
+            raise ValueError("A JSON manifest must be a list of files or an object with a 'files' list.")
+        base_dir = os.path.dirname(os.path.abspath(source))
+        for index, item in enumerate(data):
+            item = {'path': item} if isinstance(item, str) else item
+            if not isinstance(item, dict) or not isinstance(item.get('path'), str) or not item['path']:
+                raise ValueError(f"Manifest entry {index}: expected a path or an object with a 'path'.")
+            item = dict(item, path=_manifest_path(base_dir, item['path'], input_root))
+            raw_entries.append(item)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    raw_entries.append({'path': _manifest_path(base_dir, line, input_root)})
+
+    return [_entry(index, item, defaults) for index, item in enumerate(raw_entries)]
+
+def _entry(index, item, defaults):
+    """One batch entry from a manifest item and the defaults; raises ValueError naming the bad entry."""
+    model = item.get('model', defaults.get('model', config.WHISPER_MODEL))
+    if not isinstance(model, str) or not model:
+        raise ValueError(f"Manifest entry {index}: 'model' must be a model name.")
+    render_engine = item.get('render_engine', defaults.get('render_engine', config.RENDER_ENGINE))
+    if render_engine not in config.RENDER_ENGINES:
+        raise ValueError(f"Manifest entry {index}: unknown render_engine '{render_engine}' "
+                         f"(expected one of {', '.join(config.RENDER_ENGINES)}).")
+    try:
+        render_workers = int(item.get('render_workers', defaults.get('render_workers', 0)))
+    except (TypeError, ValueError):
+        render_workers = -1
+    if render_workers < 0:
+        raise ValueError(f"Manifest entry {index}: 'render_workers' must be a non-negative integer.")
+    heights = item.get('renditions', defaults.get('renditions', config.RENDITIONS))
+    if isinstance(heights, str): # "720,480", as in the upload form
+        heights = parse_heights(heights)
+    if not isinstance(heights, (list, tuple)) or not all(isinstance(h, int) and not isinstance(h, bool) for h in heights):
+        raise ValueError(f"Manifest entry {index}: 'renditions' must be a list of heights or a string like '720,480'.")
+    return {
+        'path': item['path'],
+        'model': model,
+        'do_separate_vocals': bool(item.get('separate_vocals', defaults.get('do_separate_vocals', False))),
+        'do_wipe_text': bool(item.get('wipe_text', defaults.get('do_wipe_text', False))),
+        'render_video': bool(item.get('render_video', defaults.get('render_video', True))),
+        'render_engine': render_engine,
+        'render_workers': render_workers,
+        'smart_render': bool(item.get('smart_render', defaults.get('smart_render', config.SMART_RENDER))),
+        'renditions': list(heights),
+    }
+
+def entry_options(entry, batch_size=None):
+    """Pipeline options for one batch entry."""
+    return {
+        'model': entry['model'],
+        'do_separate_vocals': entry['do_separate_vocals'],
+        'do_wipe_text': entry['do_wipe_text'],
+        'render_video': entry['render_video'],
+        'is_video': os.path.splitext(entry['path'])[1].lower() in config.VIDEO_EXTENSIONS,
+        'batch_size': batch_size or None,
+        'render_engine': entry['render_engine'],
+        'parallel_render': entry['render_workers'] > 1,
+        'render_workers': entry['render_workers'] or None,
+        'smart_render': entry['smart_render'],
+        'renditions': entry['renditions'],
+    }
+
+def group_entries(entries):
+    """Groups entries sharing model and options so each model is loaded once and reused."""
+    groups = {}
+    for entry in entries:
+        key = (entry['model'], entry['do_separate_vocals'], entry['do_wipe_text'], entry['render_video'])
+        groups.setdefault(key, []).append(entry)
+    return groups
+
+
+def run_batch(entries, output_dir, log_callback=print, batch_size=None):
+    """
+    Runs the pipeline over every entry, one options group at a time, writing a
+    video (unless render_video is off) and a transcript per file.
+    Returns a report dict with per-file timings and throughput; also saved as
+    batch_report.json in output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    batch_size = config.BATCH_DECODER_BATCH_SIZE if batch_size is None else batch_size
+    batch_start = time.time()
+    results = []
+
+    used_names = set()
+    groups = group_entries(entries)
+    log_callback(f"Batch: {len(entries)} files in {len(groups)} option groups.")
+    for (model_name, do_separate_vocals, do_wipe_text, render_video), group in groups.items():
+        log_callback(f"Batch: group model={model_name} separate_vocals={do_separate_vocals} "
+                     f"wipe_text={do_wipe_text} render_video={render_video} ({len(group)} files)")
+        # Keep the model resident for the whole group
+        warm_up_whisper_model(model_name, log_callback)
+
+        for entry in group:
+            input_path = entry['path']
+            base_name = os.path.splitext(os.path.basename(input_path))[0]
+            unique_name, n = base_name, 1
+            while unique_name in used_names: # Same file name in different folders
+                n += 1
+                unique_name = f"{base_name}_{n}"
+            used_names.add(unique_name)
+            base_name = unique_name
+            output_path = os.path.join(output_dir, f"{base_name}_lyrics.mp4")
+            transcript_path = os.path.join(output_dir, f"{base_name}_transcript.txt")
+            options = entry_options(entry, batch_size)
+            duration = probe_duration(input_path)
+            record = {'path': input_path, 'model': model_name, 'duration': duration, 'status': 'failed'}
+            file_start = time.time()
+            try:
+                segments = pipeline.run_pipeline(input_path, output_path, options, log_callback,
+                                                 task_id=f"batch_{uuid.uuid4().hex[:12]}", keep_checkpoint=False)
+                pipeline.write_transcript(segments, transcript_path)
+                record.update({
+                    'status': 'complete',
+                    'segments': len(segments),
+                    'transcript': transcript_path,
+                    'video': output_path if render_video else None,
+                    'renditions': [r['filename'] for r in list_renditions(output_path)] if render_video else [],
+                })
+            except Exception as e:
+                record['error'] = str(e)
+                log_callback(f"Batch: FAILED {input_path}: {e}")
+            elapsed = time.time() - file_start
+            record['seconds'] = round(elapsed, 2)
+            if duration:
+                # Seconds of media processed per wall-clock second
+                record['throughput'] = round(duration / elapsed, 3) if elapsed > 0 else None
+            results.append(record)
+            log_callback(f"Batch: {record['status']} {os.path.basename(input_path)} in {elapsed:.1f}s"
+                         + (f" ({record['throughput']}x real time)" if record.get('throughput') else ""))
+
+    total_seconds = time.time() - batch_start
+    total_media = sum(r['duration'] or 0 for r in results)
+    report = {
+        'files': results,
+        'total_files': len(results),
+        'completed': sum(1 for r in results if r['status'] == 'complete'),
+        'failed': sum(1 for r in results if r['status'] != 'complete'),
+        'total_seconds': round(total_seconds, 2),
+        'total_media_seconds': round(total_media, 2),
+        'throughput': round(total_media / total_seconds, 3) if total_seconds > 0 else None,
+    }
+    with open(os.path.join(output_dir, 'batch_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def print_report(report):
+    print(f"\n{'file':<40} {'status':<9} {'media s':>8} {'wall s':>8} {'x RT':>6}")
+    for r in report['files']:
+        name = os.path.basename(r['path'])[:40]
+        media = f"{r['duration']:.1f}" if r['duration'] else "?"
+        speed = f"{r['throughput']:.2f}" if r.get('throughput') else "-"
+        print(f"{name:<40} {r['status']:<9} {media:>8} {r['seconds']:>8.1f} {speed:>6}")
+    print(f"\n{report['completed']}/{report['total_files']} files completed in {report['total_seconds']:.1f}s "
+          f"({report['total_media_seconds']:.1f}s of media, {report['throughput'] or 0:.2f}x real time)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of media files or a manifest (.json or .txt)")
+    parser.add_argument("--output-dir", default=config.BATCH_OUTPUT_DIR)
+    parser.add_argument("--model", default=config.WHISPER_MODEL)
+    parser.add_argument("--separate-vocals", action="store_true")
+    parser.add_argument("--wipe-text", action="store_true")
+    parser.add_argument("--transcripts-only", action="store_true", help="Skip video rendering")
+    parser.add_argument("--render-engine", choices=config.RENDER_ENGINES, default=config.RENDER_ENGINE)
+    parser.add_argument("--render-workers", type=int, default=0, help="Segment-parallel render processes (0/1 = off)")
+    parser.add_argument("--smart-render", action="store_true", help="Re-encode only lyric ranges of video inputs")
+    parser.add_argument("--renditions", type=parse_heights, default=list(config.RENDITIONS),
+                        help="Output heights, e.g. 1080,720,480 (default: one output at config.RENDER_HEIGHT)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Decoder batch size (backends that support it)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    defaults = {
+        'model': args.model,
+        'do_separate_vocals': args.separate_vocals,
+        'do_wipe_text': args.wipe_text,
+        'render_video': not args.transcripts_only,
+        'render_engine': args.render_engine,
+        'render_workers': args.render_workers,
+        'smart_render': args.smart_render,
+        'renditions': args.renditions,
+    }
+    try:
+        batch_entries = load_entries(args.source, defaults)
+    except ValueError as e:
+        print(f"Invalid manifest {args.source}: {e}")
+        sys.exit(1)
+    if not batch_entries:
+        print(f"No supported media files found in {args.source}")
+        sys.exit(1)
+    log = (lambda message: None) if args.quiet else print
+    set_torch_threads()
+    batch_report = run_batch(batch_entries, args.output_dir, log, batch_size=args.batch_size)
+    print_report(batch_report)
+    sys.exit(0 if batch_report['failed'] == 0 else 2)
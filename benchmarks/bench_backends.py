@@ -0,0 +1,81 @@
+"""
+Benchmark: real-time factor (RTF) and memory of each transcription backend.
+
+Each backend/model runs in a fresh subprocess so peak RSS is measured in isolation.
+
+Usage (from the repo root):
+    python benchmarks/bench_backends.py path/to/song.mp3 --models small.en faster-whisper:small.en
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+def _peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def run_single(input_path, model):
+    """Runs one backend in this process and prints a JSON result line."""
+    from audio_processing import extract_audio, open_audio, SAMPLE_RATE, RAW_AUDIO_SUFFIX
+    from transcription import transcribe_audio, WHISPER_MODELS, model_key
+
+    quiet = lambda message: None
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = extract_audio(input_path, os.path.join(tmp, "audio" + RAW_AUDIO_SUFFIX), quiet)
+        duration = len(open_audio(raw_path)) / SAMPLE_RATE
+        rss_before_load = _peak_rss_mb()
+
+        start = time.time()
+        WHISPER_MODELS.preload(model_key(model), quiet)
+        load_seconds = time.time() - start
+
+        start = time.time()
+        segments = transcribe_audio(raw_path, model, quiet)
+        transcribe_seconds = time.time() - start
+
+    print(json.dumps({
+        'model': model,
+        'duration': duration,
+        'load_seconds': load_seconds,
+        'transcribe_seconds': transcribe_seconds,
+        'rtf': transcribe_seconds / duration if duration else None,
+        'segments': len(segments),
+        'peak_rss_mb': _peak_rss_mb(),
+        'model_rss_mb': _peak_rss_mb() - rss_before_load,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Audio or video file to transcribe")
+    parser.add_argument("--models", nargs="+", default=["small.en", "faster-whisper:small.en"],
+                        help="Model specs, optionally prefixed with a backend (e.g. faster-whisper:small.en)")
+    parser.add_argument("--single", help=argparse.SUPPRESS) # Internal: run one model in this process
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args.input, args.single)
+        return
+
+    print(f"{'model':<28} {'load s':>8} {'RTF':>8} {'peak MB':>9} {'segments':>9}")
+    for model in args.models:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), args.input, "--single", model],
+            capture_output=True, text=True, cwd=REPO_ROOT
+        )
+        if proc.returncode != 0:
+            print(f"{model:<28} FAILED: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{r['model']:<28} {r['load_seconds']:8.2f} {r['rtf']:8.3f} {r['peak_rss_mb']:9.0f} {r['segments']:9d}")
+
+if __name__ == "__main__":
+    main()
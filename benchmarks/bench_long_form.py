@@ -0,0 +1,56 @@
+"""
+Benchmark: long-form transcription speedup vs. worker/chunk count.
+
+Usage (from the repo root):
+    python benchmarks/bench_long_form.py path/to/long_recording.mp3 --model small.en --workers 1 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_processing import extract_audio, open_audio, SAMPLE_RATE, RAW_AUDIO_SUFFIX
+from long_form import transcribe_long_form, find_chunks, start_worker_pool
+from transcription import transcribe_audio, WHISPER_MODELS, model_key
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Audio or video file to transcribe")
+    parser.add_argument("--model", default="small.en")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--chunk-seconds", type=float, default=None, help="Target chunk length (default: config)")
+    parser.add_argument("--skip-baseline", action="store_true", help="Don't run the sequential baseline")
+    args = parser.parse_args()
+
+    quiet = lambda message: None
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = extract_audio(args.input, os.path.join(tmp, "audio" + RAW_AUDIO_SUFFIX), print)
+        if not raw_path:
+            sys.exit(1)
+        duration = len(open_audio(raw_path)) / SAMPLE_RATE
+        chunks = find_chunks(open_audio(raw_path), SAMPLE_RATE, chunk_seconds=args.chunk_seconds)
+        print(f"Input: {duration:.1f}s of audio, {len(chunks)} chunks")
+
+        # Load once so model load time is excluded from every measurement
+        WHISPER_MODELS.preload(model_key(args.model), quiet)
+
+        baseline = None
+        if not args.skip_baseline:
+            start = time.time()
+            segments = transcribe_audio(raw_path, args.model, quiet)
+            baseline = time.time() - start
+            print(f"{'sequential':>12}: {baseline:8.2f}s  RTF={baseline / duration:.3f}  segments={len(segments)}")
+
+        for workers in args.workers:
+            start_worker_pool(args.model, workers, quiet) # Worker model loads are excluded too
+            start = time.time()
+            segments = transcribe_long_form(raw_path, args.model, quiet, workers=workers, chunk_seconds=args.chunk_seconds)
+            elapsed = time.time() - start
+            speedup = f"  speedup={baseline / elapsed:.2f}x" if baseline else ""
+            print(f"{workers:>4} workers: {elapsed:8.2f}s  RTF={elapsed / duration:.3f}  segments={len(segments)}{speedup}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark: segment-parallel MoviePy rendering vs. worker count.
+
+Renders the same segments in one process, then with the parallel renderer
+at each worker count, and reports wall time and speedup.
+
+Usage (from the repo root):
+    python benchmarks/bench_parallel_render.py path/to/video.mp4 --segments segments.json --workers 1 2 4 8 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from parallel_render import render_parallel
+from video_processing import generate_phrase_video, generate_karaoke_video
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Audio or video file")
+    parser.add_argument("--segments", required=True, help="JSON file with transcript segments")
+    parser.add_argument("--karaoke", action="store_true", help="Render karaoke (wipe) text")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--skip-baseline", action="store_true", help="Don't run the single-process render")
+    args = parser.parse_args()
+
+    with open(args.segments, 'r', encoding='utf-8') as f:
+        segments = json.load(f)
+    is_video = os.path.splitext(args.input)[1].lower() in config.VIDEO_EXTENSIONS
+    config.PARALLEL_RENDER_MIN_SECONDS = 0 # Split even short test clips
+    quiet = lambda message: None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        if not args.skip_baseline:
+            generate = generate_karaoke_video if args.karaoke else generate_phrase_video
+            start = time.time()
+            generate(args.input, json.loads(json.dumps(segments)), os.path.join(tmp, "serial.mp4"), is_video,
+                     quiet, audio_path_override=args.input, work_dir=tmp)
+            baseline = time.time() - start
+            print(f"{'serial':>12}: {baseline:8.2f}s")
+
+        for workers in args.workers:
+            work_dir = os.path.join(tmp, f"w{workers}")
+            os.makedirs(work_dir)
+            start = time.time()
+            chunks = render_parallel(args.input, segments, os.path.join(tmp, f"parallel_{workers}.mp4"), is_video,
+                                     args.karaoke, quiet, audio_path_override=args.input, work_dir=work_dir,
+                                     workers=workers, min_chunks=1)
+            elapsed = time.time() - start
+            speedup = f"  speedup={baseline / elapsed:.2f}x" if baseline else ""
+            print(f"{workers:>4} workers: {elapsed:8.2f}s  chunks={chunks}{speedup}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: time-to-first-frame of the text layer, glyph atlas vs. ImageMagick TextClip.
+
+Builds the text clips for N lyric lines the way the video generators do
+(phrase captions, or karaoke base + highlight labels), composites them and
+renders the first frame.
+
+Usage (from the repo root):
+    python benchmarks/bench_text_render.py --lines 60 --mode karaoke
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import moviepy.editor as mp
+import config
+import video_processing
+
+SAMPLE_LINES = [
+    "I've been walking down this empty road tonight",
+    "Every light is fading but the stars are shining bright",
+    "Hold on, hold on, we're almost home",
+    "Singing out the words to every song we've known",
+]
+
+def build_clips(n_lines, mode, media_size):
+    clips = []
+    for i in range(n_lines):
+        text = SAMPLE_LINES[i % len(SAMPLE_LINES)]
+        if mode == "phrase":
+            clips.append(video_processing.make_text_clip(
+                text, fontsize=int(media_size[0] * config.RELATIVE_FONT_SIZE), font=config.FONT_FAMILY,
+                color=config.FONT_COLOR, bg_color=config.FONT_BACKGROUND, box_width=media_size[0] * 0.9
+            ).set_start(i * 4).set_duration(4).set_position('center'))
+        else:
+            size = int(media_size[0] * 0.04)
+            clips.append(video_processing.make_text_clip(text, size, config.KARAOKE_FONT, config.BG_COLOR)
+                         .set_start(i * 4).set_duration(4).set_position('center'))
+            clips.append(video_processing.make_text_clip(text, size, config.KARAOKE_FONT, config.FONT_COLOR, bg_color=config.FONT_BACKGROUND)
+                         .set_start(i * 4).set_duration(4).set_position('center'))
+    return clips
+
+def run(renderer, n_lines, mode, media_size=(1280, 720)):
+    config.TEXT_RENDERER = renderer
+    start = time.time()
+    clips = build_clips(n_lines, mode, media_size)
+    built = time.time() - start
+    base = mp.ColorClip(size=media_size, color=[0, 0, 0], duration=n_lines * 4)
+    final_clip = mp.CompositeVideoClip([base] + clips, size=media_size)
+    final_clip.get_frame(0)
+    first_frame = time.time() - start
+    final_clip.close()
+    return built, first_frame, len(clips)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=60, help="Number of lyric lines (a 4-minute song has ~60)")
+    parser.add_argument("--mode", choices=["phrase", "karaoke"], default="karaoke")
+    parser.add_argument("--renderers", nargs="+", default=["atlas", "imagemagick"])
+    args = parser.parse_args()
+
+    print(f"{'renderer':<12} {'clips':>6} {'build s':>9} {'first frame s':>14}")
+    for renderer in args.renderers:
+        try:
+            built, first_frame, n_clips = run(renderer, args.lines, args.mode)
+            print(f"{renderer:<12} {n_clips:>6} {built:>9.3f} {first_frame:>14.3f}")
+        except Exception as e:
+            print(f"{renderer:<12} FAILED: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Parity check and timing: MoviePy render engine vs. the ffmpeg/ASS engine.
+
+Renders the same segments with both engines, then compares duration, frame
+size and the PSNR of frames sampled at segment midpoints (where subtitles
+are on screen). Segments come from a JSON file (a list of segment dicts,
+e.g. saved from pipeline.run_pipeline) or are transcribed first.
+
+Usage (from the repo root):
+    python benchmarks/check_render_parity.py path/to/song.mp3 --segments segments.json --karaoke
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from ffmpeg_render import render_with_ffmpeg, probe_media
+from video_processing import generate_phrase_video, generate_karaoke_video
+
+def grab_frame(video_path, t, size):
+    """One RGB frame at time t as a float array (h, w, 3)."""
+    raw = subprocess.run(
+        ["ffmpeg", "-v", "error", "-ss", f"{t:.3f}", "-i", video_path, "-frames:v", "1",
+         "-s", f"{size[0]}x{size[1]}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        capture_output=True, check=True
+    ).stdout
+    return np.frombuffer(raw, dtype=np.uint8).reshape(size[1], size[0], 3).astype(np.float64)
+
+def psnr(a, b):
+    mse = np.mean((a - b) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def load_segments(args):
+    if args.segments:
+        with open(args.segments, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    import pipeline
+    options = {'model': args.model, 'do_wipe_text': args.karaoke, 'render_video': False,
+               'is_video': os.path.splitext(args.input)[1].lower() in config.VIDEO_EXTENSIONS}
+    return pipeline.run_pipeline(args.input, os.devnull, options, lambda message: None)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Audio or video file")
+    parser.add_argument("--segments", help="JSON file with transcript segments (default: transcribe the input)")
+    parser.add_argument("--model", default="small.en", help="Model used when transcribing")
+    parser.add_argument("--karaoke", action="store_true", help="Compare karaoke (wipe) rendering")
+    parser.add_argument("--samples", type=int, default=10, help="Frames compared")
+    parser.add_argument("--min-psnr", type=float, default=25.0, help="Exit non-zero below this mean PSNR (dB)")
+    args = parser.parse_args()
+
+    segments = load_segments(args)
+    is_video = os.path.splitext(args.input)[1].lower() in config.VIDEO_EXTENSIONS
+    quiet = lambda message: None
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs, timings = {}, {}
+        for engine in ("moviepy", "ffmpeg"):
+            work_dir = os.path.join(tmp, engine)
+            os.makedirs(work_dir)
+            output = os.path.join(tmp, f"{engine}.mp4")
+            kwargs = dict(input_path=args.input, segments=json.loads(json.dumps(segments)),
+                          output_filename=output, is_video_input=is_video, log_callback=quiet,
+                          audio_path_override=args.input, work_dir=work_dir)
+            start = time.time()
+            if engine == "ffmpeg":
+                render_with_ffmpeg(do_wipe_text=args.karaoke, **kwargs)
+            elif args.karaoke:
+                generate_karaoke_video(**kwargs)
+            else:
+                generate_phrase_video(**kwargs)
+            timings[engine] = time.time() - start
+            outputs[engine] = output
+
+        info = {engine: probe_media(path) or {} for engine, path in outputs.items()}
+        print(f"{'engine':<8} {'render s':>9} {'duration':>9} {'size':>11}")
+        for engine in outputs:
+            size = f"{info[engine].get('width')}x{info[engine].get('height')}"
+            print(f"{engine:<8} {timings[engine]:9.2f} {info[engine].get('duration') or 0:9.2f} {size:>11}")
+        print(f"speedup: {timings['moviepy'] / timings['ffmpeg']:.1f}x")
+
+        size = (info['moviepy']['width'], info['moviepy']['height'])
+        if size != (info['ffmpeg'].get('width'), info['ffmpeg'].get('height')):
+            print("FAIL: frame sizes differ")
+            sys.exit(1)
+        duration_gap = abs((info['moviepy'].get('duration') or 0) - (info['ffmpeg'].get('duration') or 0))
+        midpoints = [(s['start'] + s['end']) / 2 for s in segments if s.get('text', '').strip()]
+        picks = [midpoints[int(i)] for i in np.linspace(0, len(midpoints) - 1, min(args.samples, len(midpoints)))] if midpoints else []
+        scores = [psnr(grab_frame(outputs['moviepy'], t, size), grab_frame(outputs['ffmpeg'], t, size)) for t in picks]
+        mean_psnr = float(np.mean([min(s, 99.0) for s in scores])) if scores else float('inf')
+        print(f"duration gap: {duration_gap:.3f}s, mean PSNR over {len(scores)} frames: {mean_psnr:.1f} dB")
+        ok = duration_gap <= 0.1 and mean_psnr >= args.min_psnr
+        print("PASS" if ok else "FAIL")
+        sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Check: the start order JobScheduler predicts (queue positions, cost ahead,
+ETAs) against the order its workers actually start jobs in.
+
+Jobs block until the end of the check, so every started job keeps counting
+as running for its owner. Waiting jobs are queued while the scheduler's lock
+is held, the predicted order is read, then the workers start them.
+
+Usage (from the repo root):
+    python benchmarks/check_scheduler_order.py --policy fair
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobScheduler
+
+# (already running, waiting in submission order) as (task_id, owner, cost)
+SCENARIOS = [
+    ([('b0', 'b', 10)], [('a1', 'a', 10), ('a2', 'a', 10), ('a3', 'a', 10), ('b1', 'b', 10), ('b2', 'b', 10)]),
+    ([], [('a1', 'a', 30), ('a2', 'a', 10), ('b1', 'b', 20), ('c1', 'c', 5), ('b2', 'b', 40), ('a3', 'a', 15)]),
+    ([('a0', 'a', 10), ('a00', 'a', 10)], [('a1', 'a', 10), ('b1', 'b', 10), ('c1', 'c', 10), ('b2', 'b', 10)]),
+]
+
+def wait_running(scheduler, count, timeout=5.0):
+    deadline = time.time() + timeout
+    while scheduler.stats()['running'] < count:
+        if time.time() > deadline:
+            raise RuntimeError(f"Only {scheduler.stats()['running']} of {count} jobs started.")
+        time.sleep(0.01)
+
+def run_scenario(policy, running, waiting):
+    """(predicted start order, actual start order) of the waiting jobs."""
+    release = threading.Event()
+    scheduler = JobScheduler(len(running) + len(waiting), len(waiting), policy=policy)
+    for task_id, owner, cost in running:
+        scheduler.submit(task_id, release.wait, cost=cost, owner=owner)
+        wait_running(scheduler, len(scheduler._running) + 1)
+    with scheduler._cond:
+        for task_id, owner, cost in waiting:
+            scheduler.submit(task_id, release.wait, cost=cost, owner=owner)
+        predicted = [job['task_id'] for job in scheduler._order()]
+    wait_running(scheduler, len(running) + len(waiting))
+    with scheduler._cond:
+        actual = list(scheduler._running)[len(running):] # Insertion order = start order
+    release.set()
+    return predicted, actual
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policy", choices=JobScheduler.POLICIES, nargs='+', default=list(JobScheduler.POLICIES))
+    args = parser.parse_args()
+
+    ok = True
+    for policy in args.policy:
+        for running, waiting in SCENARIOS:
+            predicted, actual = run_scenario(policy, running, waiting)
+            match = predicted == actual
+            ok = ok and match
+            print(f"{policy:<5} running={[r[0] for r in running]} predicted={predicted} actual={actual} "
+                  f"{'ok' if match else 'MISMATCH'}")
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
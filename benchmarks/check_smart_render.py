@@ -0,0 +1,107 @@
+"""
+Parity check and timing: smart render (stream-copied lyric-free ranges) vs.
+rendering the whole timeline with the MoviePy engine.
+
+Renders the same video input both ways, then checks that the smart render
+output decodes without errors, and compares duration, frame count and the
+PSNR of frames sampled inside the copied and the re-encoded ranges. Segments
+come from a JSON file (a list of segment dicts, e.g. saved from
+pipeline.run_pipeline) or are transcribed first.
+
+Usage (from the repo root):
+    python benchmarks/check_smart_render.py path/to/video.mp4 --segments segments.json --karaoke
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from ffmpeg_render import probe_media
+from smart_render import render_smart, plan_ranges, idr_times
+from video_processing import generate_phrase_video, generate_karaoke_video
+from check_render_parity import grab_frame, psnr, load_segments
+
+def decode_errors(video_path):
+    """ffmpeg's error output for a full decode of the video track (empty if it decodes cleanly)."""
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", video_path, "-map", "0:v:0", "-f", "null", "-"],
+                            capture_output=True, text=True)
+    return result.stderr.strip() or ("" if result.returncode == 0 else f"exit code {result.returncode}")
+
+def frame_count(video_path):
+    result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                             "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", video_path],
+                            capture_output=True, text=True)
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="H.264 video file")
+    parser.add_argument("--segments", help="JSON file with transcript segments (default: transcribe the input)")
+    parser.add_argument("--model", default="small.en", help="Model used when transcribing")
+    parser.add_argument("--karaoke", action="store_true", help="Compare karaoke (wipe) rendering")
+    parser.add_argument("--samples", type=int, default=10, help="Frames compared per range kind")
+    parser.add_argument("--min-psnr", type=float, default=30.0, help="Exit non-zero below this mean PSNR (dB)")
+    args = parser.parse_args()
+
+    segments = load_segments(args)
+    info = probe_media(args.input) or {}
+    if not info.get('fps'):
+        print("FAIL: could not probe the input")
+        sys.exit(1)
+    config.VIDEO_FPS = info['fps'] # Smart render keeps the input's frame rate; render the reference at it too
+    quiet = lambda message: None
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs, timings = {}, {}
+        for mode in ("full", "smart"):
+            work_dir = os.path.join(tmp, mode)
+            os.makedirs(work_dir)
+            output = os.path.join(tmp, f"{mode}.mp4")
+            start = time.time()
+            if mode == "smart":
+                if not render_smart(args.input, json.loads(json.dumps(segments)), output, args.karaoke,
+                                    log_callback=print, audio_path_override=args.input, work_dir=work_dir):
+                    print("SKIP: input not eligible for smart render (see log above)")
+                    sys.exit(2)
+            else:
+                generate = generate_karaoke_video if args.karaoke else generate_phrase_video
+                generate(args.input, json.loads(json.dumps(segments)), output, True, quiet,
+                         audio_path_override=args.input, work_dir=work_dir)
+            timings[mode] = time.time() - start
+            outputs[mode] = output
+
+        errors = decode_errors(outputs['smart'])
+        frames = {mode: frame_count(path) for mode, path in outputs.items()}
+        durations = {mode: (probe_media(path) or {}).get('duration') or 0 for mode, path in outputs.items()}
+        print(f"{'mode':<6} {'render s':>9} {'duration':>9} {'frames':>7}")
+        for mode in outputs:
+            print(f"{mode:<6} {timings[mode]:9.2f} {durations[mode]:9.2f} {frames[mode] or 0:>7}")
+        print(f"speedup: {timings['full'] / timings['smart']:.1f}x")
+
+        size = (info['width'], info['height'])
+        pieces = plan_ranges(segments, idr_times(args.input), info['duration'])
+        ok = not errors and abs(durations['full'] - durations['smart']) <= 0.1 and frames['full'] == frames['smart']
+        if errors:
+            print(f"decode errors in the smart render output:\n{errors}")
+        for kind in ('copy', 'render'):
+            midpoints = [(start + end) / 2 for piece_kind, start, end in pieces if piece_kind == kind]
+            picks = [midpoints[int(i)] for i in np.linspace(0, len(midpoints) - 1, min(args.samples, len(midpoints)))] if midpoints else []
+            scores = [psnr(grab_frame(outputs['full'], t, size), grab_frame(outputs['smart'], t, size)) for t in picks]
+            mean_psnr = float(np.mean([min(s, 99.0) for s in scores])) if scores else float('inf')
+            print(f"{kind:>6} ranges: mean PSNR over {len(scores)} frames: {mean_psnr:.1f} dB")
+            ok = ok and mean_psnr >= args.min_psnr
+        print("PASS" if ok else "FAIL")
+        sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,114 @@
 # -- Directories --
 UPLOADS_DIR = "uploads"
 OUTPUTS_DIR = "outputs"
-DEMUCS_OUTPUT_DIR = "temp_demucs_output" # For cleaning up Demucs temp files
+SCRATCH_DIR = None # Base for per-task scratch directories (None = tmpfs if available, else system temp)
+USE_TMPFS_SCRATCH = True # Prefer /dev/shm for scratch files when SCRATCH_DIR is None
+RESULT_CACHE_DIR = "cache" # Content-addressed cache of intermediate artifacts
+TASKS_DIR = "tasks" # Per-task stage checkpoints, kept after a failure so the task can be retried
+TASK_DB_PATH = "tasks/task_store.db" # SQLite task store (status, logs, retry info)
 
 # -- Whisper Options --
 WHISPER_MODEL = "medium.en" # Default model
+WHISPER_MODEL_MEMORY_BUDGET_MB = 4096 # Max memory for cached Whisper models (LRU eviction beyond this)
+WARMUP_WHISPER_MODEL = True # Load WHISPER_MODEL in the background at app startup
+# Backend used when the model name has no "backend:" prefix: "whisper" or "faster-whisper"
+TRANSCRIPTION_BACKEND = "whisper"
+FASTER_WHISPER_COMPUTE_TYPE = "int8" # CTranslate2 quantization on CPU
+FASTER_WHISPER_CPU_THREADS = 0 # 0 = CTranslate2 default
+
+# -- Vocal Separation (Demucs) --
+DEMUCS_MODEL = "htdemucs_ft"
+DEMUCS_IN_PROCESS = True # Keep the model loaded in this process instead of running `python -m demucs.separate`
+DEMUCS_SEGMENT = None # Split length in seconds for the in-process engine (None = model default)
+DEMUCS_OVERLAP = 0.25 # Overlap between split segments
+# torch CPU threads for the whole process (Demucs, Whisper and alignment share one pool), set once at
+# startup; 0 = torch default. Long-form transcription workers size their own.
+TORCH_THREADS = 0
+
+# -- Long-form Transcription --
+# Recordings longer than LONG_FORM_MIN_SECONDS are split at silences and the
+# chunks transcribed in parallel worker processes
+LONG_FORM_ENABLED = True
+LONG_FORM_MIN_SECONDS = 600
+LONG_FORM_CHUNK_SECONDS = 120 # Target chunk length
+LONG_FORM_SILENCE_SEARCH_SECONDS = 15 # Look this far around each target boundary for the quietest cut point
+LONG_FORM_WORKERS = 0 # Worker processes (0 = a quarter of the CPU cores)
+# Start the worker pool with WHISPER_MODEL loaded at app startup instead of on the first long recording.
+# Each worker holds its own copy of the model; the pool is capped to fit WHISPER_MODEL_MEMORY_BUDGET_MB.
+WARMUP_LONG_FORM_POOL = False
+
+# -- Alignment Options --
+ALIGN_MODEL_CACHE_SIZE = 3 # Max number of per-language WhisperX alignment models kept loaded
+PRELOAD_ALIGN_LANGUAGES = ['en'] # Alignment models loaded at app startup (empty list to disable)
 
 # <<< FIX: Add back allowed file extensions >>>
 VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv']
 AUDIO_EXTENSIONS = ['.mp3', '.wav', '.m4a', '.flac'] # Ensure .flac has the dot
 
+# -- Job Scheduling --
+MAX_PIPELINE_WORKERS = 4 # Jobs allowed to run at the same time
+MAX_QUEUED_JOBS = 20 # Uploads beyond this are rejected with HTTP 429
+# Concurrency per stage class among running jobs:
+# 'transcription' covers Demucs, Whisper and alignment; 'encoding' covers video rendering
+STAGE_CONCURRENCY = {'transcription': 1, 'encoding': 2}
+# Order of waiting jobs: 'fifo', 'sjf' (shortest predicted run time first) or 'fair' (clients take turns)
+SCHEDULING_POLICY = "fifo"
+SCHEDULER_AGING = 1.0 # sjf: a waiting job's predicted cost drops by this many seconds per second waited
+SCHEDULER_UNKNOWN_COST = 300 # sjf: predicted seconds for jobs without a prediction (e.g. batches)
+STATUS_HEARTBEAT_SECONDS = 15 # Keep-alive interval for idle /events/<task_id> streams
+STATUS_POLL_SECONDS = 1.0 # How often /events streams re-read a shared (SQLite) store for changes from other workers
+
+# -- Run-time Prediction --
+STAGE_HISTORY_PATH = "tasks/stage_history.db" # Stage timings used for ETAs and sjf scheduling
+STAGE_HISTORY_SIZE = 50 # Newest samples per stage variant used for a prediction
+# Seconds of processing per second of media for stages with no history yet
+STAGE_DEFAULT_RATES = {'extract': 0.02, 'separate': 1.0, 'transcribe': 0.5, 'align': 0.1, 'render': 1.0}
+
+# -- Profiling --
+RSS_SAMPLE_SECONDS = 0.25 # Sampling interval for per-stage peak memory (see metrics.py)
+
+# -- Task Store --
+TASK_STORE = "sqlite" # 'sqlite' (persistent across restarts) or 'memory'
+# Held by the serving process: the job queue is in its memory, so the app runs as one process (threads for concurrency)
+SERVER_LOCK_PATH = "tasks/server.lock"
+TASK_TTL_SECONDS = 24 * 3600 # Finished tasks are removed this long after their last update
+TASK_EXPIRY_INTERVAL_SECONDS = 300 # Minimum time between expiry sweeps
+TASK_LOG_MAX_LINES = 2000 # Only the newest log lines of a task are kept
+
+# -- Upload Ingest --
+MAX_UPLOAD_MB = 2048 # Larger request bodies are refused before they are read
+MAX_MEDIA_SECONDS = 3600 # Uploads with a longer duration are rejected before queueing (0 = no limit)
+INGEST_PROBE_BYTES = 2 * 1024 * 1024 # Probe a partial upload once this much of it has arrived
+
+# -- Batch Processing --
+BATCH_OUTPUT_DIR = "outputs/batch" # Default output directory for batch runs
+BATCH_INPUT_ROOT = "batch_inputs" # /batch may only read directories/manifests under this folder
+BATCH_DECODER_BATCH_SIZE = 8 # Batched decoding size for backends that support it (0 = off)
+
 # -- Video Style Options --
+VIDEO_FPS = 24 # Output frame rate (also the karaoke wipe timeline resolution)
+RENDER_HEIGHT = 720 # Video inputs are downscaled to this height; audio-only inputs get a 16:9 canvas of it
+# Output renditions: the per-job 'renditions' option (list of heights) renders the tallest one
+# and scales the others from its subtitled frames (ffmpeg engine: same command; MoviePy: one extra pass)
+RENDITION_HEIGHTS = (1080, 720, 480, 360) # Heights a job may request
+RENDITIONS = [] # Default renditions; empty = a single output at RENDER_HEIGHT
+# Render engine: "moviepy" (per-frame compositing in Python) or "ffmpeg" (ASS subtitles
+# burned in by a single ffmpeg/libass call). Per-job 'render_engine' option overrides it.
+RENDER_ENGINE = "moviepy"
+RENDER_ENGINES = ("moviepy", "ffmpeg")
+# Audio-only inputs (MoviePy engine): render one still per visible-text change and
+# encode them with the concat demuxer as variable frame rate, instead of every frame
+AUDIO_ONLY_STILL_FRAMES = True
+
+# Segment-parallel rendering (MoviePy engine): chunks rendered by worker processes, joined without re-encoding
+PARALLEL_RENDER = False # Default for the per-job 'parallel_render' option
+PARALLEL_RENDER_WORKERS = 0 # Worker processes (0 = half the CPU cores)
+PARALLEL_RENDER_MIN_SECONDS = 60 # Shorter inputs are rendered in one piece
+# Smart render (MoviePy engine, H.264 video inputs no taller than the render height): re-encode only the ranges
+# showing lyrics and stream-copy the rest, cut at keyframes
+SMART_RENDER = False # Default for the per-job 'smart_render' option
+SMART_RENDER_MIN_COPY_FRACTION = 0.2 # Below this share of copyable video, render the whole timeline
+
 # For Phrase Video (generate_phrase_video)
 RELATIVE_FONT_SIZE = 0.045 # Relative to video width
 FONT_COLOR = 'white'
@@ -18,10 +116,39 @@ FONT_FAMILY = 'Arial-Bold'
 FONT_BACKGROUND = 'rgba(0, 0, 0, 0.6)' # Semi-transparent black
 SUBTITLE_Y_POSITION = 0.85 # Relative Y position (0.0 top, 1.0 bottom)
 
+# Text rasterizer: "atlas" (Pillow/FreeType glyph cache) or "imagemagick" (MoviePy TextClip)
+TEXT_RENDERER = "atlas"
+# Font files tried for each ImageMagick-style font name when using the atlas renderer
+FONT_FILES = {
+    'Arial-Bold': ['Arial Bold.ttf', 'arialbd.ttf', 'Arial-BoldMT.ttf', 'DejaVuSans-Bold.ttf'],
+    'Courier-Bold': ['Courier New Bold.ttf', 'courbd.ttf', 'DejaVuSansMono-Bold.ttf'],
+}
+FONT_DIRS = [
+    '/Library/Fonts', '/System/Library/Fonts/Supplemental', 'C:\\Windows\\Fonts',
+    '/usr/share/fonts/truetype/msttcorefonts', '/usr/share/fonts/truetype/dejavu',
+]
+
 # For Karaoke Video (generate_karaoke_video)
 KARAOKE_FONT = "Courier-Bold" # MUST be monospace for wipe effect
 BG_COLOR = "gray30" # Added for karaoke base text
 # Karaoke uses fixed font size defined in video_processing.py based on width
 
+# -- Video Encoding --
+# Encoders tried in order; the first one that passes the startup probe is used, libx264 is the fallback
+ENCODER_PREFERENCE = ['h264_videotoolbox', 'h264_nvenc', 'h264_qsv', 'libx264']
+ENCODER_PRESET = "fast" # x264/nvenc/qsv preset
+ENCODER_CRF = 23 # Constant quality (CRF for libx264, -cq/-global_quality for nvenc/qsv)
+ENCODER_THREADS = 0 # Threads per encode (0 = CPU cores / concurrent encodes, see STAGE_CONCURRENCY)
+
+# -- Result Cache --
+ENABLE_RESULT_CACHE = True # Reuse WAV/vocals/segments across uploads of the same file
+RESULT_CACHE_MAX_MB = 2048 # Least recently used artifacts are evicted beyond this size
+
 # -- Pipeline Options --
-REPLACE_AUDIO_WITH_VOCALS = True # If True, use separated vocals in final video (requires --separate-vocals)
\ No newline at end of file
+REPLACE_AUDIO_WITH_VOCALS = True # If True, use separated vocals in final video (requires --separate-vocals)
+# Speculative separation: transcribe the original mix while Demucs runs, then
+# re-transcribe only low-confidence segments on the separated vocals
+SPECULATIVE_SEPARATION = False # Default for the 'speculative_separation' form field
+SPECULATIVE_MIN_AVG_LOGPROB = -1.0 # Segments below this avg_logprob are re-transcribed
+SPECULATIVE_MAX_NO_SPEECH_PROB = 0.6 # Segments above this no_speech_prob are re-transcribed
+SPECULATIVE_MAX_RETRANSCRIBE_FRACTION = 0.5 # Above this share of low-confidence segments, redo the full vocal track
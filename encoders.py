@@ -0,0 +1,128 @@
+"""
+H.264 encoder discovery and selection.
+
+The ffmpeg build is probed once for usable encoders (hardware encoders get a
+one-frame test encode, since being compiled in doesn't mean the device is
+there), and the selection policy picks the first usable encoder from
+config.ENCODER_PREFERENCE with threads sized to the cores per concurrent encode.
+"""
+import os
+import time
+import threading
+import subprocess
+from functools import lru_cache
+import config
+from metrics import record_encode
+
+SOFTWARE_ENCODER = "libx264"
+# Quality flag per encoder: CRF for x264, the closest constant-quality knob for the others
+QUALITY_FLAGS = {
+    'libx264': '-crf',
+    'h264_nvenc': '-cq',
+    'h264_qsv': '-global_quality',
+}
+
+_probe_lock = threading.Lock()
+_usable_encoders = None
+
+def _listed_encoders():
+    """Names of the video encoders compiled into ffmpeg."""
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, check=True)
+    except (subprocess.CalledProcessError, OSError):
+        return set()
+    names = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # Encoder lines look like ' V....D libx264   description'
+        if len(parts) >= 2 and parts[0].startswith('V') and len(parts[0]) == 6:
+            names.add(parts[1])
+    return names
+
+def _test_encode(codec):
+    """True if a one-frame encode works, i.e. the encoder's device/driver is present."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+             "-frames:v", "1", "-pix_fmt", "yuv420p", "-c:v", codec, "-f", "null", "-"],
+            capture_output=True, timeout=30
+        )
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, OSError):
+        return False
+
+def probe_encoders(log_callback=print):
+    """Returns the usable encoders from config.ENCODER_PREFERENCE (probed once, then cached)."""
+    global _usable_encoders
+    with _probe_lock:
+        if _usable_encoders is None:
+            start = time.time()
+            listed = _listed_encoders()
+            usable = []
+            for codec in config.ENCODER_PREFERENCE:
+                if codec not in listed:
+                    continue
+                if codec == SOFTWARE_ENCODER or _test_encode(codec):
+                    usable.append(codec)
+            _usable_encoders = usable
+            log_callback(f"Encoder probe: usable {usable or 'none'} (of {len(listed)} listed) in {time.time() - start:.2f}s")
+        return list(_usable_encoders)
+
+def encoder_threads(concurrent_jobs=None):
+    """Threads per encode: the cores shared among the encodes allowed to run at once."""
+    if config.ENCODER_THREADS:
+        return config.ENCODER_THREADS
+    if concurrent_jobs is None:
+        concurrent_jobs = config.STAGE_CONCURRENCY.get('encoding') or config.MAX_PIPELINE_WORKERS
+    return max(1, (os.cpu_count() or 1) // max(1, concurrent_jobs))
+
+@lru_cache(maxsize=16)
+def _choice(codec, concurrent_jobs):
+    return {
+        'codec': codec,
+        'preset': config.ENCODER_PRESET if codec in (SOFTWARE_ENCODER, 'h264_nvenc', 'h264_qsv') else None,
+        'quality': config.ENCODER_CRF if codec in QUALITY_FLAGS else None,
+        'threads': encoder_threads(concurrent_jobs),
+    }
+
+def encoder_candidates(concurrent_jobs=None):
+    """
+    Encoder settings to try in order: the preferred usable encoder, then
+    libx264 as the fallback. Each is a dict with codec, preset, quality and threads.
+    """
+    usable = probe_encoders()
+    codecs = usable[:1] + ([SOFTWARE_ENCODER] if SOFTWARE_ENCODER not in usable[:1] else [])
+    return [_choice(codec, concurrent_jobs) for codec in codecs]
+
+def ffmpeg_args(choice):
+    """Video encoder arguments for an ffmpeg command line."""
+    args = ["-c:v", choice['codec']]
+    if choice['preset']:
+        args += ["-preset", choice['preset']]
+    flag = QUALITY_FLAGS.get(choice['codec'])
+    if flag and choice['quality'] is not None:
+        args += [flag, str(choice['quality'])]
+    return args + ["-threads", str(choice['threads'])]
+
+def moviepy_kwargs(choice):
+    """Keyword arguments for MoviePy's write_videofile."""
+    kwargs = {'codec': choice['codec'], 'threads': choice['threads']}
+    if choice['preset']:
+        kwargs['preset'] = choice['preset']
+    flag = QUALITY_FLAGS.get(choice['codec'])
+    if flag and choice['quality'] is not None:
+        kwargs['ffmpeg_params'] = [flag, str(choice['quality'])]
+    return kwargs
+
+def describe(choice):
+    parts = [choice['codec']]
+    if choice['preset']: parts.append(f"preset={choice['preset']}")
+    if choice['quality'] is not None: parts.append(f"quality={choice['quality']}")
+    parts.append(f"threads={choice['threads']}")
+    return ", ".join(parts)
+
+def log_encode_rate(log_callback, choice, frames, seconds):
+    """Logs the encoder used and the achieved encode speed, and records both as metrics."""
+    fps = frames / seconds if seconds > 0 else 0
+    record_encode(choice['codec'], frames, seconds)
+    log_callback(f"Encoded {frames} frames with {describe(choice)} in {seconds:.1f}s ({fps:.1f} fps)")
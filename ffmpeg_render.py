@@ -0,0 +1,319 @@
+"""
+Direct ffmpeg render engine: writes the lyrics as an ASS subtitle file and burns
+it in with a single ffmpeg call (libass), instead of compositing every frame in
+Python with MoviePy. Styles mirror the MoviePy generators in video_processing.py.
+"""
+import os
+import json
+import math
+import shutil
+import subprocess
+import tempfile
+import time
+import config
+from text_render import parse_color, load_font
+from encoders import encoder_candidates, ffmpeg_args, log_encode_rate
+
+ASS_FILENAME = "lyrics.ass"
+FONTS_SUBDIR = "fonts"
+# Audio codecs that can go into an .mp4 without re-encoding
+MP4_COPY_AUDIO_CODECS = {'aac', 'mp3', 'alac', 'ac3', 'eac3'}
+
+# --- Probing ---
+def probe_media(input_path):
+    """
+    Returns {'duration', 'width', 'height', 'video_codec', 'fps', 'audio_codec'}
+    from ffprobe (missing entries are None), or None if the file can't be probed.
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries",
+             "format=duration:stream=codec_type,codec_name,width,height,avg_frame_rate",
+             "-of", "json", input_path],
+            capture_output=True, text=True, check=True
+        )
+        data = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+    info = {'duration': None, 'width': None, 'height': None, 'video_codec': None, 'fps': None, 'audio_codec': None}
+    try:
+        info['duration'] = float(data.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        pass
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and info['width'] is None:
+            info['width'], info['height'] = stream.get('width'), stream.get('height')
+            info['video_codec'] = stream.get('codec_name')
+            num, _, den = (stream.get('avg_frame_rate') or '').partition('/')
+            try:
+                info['fps'] = float(num) / float(den or 1) or None
+            except (ValueError, ZeroDivisionError):
+                pass
+        elif stream.get('codec_type') == 'audio' and info['audio_codec'] is None:
+            info['audio_codec'] = stream.get('codec_name')
+    return info
+
+def canvas_size(height=None):
+    """Frame size for audio-only inputs: 16:9 at the render height (1280x720 by default)."""
+    height = height or config.RENDER_HEIGHT
+    width = int(round(height * 16 / 9))
+    return (width - width % 2, height - height % 2)
+
+def render_size(width, height, max_height=None):
+    """Output frame size: the input size, downscaled to max_height (even dimensions for x264)."""
+    max_height = max_height or config.RENDER_HEIGHT
+    if not width or not height:
+        return canvas_size(max_height)
+    if height > max_height:
+        width, height = int(round(width * max_height / height)), max_height
+    return (width - width % 2, height - height % 2)
+
+
+# --- ASS Generation ---
+def ass_color(color):
+    """Config color string -> ASS '&HAABBGGRR' (ASS alpha is inverted: 00 = opaque)."""
+    r, g, b, a = parse_color(color)
+    return f"&H{255 - a:02X}{b:02X}{g:02X}{r:02X}"
+
+def ass_timestamp(seconds):
+    centis = max(0, int(round(seconds * 100)))
+    hours, centis = divmod(centis, 360000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centis:02d}"
+
+def ass_escape(text):
+    """Keeps lyric text literal: braces start override blocks and backslashes escapes."""
+    return text.replace('\\', '\\\\').replace('{', '(').replace('}', ')').replace('\n', ' ')
+
+def resolve_font(font_name, size):
+    """(family name, bold flag, font file or None) for an ImageMagick-style font name."""
+    font = load_font(font_name, size)
+    font_path = getattr(font, 'path', None)
+    try:
+        family, style = font.getname()
+    except Exception:
+        family, style = None, ''
+    if not font_path or not family:
+        # Built-in fallback font: let libass/fontconfig pick by name instead
+        family, _, style = font_name.partition('-')
+        font_path = None
+    return family, 'bold' in (style or '').lower(), font_path
+
+def _style_line(name, font_name, size, primary, secondary, box_color, alignment, margin_h, margin_v):
+    family, bold, _ = resolve_font(font_name, size)
+    box = ass_color(box_color) if box_color else "&HFF000000"
+    outline = max(1, size // 8) if box_color else 0 # Opaque-box padding, like the atlas renderer's
+    # Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour,
+    # Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline,
+    # Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+    return (f"Style: {name},{family},{size},{ass_color(primary)},{ass_color(secondary)},{box},{box},"
+            f"{-1 if bold else 0},0,0,0,100,100,0,0,{3 if box_color else 1},{outline},0,"
+            f"{alignment},{margin_h},{margin_h},{margin_v},1")
+
+def _karaoke_text(segment, log_callback):
+    """
+    Builds '{\\k..}' karaoke text for one segment. Each word (with the text
+    before it) switches from the unsung to the sung color at the word's
+    start time, matching the stepwise wipe of the MoviePy karaoke path.
+    """
+    phrase = segment.get("text", "").strip()
+    seg_start = segment.get("start", 0)
+    seg_end = segment.get("end", seg_start + 2)
+    timings = [] # (relative start, char end index)
+    char_idx = 0
+    for w in segment.get("words", []):
+        word_text = w.get("word", "").strip()
+        if not word_text or w.get("start") is None or w.get("end") is None: continue
+        try:
+            word_start_index = phrase.index(word_text, char_idx)
+        except ValueError:
+            log_callback(f"Warning: Word '{word_text}' from alignment not found...")
+            char_idx += len(word_text) + 1
+            continue
+        char_idx = word_start_index + len(word_text)
+        timings.append((max(0, w['start'] - seg_start), char_idx))
+        if char_idx < len(phrase) and phrase[char_idx] == ' ': char_idx += 1
+    if not timings:
+        return None
+
+    # Work in cumulative centiseconds so rounding doesn't drift over long lines
+    def centis(t): return int(round(t * 100))
+    parts = [f"{{\\k{centis(timings[0][0])}}}"]
+    prev_end, prev_time = 0, centis(timings[0][0])
+    for i, (start, char_end) in enumerate(timings):
+        next_time = centis(timings[i + 1][0]) if i + 1 < len(timings) else centis(seg_end - seg_start)
+        next_time = max(next_time, prev_time)
+        parts.append(f"{{\\k{next_time - prev_time}}}{ass_escape(phrase[prev_end:char_end])}")
+        prev_end, prev_time = char_end, next_time
+    if prev_end < len(phrase):
+        # Trailing text (punctuation after the last timed word) would switch at the
+        # event's end time, so it is never highlighted, as in the MoviePy wipe
+        parts.append(f"{{\\k0}}{ass_escape(phrase[prev_end:])}")
+    return "".join(parts)
+
+def build_ass(segments, media_size, is_video_input, karaoke, duration, log_callback=print):
+    """
+    Returns the ASS script for the segments. Phrase mode uses the phrase video
+    style (wrapped, boxed captions); karaoke mode uses '\\k' timing from the
+    word timestamps with the karaoke font and colors.
+    """
+    width, height = media_size
+    # Video: top of the text at SUBTITLE_Y_POSITION; audio-only: centered
+    alignment = 8 if is_video_input else 5
+    margin_v = int(height * config.SUBTITLE_Y_POSITION) if is_video_input else 0
+    if karaoke:
+        size = int(width * 0.04)
+        style = _style_line("Lyrics", config.KARAOKE_FONT, size, config.FONT_COLOR, config.BG_COLOR,
+                            config.FONT_BACKGROUND, alignment, 0, margin_v)
+    else:
+        size = int(width * config.RELATIVE_FONT_SIZE)
+        style = _style_line("Lyrics", config.FONT_FAMILY, size, config.FONT_COLOR, config.FONT_COLOR,
+                            config.FONT_BACKGROUND, alignment, int(width * 0.05), margin_v)
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        f"WrapStyle: {2 if karaoke else 0}", # Karaoke lines don't wrap, like TextClip 'label'
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, "
+        "Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        style,
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    last_segment_end = 0
+    for i, seg in enumerate(segments):
+        text = seg.get('text', "").strip()
+        start = max(0, seg.get('start', last_segment_end))
+        end = seg.get('end', start + 2)
+        if not karaoke:
+            # Phrase captions end at the next one's start, like generate_phrase_video
+            next_start = segments[i + 1].get('start', duration) if i + 1 < len(segments) else duration
+            end = min(end, next_start)
+        if duration:
+            end = min(end, duration)
+        last_segment_end = end
+        if not text or end - start <= 0.01:
+            continue
+        body = ass_escape(text)
+        if karaoke:
+            body = _karaoke_text(dict(seg, start=start, end=end), log_callback) or body
+        lines.append(f"Dialogue: 0,{ass_timestamp(start)},{ass_timestamp(end)},Lyrics,,0,0,0,,{body}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Rendering ---
+def _stage_fonts(work_dir, font_names, size):
+    """Copies the resolved font files next to the script so libass finds them without fontconfig."""
+    fonts_dir = os.path.join(work_dir, FONTS_SUBDIR)
+    os.makedirs(fonts_dir, exist_ok=True)
+    for font_name in font_names:
+        _, _, font_path = resolve_font(font_name, size)
+        if font_path and os.path.exists(font_path):
+            shutil.copy2(font_path, os.path.join(fonts_dir, os.path.basename(font_path)))
+    return fonts_dir
+
+def render_with_ffmpeg(input_path, segments, output_filename, is_video_input, do_wipe_text,
+                       log_callback=print, audio_path_override=None, work_dir=None, render_height=None,
+                       rendition_outputs=None):
+    """
+    Renders the lyrics video with one ffmpeg process: the input video (or a
+    black background for audio) with the ASS subtitles burned in. The audio
+    stream is copied when the mp4 container allows it, otherwise encoded to AAC.
+    rendition_outputs ([(height, path)]) adds smaller renditions to the same
+    command: the subtitled frames are split and scaled per rendition, so the
+    input is decoded and the subtitles composited once. Heights at or above
+    the main output's are skipped. Returns the rendition heights written.
+    The ASS file and fonts go in work_dir (a temporary directory if None).
+    """
+    if not segments:
+        log_callback("No segments to process. Skipping video generation.")
+        return []
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return render_with_ffmpeg(input_path, segments, output_filename, is_video_input, do_wipe_text, log_callback,
+                                      audio_path_override, tmp, render_height, rendition_outputs)
+    audio_path = audio_path_override if audio_path_override and os.path.exists(audio_path_override) else input_path
+    separate_audio = os.path.abspath(audio_path) != os.path.abspath(input_path)
+
+    input_info = probe_media(input_path) or {}
+    audio_info = probe_media(audio_path) if separate_audio else input_info
+    audio_info = audio_info or {}
+    durations = [d for d in (input_info.get('duration') if is_video_input else None, audio_info.get('duration')) if d]
+    duration = min(durations) if durations else None
+    if not duration:
+        log_callback("Error: Could not determine media duration for ffmpeg render.")
+        return []
+
+    if is_video_input:
+        media_size = render_size(input_info.get('width'), input_info.get('height'), render_height)
+    else:
+        media_size = canvas_size(render_height)
+    log_callback(f"ffmpeg render: {media_size[0]}x{media_size[1]}, {duration:.2f}s, "
+                 f"{'karaoke' if do_wipe_text else 'phrase'} subtitles.")
+
+    font_size = int(media_size[0] * (0.04 if do_wipe_text else config.RELATIVE_FONT_SIZE))
+    font_name = config.KARAOKE_FONT if do_wipe_text else config.FONT_FAMILY
+    with open(os.path.join(work_dir, ASS_FILENAME), 'w', encoding='utf-8') as f:
+        f.write(build_ass(segments, media_size, is_video_input, do_wipe_text, duration, log_callback))
+    _stage_fonts(work_dir, [font_name], font_size)
+
+    # ffmpeg runs inside work_dir so the filter arguments are plain relative names (no escaping)
+    command = ["ffmpeg", "-y", "-v", "error", "-nostats"]
+    if is_video_input:
+        command += ["-i", os.path.abspath(input_path)]
+    else:
+        command += ["-f", "lavfi", "-i", f"color=c=black:s={media_size[0]}x{media_size[1]}:r={config.VIDEO_FPS}"]
+    if separate_audio or not is_video_input:
+        command += ["-i", os.path.abspath(audio_path)]
+        audio_map = "1:a:0"
+    else:
+        audio_map = "0:a:0?"
+    filters = []
+    if is_video_input and input_info.get('height') and (input_info['width'], input_info['height']) != media_size:
+        log_callback(f"Downscaling video from {input_info['height']}p to {media_size[1]}p...")
+        filters.append(f"scale={media_size[0]}:{media_size[1]}")
+    filters.append(f"ass={ASS_FILENAME}:fontsdir={FONTS_SUBDIR}")
+    audio_codec = "copy" if audio_info.get('audio_codec') in MP4_COPY_AUDIO_CODECS else "aac"
+
+    renditions = [(h, os.path.abspath(path)) for h, path in rendition_outputs or [] if h < media_size[1]]
+    skipped = [h for h, _ in rendition_outputs or [] if h > media_size[1]]
+    if skipped:
+        log_callback(f"Renditions: skipping {skipped} (taller than the {media_size[1]}p output).")
+    # [0:v]scale,ass,split=N[o0][o1]...; [o1]scale=-2:H1[v1]; ... ([o0] is the main output)
+    outputs = [("[o0]", os.path.abspath(output_filename))] + [(f"[v{i}]", path) for i, (_, path) in enumerate(renditions, 1)]
+    if renditions:
+        graph = [f"[0:v]{','.join(filters)},split={len(outputs)}" + "".join(f"[o{i}]" for i in range(len(outputs)))]
+        graph += [f"[o{i}]scale=-2:{h}[v{i}]" for i, (h, _) in enumerate(renditions, 1)]
+        command += ["-filter_complex", ";".join(graph)]
+    else:
+        command += ["-filter:v", ",".join(filters)]
+        outputs = [("0:v:0", outputs[0][1])]
+
+    frames = int(math.ceil(duration * config.VIDEO_FPS))
+    encoding_jobs = len(outputs) * (config.STAGE_CONCURRENCY.get('encoding') or 1) if renditions else None
+    for choice in encoder_candidates(concurrent_jobs=encoding_jobs):
+        log_callback(f"Writing final video file with ffmpeg ({choice['codec']}, audio: {audio_codec})...")
+        output_args = []
+        for video_map, path in outputs:
+            output_args += ["-map", video_map, "-map", audio_map, "-r", str(config.VIDEO_FPS), "-c:a", audio_codec,
+                            "-t", f"{duration:.3f}", "-movflags", "+faststart"] + \
+                           ffmpeg_args(choice) + ["-pix_fmt", "yuv420p", path]
+        start = time.time()
+        result = subprocess.run(command + output_args, cwd=work_dir, capture_output=True, text=True)
+        if result.returncode == 0:
+            log_encode_rate(log_callback, choice, frames * len(outputs), time.time() - start)
+            log_callback(f"Success! Lyrics video successfully generated: '{output_filename}'")
+            if renditions:
+                log_callback(f"Renditions written: {', '.join(f'{h}p' for h, _ in renditions)}")
+            return [h for h, _ in renditions]
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        log_callback(f"ffmpeg encode with {choice['codec']} failed: {error}")
+    raise RuntimeError("ffmpeg render failed with every encoder.")
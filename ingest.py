@@ -0,0 +1,148 @@
+"""
+Streaming upload ingest.
+
+Multipart file parts are written straight into the uploads folder while
+Werkzeug parses the request body (instead of being spooled to a temporary
+file and copied), and their SHA-256 is computed on the way through, so the
+pipeline's result cache doesn't need to read the file again.
+
+Once config.INGEST_PROBE_BYTES have arrived the partial file is probed with
+ffprobe, and media that can't be used (no audio track, longer than
+config.MAX_MEDIA_SECONDS) is rejected before the rest of the body is read.
+Containers whose index is at the end (MP4 without faststart) can't be probed
+early; every upload is probed again once it is complete.
+"""
+import os
+import time
+import uuid
+import hashlib
+from werkzeug.exceptions import HTTPException
+from flask import Request
+import config
+from ffmpeg_render import probe_media
+from result_cache import hash_file
+
+PART_PREFIX = ".ingest-"
+
+class IngestRejected(HTTPException):
+    """Upload refused because of what the media is (the description says why)."""
+    code = 415
+
+    def __init__(self, description, code=None):
+        super().__init__(description)
+        if code:
+            self.code = code
+
+
+def check_media(info, complete):
+    """
+    Raises IngestRejected for media the pipeline can't use. A partial file is
+    only rejected on positive evidence; anything undecided waits for the full probe.
+    """
+    if info is None or not (info.get('audio_codec') or info.get('video_codec')):
+        if complete:
+            raise IngestRejected("Unrecognized or unsupported media file.")
+        return
+    if not info.get('audio_codec'):
+        raise IngestRejected("The file has no audio track.")
+    duration = info.get('duration')
+    if config.MAX_MEDIA_SECONDS and duration and duration > config.MAX_MEDIA_SECONDS:
+        raise IngestRejected(f"Media is {duration / 60:.1f} minutes long; the limit is "
+                             f"{config.MAX_MEDIA_SECONDS / 60:.0f} minutes.", code=413)
+
+
+class IngestFile:
+    """Writable, readable file target for one multipart file part."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{PART_PREFIX}{uuid.uuid4().hex}.part")
+        self._file = open(self.path, 'wb+')
+        self._digest = hashlib.sha256()
+        self._probed = False
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+        if not self._probed and self.size >= config.INGEST_PROBE_BYTES:
+            self._probed = True
+            self._file.flush()
+            try:
+                check_media(probe_media(self.path), complete=False)
+            except IngestRejected:
+                self.discard()
+                raise
+        return len(data)
+
+    # Werkzeug seeks back to the start once the part is complete; FileStorage may read it
+    def seek(self, offset, whence=0): return self._file.seek(offset, whence)
+    def tell(self): return self._file.tell()
+    def read(self, size=-1): return self._file.read(size)
+    def readline(self, size=-1): return self._file.readline(size)
+    def flush(self): self._file.flush()
+    def close(self): self._file.close()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def finish(self, final_path):
+        """Probes the complete file and moves it to final_path. Returns {'sha256', 'size', 'media'}."""
+        self._file.close()
+        info = probe_media(self.path)
+        try:
+            check_media(info, complete=True)
+        except IngestRejected:
+            self.discard()
+            raise
+        os.replace(self.path, final_path) # Same directory, so no copy
+        return {'sha256': self._digest.hexdigest(), 'size': self.size, 'media': info}
+
+
+class IngestRequest(Request):
+    """Flask request class that streams file parts into the uploads folder."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ingest_parts = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        part = IngestFile(config.UPLOADS_DIR)
+        self.ingest_parts.append(part)
+        return part
+
+
+def save_upload(file_storage, final_path):
+    """
+    Puts an uploaded file at final_path and checks it. Returns {'sha256', 'size', 'media'}.
+    Streamed parts are just moved; anything else (e.g. a test client's stream) is saved and hashed.
+    """
+    if isinstance(file_storage.stream, IngestFile):
+        return file_storage.stream.finish(final_path)
+    file_storage.save(final_path)
+    info = probe_media(final_path)
+    try:
+        check_media(info, complete=True)
+    except IngestRejected:
+        os.remove(final_path)
+        raise
+    return {'sha256': hash_file(final_path), 'size': os.path.getsize(final_path), 'media': info}
+
+def discard_uploads(request):
+    """Removes the request's streamed parts that were not moved into place by save_upload."""
+    for part in getattr(request, 'ingest_parts', []):
+        part.discard()
+
+def remove_stale_parts(directory, max_age_seconds=3600):
+    """Deletes partial uploads left behind by aborted requests."""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(PART_PREFIX) and os.path.getmtime(path) < cutoff:
+            try: os.remove(path)
+            except OSError: pass
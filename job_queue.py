@@ -0,0 +1,180 @@
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+import config
+
+class QueueFullError(Exception):
+    """Raised by JobScheduler.submit when the pending queue is at capacity."""
+    pass
+
+
+# --- Job Scheduler ---
+class JobScheduler:
+    """
+    Fixed pool of worker threads pulling jobs from a bounded queue.
+    Jobs are identified by task_id so they can be located (queue position)
+    and cancelled while still waiting.
+
+    The next job is chosen by policy:
+      'fifo' - in submission order
+      'sjf'  - smallest predicted cost first; a job's cost drops by `aging`
+               seconds per second waited, so long jobs can't starve
+      'fair' - the owner (client) with the fewest running jobs goes next, ties
+               to the owner served least recently; each owner's jobs run in order
+    """
+
+    POLICIES = ('fifo', 'sjf', 'fair')
+
+    def __init__(self, max_workers, max_queue_size, policy='fifo', aging=1.0, unknown_cost=300):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.aging = aging
+        self.unknown_cost = unknown_cost
+        self._pending = [] # Job dicts in submission order
+        self._running = {} # task_id -> job dict
+        self._last_served = {} # owner -> start counter of its most recent job ('fair')
+        self._starts = 0
+        self._cond = threading.Condition()
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"pipeline-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, task_id, target, *args, cost=None, owner=None):
+        """
+        Queues target(*args) to run on a worker. cost is the job's predicted
+        run time in seconds (used by 'sjf'), owner the client it belongs to
+        (used by 'fair'). Returns the 1-based queue position.
+        Raises QueueFullError if max_queue_size jobs are already waiting.
+        """
+        with self._cond:
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs waiting).")
+            self._pending.append({'task_id': task_id, 'target': target, 'args': args, 'cost': cost,
+                                  'owner': owner, 'submitted': time.time()})
+            self._cond.notify()
+            return self._order().index(self._pending[-1]) + 1
+
+    def cancel(self, task_id):
+        """Removes a queued job. Returns False if the job is not waiting (running or unknown)."""
+        with self._cond:
+            for job in self._pending:
+                if job['task_id'] == task_id:
+                    self._pending.remove(job)
+                    return True
+            return False
+
+    def position(self, task_id):
+        """1-based position of a waiting job in the order it would start, 0 if running, None if unknown."""
+        with self._cond:
+            if task_id in self._running:
+                return 0
+            for i, job in enumerate(self._order()):
+                if job['task_id'] == task_id:
+                    return i + 1
+            return None
+
+    def cost_ahead(self, task_id):
+        """Sum of the predicted costs of the jobs that would start before task_id (None if not waiting)."""
+        with self._cond:
+            total = 0.0
+            for job in self._order():
+                if job['task_id'] == task_id:
+                    return total
+                total += job['cost'] if job['cost'] is not None else self.unknown_cost
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._pending),
+                'max_queue_size': self.max_queue_size,
+                'policy': self.policy,
+            }
+
+    # --- Ordering (callers hold self._cond) ---
+    def _effective_cost(self, job, now):
+        cost = job['cost'] if job['cost'] is not None else self.unknown_cost
+        return cost - self.aging * (now - job['submitted'])
+
+    def _running_owners(self):
+        counts = {}
+        for job in self._running.values():
+            counts[job['owner']] = counts.get(job['owner'], 0) + 1
+        return counts
+
+    def _pick(self, pending, running_owners, last_served):
+        if self.policy == 'sjf':
+            now = time.time()
+            return min(pending, key=lambda job: (self._effective_cost(job, now), job['submitted']))
+        if self.policy == 'fair':
+            # pending is in submission order, so min() takes each owner's oldest job
+            return min(pending, key=lambda job: (running_owners.get(job['owner'], 0),
+                                                 last_served.get(job['owner'], -1)))
+        return pending[0]
+
+    def _order(self):
+        """Waiting jobs in the order they would start if nothing else changed."""
+        pending = list(self._pending)
+        running_owners = self._running_owners()
+        last_served = dict(self._last_served)
+        ordered = []
+        while pending:
+            job = self._pick(pending, running_owners, last_served)
+            pending.remove(job)
+            ordered.append(job)
+            # A started job counts as running for its owner, as in _worker_loop
+            running_owners[job['owner']] = running_owners.get(job['owner'], 0) + 1
+            last_served[job['owner']] = self._starts + len(ordered)
+        return ordered
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pick(self._pending, self._running_owners(), self._last_served)
+                self._pending.remove(job)
+                self._starts += 1
+                self._last_served[job['owner']] = self._starts
+                task_id = job['task_id']
+                self._running[task_id] = job
+            try:
+                job['target'](*job['args'])
+            except Exception:
+                # Jobs handle their own errors; this only keeps the worker alive
+                print(f"[Scheduler] Unhandled error in job {task_id}:\n{traceback.format_exc()}")
+            finally:
+                with self._cond:
+                    self._running.pop(task_id, None)
+
+
+# --- Stage Concurrency Limits ---
+# Running jobs still compete for CPU/RAM, so heavy stages take a slot from their
+# stage class before starting. Classes and limits come from config.STAGE_CONCURRENCY.
+_STAGE_SEMAPHORES = {
+    stage_class: threading.BoundedSemaphore(limit)
+    for stage_class, limit in config.STAGE_CONCURRENCY.items()
+}
+
+@contextmanager
+def stage_slot(stage_class, log_callback=print):
+    """Blocks until a slot for stage_class is free, holds it for the duration of the block."""
+    semaphore = _STAGE_SEMAPHORES.get(stage_class)
+    if semaphore is None:
+        yield
+        return
+    if not semaphore.acquire(blocking=False):
+        log_callback(f"Waiting for a free '{stage_class}' slot...")
+        semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import config
+from audio_processing import SAMPLE_RATE, open_audio
+from metrics import timed
+
+# --- Silence-based Splitting ---
+def find_chunks(audio, sample_rate=SAMPLE_RATE, chunk_seconds=None, search_seconds=None, frame_seconds=0.03):
+    """
+    Splits audio into roughly chunk_seconds long pieces, cutting at the quietest
+    frame (lowest RMS energy) within +/- search_seconds of each target boundary,
+    so words are not cut in half. Returns a list of (start_sample, end_sample).
+    """
+    chunk_seconds = chunk_seconds or config.LONG_FORM_CHUNK_SECONDS
+    search_seconds = config.LONG_FORM_SILENCE_SEARCH_SECONDS if search_seconds is None else search_seconds
+    total = len(audio)
+    frame = max(1, int(frame_seconds * sample_rate))
+    n_frames = total // frame
+    if n_frames == 0 or total <= chunk_seconds * sample_rate:
+        return [(0, total)]
+
+    # Frame energies computed in one pass over a (n_frames, frame) view
+    framed = np.asarray(audio[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(framed * framed, axis=1))
+
+    chunk_frames = int(chunk_seconds / frame_seconds)
+    search_frames = int(search_seconds / frame_seconds)
+    boundaries = [0]
+    while boundaries[-1] + chunk_frames + search_frames < n_frames:
+        target = boundaries[-1] + chunk_frames
+        lo, hi = max(boundaries[-1] + 1, target - search_frames), min(n_frames, target + search_frames)
+        boundaries.append(lo + int(np.argmin(energy[lo:hi])))
+
+    samples = [b * frame for b in boundaries] + [total]
+    return [(samples[i], samples[i + 1]) for i in range(len(samples) - 1)]
+
+
+# --- Worker Process ---
+# Loaded once per worker process by _init_worker and kept for the life of the pool
+_WORKER_MODEL = None
+
+def _init_worker(key, threads):
+    global _WORKER_MODEL
+    import torch
+    from transcription import BACKENDS
+    if threads:
+        torch.set_num_threads(threads)
+    backend_name, model_name, device = key
+    _WORKER_MODEL = BACKENDS[backend_name].load(model_name, device)
+
+def _ready():
+    return os.getpid()
+
+def _model_bytes():
+    from model_registry import estimate_model_bytes
+    return estimate_model_bytes(_WORKER_MODEL)
+
+def _transcribe_chunk(backend_name, audio_path, start_sample, end_sample, word_timestamps_needed):
+    from transcription import BACKENDS
+    audio = np.array(open_audio(audio_path)[start_sample:end_sample], dtype=np.float32)
+    segments = BACKENDS[backend_name].transcribe(_WORKER_MODEL, audio, word_timestamps=word_timestamps_needed)
+    offset = start_sample / SAMPLE_RATE
+    for seg in segments:
+        seg['start'] = seg.get('start', 0.0) + offset
+        seg['end'] = seg.get('end', 0.0) + offset
+        for w in seg.get('words', []) or []:
+            if 'start' in w: w['start'] += offset
+            if 'end' in w: w['end'] += offset
+    return segments
+
+
+def stitch_segments(chunk_results):
+    """Concatenates per-chunk segment lists (already in global time) and renumbers ids."""
+    segments = [seg for chunk in chunk_results for seg in chunk]
+    for i, seg in enumerate(segments):
+        seg['id'] = i
+    return segments
+
+def default_workers():
+    return config.LONG_FORM_WORKERS or max(1, (os.cpu_count() or 1) // 4)
+
+
+# --- Persistent Worker Pool ---
+# One pool of spawned processes (never forked: the server is multi-threaded and
+# torch/OpenMP are already initialised) that keeps its model loaded between jobs.
+# A job for another model or worker count replaces the pool; jobs already
+# submitted to the old one still finish before its workers exit. Every worker
+# holds its own copy of the model, so the pool is sized to fit those copies in
+# config.WHISPER_MODEL_MEMORY_BUDGET_MB.
+_POOL_LOCK = threading.Lock()
+_POOL = None # (model key, workers, executor)
+_MODEL_BYTES = {} # model key -> size of one loaded copy, as reported by a worker
+
+def _pool(key, workers):
+    """The pool for (key, workers), created if needed. Callers hold _POOL_LOCK."""
+    global _POOL
+    if _POOL is not None and _POOL[:2] == (key, workers):
+        return _POOL[2]
+    if _POOL is not None:
+        _POOL[2].shutdown(wait=False)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(key, threads))
+    _POOL = (key, workers, executor)
+    return executor
+
+def _discard_pool(executor):
+    """Drops a broken pool so the next job starts a fresh one."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL[2] is executor:
+            _POOL = None
+    executor.shutdown(wait=False)
+
+def _model_size(key):
+    from transcription import WHISPER_MODELS
+    return WHISPER_MODELS.size_bytes(key) or _MODEL_BYTES.get(key)
+
+def _budget_workers(key, workers):
+    """workers, capped so that many copies of the model fit in the Whisper memory budget."""
+    budget = config.WHISPER_MODEL_MEMORY_BUDGET_MB * 1024 * 1024 if config.WHISPER_MODEL_MEMORY_BUDGET_MB else None
+    size = _model_size(key)
+    if not budget or not size:
+        return workers
+    return max(1, min(workers, int(budget // size)))
+
+def _sized_pool(key, workers, log_callback=print):
+    """
+    (executor, workers) for key with at most `workers` processes, capped by the
+    memory budget. If the model's size isn't known yet, one worker loads it and
+    reports it first. Callers hold _POOL_LOCK.
+    """
+    global _POOL
+    if _model_size(key) is None:
+        executor = _pool(key, workers)
+        try:
+            # Spawned on demand: this submit starts a single worker
+            _MODEL_BYTES[key] = executor.submit(_model_bytes).result()
+        except BrokenProcessPool:
+            _POOL = None
+            executor.shutdown(wait=False)
+            raise
+    capped = _budget_workers(key, workers)
+    if capped < workers:
+        log_callback(f"Long-form: {capped} of {workers} workers fit {key[1]} in the "
+                     f"{config.WHISPER_MODEL_MEMORY_BUDGET_MB} MB model budget.")
+    return _pool(key, capped), capped
+
+def start_worker_pool(model_name=None, workers=None, log_callback=print):
+    """
+    Starts the worker pool for model_name (default config.WHISPER_MODEL) and
+    waits until every worker has loaded it, so the first long recording
+    doesn't pay for the model loads.
+    """
+    from transcription import model_key
+    model_name = model_name or config.WHISPER_MODEL
+    workers = workers or default_workers()
+    executor = None
+    try:
+        with _POOL_LOCK:
+            executor, workers = _sized_pool(model_key(model_name), workers, log_callback)
+            futures = [executor.submit(_ready) for _ in range(workers)]
+        for future in futures:
+            future.result()
+        log_callback(f"Long-form worker pool ready: {workers} workers with '{model_name}' loaded.")
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _discard_pool(executor)
+        log_callback(f"Warning: Could not start the long-form worker pool: {e}")
+
+
+# --- Long-form Transcription ---
+@timed('whisper')
+def transcribe_long_form(audio_path, model_name, log_callback=print, word_timestamps_needed=False, workers=None, chunk_seconds=None):
+    """
+    Transcribes a long recording by splitting it at silences and transcribing
+    the chunks in the persistent worker pool. audio_path must be raw extracted
+    audio (see audio_processing.extract_audio) so workers can memory-map it.
+    Returns segments with global timestamps, or [] on failure.
+    """
+    from transcription import model_key
+    executor = None
+    try:
+        audio = open_audio(audio_path)
+        chunks = find_chunks(audio, SAMPLE_RATE, chunk_seconds=chunk_seconds)
+        # The pool keeps its size across jobs (resizing means reloading the model); extra chunks just queue
+        key = model_key(model_name)
+        start_time = time.time()
+        with _POOL_LOCK:
+            executor, workers = _sized_pool(key, workers or default_workers(), log_callback)
+            log_callback(f"Long-form transcription: {len(audio) / SAMPLE_RATE:.0f}s split into {len(chunks)} chunks, "
+                         f"{min(workers, len(chunks))} of {workers} pool workers.")
+            futures = [executor.submit(_transcribe_chunk, key[0], audio_path, start, end, word_timestamps_needed)
+                       for start, end in chunks]
+        chunk_results = []
+        for i, future in enumerate(futures):
+            chunk_results.append(future.result())
+            log_callback(f"Long-form: chunk {i + 1}/{len(chunks)} done.")
+
+        segments = stitch_segments(chunk_results)
+        log_callback(f"Long-form transcription complete in {time.time() - start_time:.2f}s. Found {len(segments)} segments.")
+        return segments
+    except BrokenProcessPool as e:
+        _discard_pool(executor)
+        log_callback(f"Long-form worker pool failed: {e}")
+        return []
+    except Exception as e:
+        log_callback(f"An error occurred during long-form transcription: {e}")
+        return []
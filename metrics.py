@@ -0,0 +1,261 @@
+"""
+Stage-level profiling and a Prometheus-style metrics export.
+
+span(name) times a block. Pipeline stages are recorded as 'stage_seconds'
+together with the peak resident memory of the process while they ran
+(sampled every config.RSS_SAMPLE_SECONDS); sub-steps (model load, decode,
+Demucs, Whisper, alignment, text clip creation, encode) as 'step_seconds'.
+Observations go to the process-wide METRICS registry and, when the running
+thread belongs to a pipeline task, to that task's TaskProfile.
+
+Peak RSS is for the whole process, so it includes concurrently running jobs;
+spans inside worker processes (parallel render, long-form transcription) are
+not collected.
+"""
+import os
+import sys
+import time
+import threading
+import functools
+from contextlib import contextmanager
+import config
+
+PREFIX = "lyrassist_"
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+FPS_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+
+HELP = {
+    'stage_seconds': ('histogram', "Wall time of pipeline stages.", SECONDS_BUCKETS),
+    'step_seconds': ('histogram', "Wall time of pipeline sub-steps.", SECONDS_BUCKETS),
+    'encode_fps': ('histogram', "Frames encoded per second.", FPS_BUCKETS),
+    'stage_peak_rss_bytes': ('gauge', "Peak process RSS during the most recent run of a stage.", None),
+    'tasks_total': ('counter', "Finished tasks by final status.", None),
+}
+
+def current_rss_bytes():
+    """Resident memory of this process, or None if it can't be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource # Peak rather than current RSS, but better than nothing off Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        return None
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+
+# --- Registry ---
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+        self._values = {} # (name, labels) -> value (gauges and counters)
+        self._collectors = [] # Callables returning [(name, type, help, labels dict, value)] at scrape time
+
+    def observe(self, name, value, **labels):
+        buckets = HELP[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines, described = [], set()
+        def describe(name, kind, help_text):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        with self._lock:
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+            values = dict(self._values)
+        for (name, labels), series in sorted(histograms.items()):
+            kind, help_text, buckets = HELP[name]
+            describe(name, kind, help_text)
+            for bound, count in zip(buckets, series):
+                lines.append(f"{PREFIX}{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{PREFIX}{name}_sum{_label_text(labels)} {series[-2]:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_label_text(labels)} {series[-1]}")
+        for (name, labels), value in sorted(values.items()):
+            kind, help_text, _ = HELP[name]
+            describe(name, kind, help_text)
+            lines.append(f"{PREFIX}{name}{_label_text(labels)} {value}")
+        # Collectors report per source (e.g. per model registry); a metric family's lines must be contiguous
+        families = {}
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                if value is not None:
+                    families.setdefault((name, kind, help_text), []).append((tuple(sorted(labels.items())), value))
+        for (name, kind, help_text), samples in families.items():
+            describe(name, kind, help_text)
+            for labels, value in samples:
+                lines.append(f"{PREFIX}{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Per-Task Profiles ---
+class TaskProfile:
+    """Spans and encode rates of one pipeline run, summarized for the task's status record."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {} # name -> {'seconds', 'peak_rss_mb'}
+        self.steps = {} # name -> {'seconds', 'count'}
+        self.encode_fps = []
+        self.cached_stages = [] # Stages served from the result cache (set by the pipeline)
+
+    def add(self, kind, name, seconds, peak_rss=None):
+        with self._lock:
+            if kind == 'stage':
+                self.stages[name] = {'seconds': round(seconds, 2),
+                                     'peak_rss_mb': round(peak_rss / 1024 / 1024) if peak_rss else None}
+            else:
+                step = self.steps.setdefault(name, {'seconds': 0.0, 'count': 0})
+                step['seconds'] = round(step['seconds'] + seconds, 3)
+                step['count'] += 1
+
+    def add_encode_fps(self, fps):
+        with self._lock:
+            self.encode_fps.append(round(fps, 1))
+
+    def summary(self):
+        with self._lock:
+            return {'stages': dict(self.stages), 'steps': {name: dict(step) for name, step in self.steps.items()},
+                    'encode_fps': list(self.encode_fps), 'cached_stages': list(self.cached_stages)}
+
+_current = threading.local()
+
+@contextmanager
+def task_profile(profile):
+    """Makes profile the current thread's task profile for the duration of the block."""
+    previous = getattr(_current, 'profile', None)
+    _current.profile = profile
+    try:
+        yield profile
+    finally:
+        _current.profile = previous
+
+def current_profile():
+    return getattr(_current, 'profile', None)
+
+def in_current_profile(func):
+    """Wraps func to run under the calling thread's task profile, for work handed to another thread."""
+    profile = current_profile()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with task_profile(profile):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# --- Peak RSS Sampling ---
+class _RssSampler:
+    """Background thread that keeps the running maximum RSS for every open stage span."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peaks = {} # token -> peak bytes
+        self._thread = None
+
+    def start(self):
+        token = object()
+        rss = current_rss_bytes()
+        with self._lock:
+            self._peaks[token] = rss or 0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token):
+        rss = current_rss_bytes() or 0
+        with self._lock:
+            return max(self._peaks.pop(token, 0), rss) or None
+
+    def _run(self):
+        while True:
+            time.sleep(config.RSS_SAMPLE_SECONDS)
+            rss = current_rss_bytes()
+            if rss is None:
+                continue
+            with self._lock:
+                for token, peak in self._peaks.items():
+                    if rss > peak:
+                        self._peaks[token] = rss
+
+_RSS = _RssSampler()
+
+
+# --- Spans ---
+@contextmanager
+def span(name, kind='step', **labels):
+    """Times the block as a 'stage' or 'step' span (see module docstring)."""
+    profile = current_profile()
+    token = _RSS.start() if kind == 'stage' else None
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        peak_rss = _RSS.stop(token) if token is not None else None
+        if kind == 'stage':
+            METRICS.observe('stage_seconds', seconds, stage=name, **labels)
+            if peak_rss:
+                METRICS.set('stage_peak_rss_bytes', peak_rss, stage=name)
+        else:
+            METRICS.observe('step_seconds', seconds, step=name, **labels)
+        if profile is not None:
+            profile.add(kind, name, seconds, peak_rss)
+
+def timed(name):
+    """Decorator form of span(name) for sub-steps."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_encode(encoder, frames, seconds):
+    """Records an encode as a step span plus its frame rate."""
+    METRICS.observe('step_seconds', seconds, step='encode')
+    profile = current_profile()
+    if profile is not None:
+        profile.add('step', 'encode', seconds)
+    if frames and seconds > 0:
+        METRICS.observe('encode_fps', frames / seconds, encoder=encoder)
+        if profile is not None:
+            profile.add_encode_fps(frames / seconds)
+
+
+METRICS = MetricsRegistry()
+METRICS.add_collector(lambda: [('process_resident_memory_bytes', 'gauge', "Current RSS of this process.",
+                                {}, current_rss_bytes())])
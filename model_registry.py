@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from metrics import span
+
+# --- Model size estimation ---
+def _directory_bytes(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def estimate_model_bytes(model):
+    """
+    Best-effort estimate of how much memory a loaded model holds.
+    Sums parameter and buffer sizes for torch modules; recurses into
+    tuples/lists (e.g. WhisperX returns (model, metadata)). Models that
+    aren't torch modules (CTranslate2) are sized from the files in their
+    'model_path' directory. Returns 0 if unknown.
+    """
+    if model is None:
+        return 0
+    if isinstance(model, (tuple, list)):
+        return sum(estimate_model_bytes(m) for m in model)
+    model_path = getattr(model, 'model_path', None)
+    if isinstance(model_path, str) and os.path.isdir(model_path):
+        return _directory_bytes(model_path)
+    total = 0
+    try:
+        if hasattr(model, 'parameters'):
+            total += sum(p.numel() * p.element_size() for p in model.parameters())
+        if hasattr(model, 'buffers'):
+            total += sum(b.numel() * b.element_size() for b in model.buffers())
+    except Exception:
+        return 0
+    return total
+
+
+class _Entry:
+    def __init__(self, model, size_bytes, load_seconds):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.use_lock = threading.Lock() # Serializes use of models that are not thread-safe
+
+
+# --- Model Registry ---
+class ModelRegistry:
+    """
+    Process-wide, thread-safe cache of loaded models keyed by an arbitrary
+    hashable key (e.g. (model_name, device)).
+
+    - Each key is loaded at most once, even if several threads ask at the same time.
+    - Least recently used entries are evicted when the memory budget or the
+      entry limit is exceeded. The most recently loaded entry is never evicted,
+      so a single model larger than the budget still works.
+    - Hit/miss/load-time counters are available through stats().
+    """
+
+    def __init__(self, name, loader, memory_budget_mb=None, max_entries=None, exclusive_use=False):
+        self.name = name
+        self._loader = loader # Called as loader(*key) on a cache miss
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.max_entries = max_entries
+        self.exclusive_use = exclusive_use # If True, acquire() holds a per-model lock while in use
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {} # Per-key load locks so different models can load concurrently
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._total_load_seconds = 0.0
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _get_entry(self, key, log_callback=print):
+        entry = self._lookup(key)
+        if entry is not None:
+            with self._lock: self._hits += 1
+            return entry
+
+        with self._key_lock(key):
+            # Another thread may have finished loading while we waited
+            entry = self._lookup(key)
+            if entry is not None:
+                with self._lock: self._hits += 1
+                return entry
+
+            log_callback(f"[{self.name}] Cache miss for {key}, loading...")
+            load_start = time.time()
+            with span('model_load', registry=self.name):
+                model = self._loader(*key)
+            load_seconds = time.time() - load_start
+            entry = _Entry(model, estimate_model_bytes(model), load_seconds)
+
+            with self._lock:
+                self._misses += 1
+                self._total_load_seconds += load_seconds
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self._evict_locked(log_callback)
+            log_callback(f"[{self.name}] Loaded {key} in {load_seconds:.2f}s ({entry.size_bytes / 1024 / 1024:.0f} MB).")
+            return entry
+
+    def _evict_locked(self, log_callback=print):
+        """Drop least recently used entries until within budget. Caller holds self._lock."""
+        def over_budget():
+            if self.max_entries is not None and len(self._entries) > self.max_entries:
+                return True
+            if self.memory_budget_bytes is not None:
+                used = sum(e.size_bytes for e in self._entries.values())
+                return used > self.memory_budget_bytes
+            return False
+
+        while len(self._entries) > 1 and over_budget():
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._evictions += 1
+            # Threads currently using the model keep their own reference; we only drop ours
+            log_callback(f"[{self.name}] Evicted {old_key} ({old_entry.size_bytes / 1024 / 1024:.0f} MB).")
+
+    def get(self, key, log_callback=print):
+        """Returns the model for key, loading it on first use."""
+        return self._get_entry(key, log_callback).model
+
+    @contextmanager
+    def acquire(self, key, log_callback=print):
+        """
+        Context manager yielding the model for key. For registries created with
+        exclusive_use=True, holds the model's lock so only one thread runs it at a time.
+        """
+        entry = self._get_entry(key, log_callback)
+        if self.exclusive_use:
+            with entry.use_lock:
+                yield entry.model
+        else:
+            yield entry.model
+
+    def preload(self, key, log_callback=print):
+        """Loads key into the registry ahead of the first request."""
+        self._get_entry(key, log_callback)
+
+    def size_bytes(self, key):
+        """Estimated size of the loaded model for key, or None if it isn't loaded."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.size_bytes if entry is not None else None
+
+    def evict(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._evictions += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'entries': [str(k) for k in self._entries.keys()],
+                'memory_bytes': sum(e.size_bytes for e in self._entries.values()),
+                'memory_budget_bytes': self.memory_budget_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'total_load_seconds': round(self._total_load_seconds, 3),
+            }
@@ -0,0 +1,190 @@
+"""
+Segment-parallel rendering for the MoviePy engine.
+
+The timeline is split into chunks at segment starts (snapped to the frame
+grid), each chunk is rendered video-only by a worker process with its own
+VideoFileClip subclip, and the chunk files are joined with the ffmpeg concat
+demuxer without re-encoding. Every chunk is an independent encode, so each
+one starts on a keyframe and the joined stream is valid. Audio is muxed in
+during the join.
+"""
+import os
+import json
+import time
+import multiprocessing
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import config
+
+# --- Chunk Planning ---
+def plan_chunks(segments, duration, n_chunks, fps=None):
+    """
+    Returns [(start, end)] time ranges covering [0, duration]. Boundaries are
+    the segment starts closest to equal-length targets, preferring starts where
+    the previous segment has already ended (nothing on screen crosses the cut),
+    and are snapped to whole frames so no frame is dropped or doubled.
+    """
+    fps = fps or config.VIDEO_FPS
+    if n_chunks <= 1 or not segments:
+        return [(0.0, duration)]
+    clean, any_start = [], []
+    for i, seg in enumerate(segments):
+        start = seg.get('start')
+        if start is None or not 0 < start < duration:
+            continue
+        any_start.append(start)
+        if i == 0 or (segments[i - 1].get('end') or 0) <= start:
+            clean.append(start)
+    candidates = clean or any_start
+    if not candidates:
+        return [(0.0, duration)]
+
+    boundaries = set()
+    for k in range(1, n_chunks):
+        target = duration * k / n_chunks
+        nearest = min(candidates, key=lambda t: abs(t - target))
+        boundaries.add(round(nearest * fps) / fps)
+    cuts = [0.0] + sorted(b for b in boundaries if 0 < b < duration) + [duration]
+    return [(cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1) if cuts[i + 1] - cuts[i] > 1.0 / fps]
+
+def chunk_segments(segments, start, end):
+    """
+    Segments on screen during [start, end), shifted to chunk time. A segment
+    crossing the chunk's start (a cut at a non-clean boundary) keeps its
+    negative start; the renderers clip it to the chunk, so its tail is drawn.
+    """
+    shifted = []
+    for seg in segments:
+        seg_start = seg.get('start', 0)
+        seg_end = seg.get('end')
+        if seg_end is None:
+            seg_end = seg_start + 2 # The renderers' default length
+        if not (seg_start < end and seg_end > start):
+            continue
+        seg = json.loads(json.dumps(seg))
+        seg['start'] = seg_start - start
+        if seg.get('end') is not None:
+            seg['end'] = seg['end'] - start
+        for w in seg.get('words', []):
+            for key in ('start', 'end'):
+                if w.get(key) is not None:
+                    w[key] = w[key] - start
+        shifted.append(seg)
+    return shifted
+
+
+# --- Worker Process ---
+def _init_worker(usable_encoders, threads, fps):
+    import encoders
+    encoders._usable_encoders = list(usable_encoders) # Skip re-probing in every worker
+    config.ENCODER_THREADS = threads
+    config.VIDEO_FPS = fps
+
+def _render_chunk(do_wipe_text, input_path, segments, output_path, is_video_input, time_range, work_dir, render_height):
+    from video_processing import generate_phrase_video, generate_karaoke_video
+    messages = []
+    generate = generate_karaoke_video if do_wipe_text else generate_phrase_video
+    start = time.time()
+    os.makedirs(work_dir, exist_ok=True)
+    generate(input_path, segments, output_path, is_video_input, messages.append,
+             work_dir=work_dir, time_range=time_range, render_height=render_height)
+    if not os.path.exists(output_path):
+        raise RuntimeError(f"Chunk {time_range} produced no output: {messages[-1] if messages else 'no log'}")
+    return time.time() - start
+
+
+# --- Chunk Rendering and Joining ---
+def render_chunks(input_path, segments, chunks, chunk_paths, is_video_input, do_wipe_text, workers, threads,
+                  log_callback=print, fps=None, render_height=None):
+    """Renders each (start, end) chunk video-only to its path in worker processes."""
+    from encoders import probe_encoders
+    context = multiprocessing.get_context('spawn') # MoviePy/ffmpeg readers are not fork-safe in a threaded server
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(probe_encoders(log_callback), threads, fps or config.VIDEO_FPS)) as pool:
+        futures = [
+            pool.submit(_render_chunk, do_wipe_text, os.path.abspath(input_path),
+                        chunk_segments(segments, chunk_start, chunk_end), chunk_paths[i], is_video_input,
+                        (chunk_start, chunk_end), os.path.splitext(chunk_paths[i])[0] + "_work", render_height)
+            for i, (chunk_start, chunk_end) in enumerate(chunks)
+        ]
+        for i, future in enumerate(futures):
+            seconds = future.result()
+            log_callback(f"Rendered chunk {i + 1}/{len(chunks)} "
+                         f"({chunks[i][0]:.1f}-{chunks[i][1]:.1f}s) in {seconds:.1f}s")
+
+def join_chunks(chunk_paths, audio_path, duration, output_filename, work_dir, in_band_parameter_sets=False):
+    """
+    Joins video chunks with the concat demuxer (no re-encode) and muxes the
+    audio track in. With in_band_parameter_sets, chunks from different encodes
+    can be joined: each one goes through h264_mp4toannexb, so its SPS/PPS are
+    repeated in-band before its IDR frames, and the MP4 is tagged avc3
+    (parameter sets may change in-band) instead of avc1.
+    """
+    list_path = os.path.join(work_dir, "chunks.ffconcat")
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for path in chunk_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    command = ["ffmpeg", "-y", "-v", "error", "-nostats", "-f", "concat", "-safe", "0"]
+    if in_band_parameter_sets:
+        command += ["-auto_convert", "1"] # The demuxer's per-file h264_mp4toannexb, with each file's own SPS/PPS
+    command += ["-i", list_path, "-i", os.path.abspath(audio_path), "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy"]
+    if in_band_parameter_sets:
+        command += ["-bsf:v", "h264_mp4toannexb", "-tag:v", "avc3"]
+    command += ["-c:a", "aac", "-t", f"{duration:.3f}", "-movflags", "+faststart", os.path.abspath(output_filename)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        raise RuntimeError(f"Joining render chunks failed: {error}")
+
+
+# --- Parallel Render ---
+def default_workers():
+    return config.PARALLEL_RENDER_WORKERS or max(1, (os.cpu_count() or 1) // 2)
+
+def render_parallel(input_path, segments, output_filename, is_video_input, do_wipe_text,
+                    log_callback=print, audio_path_override=None, work_dir=None, workers=None, duration=None,
+                    min_chunks=2, render_height=None):
+    """
+    Renders the lyrics video in parallel chunks and joins them without
+    re-encoding. Returns the number of chunks rendered, or 0 without writing
+    anything if the input is too short or yields fewer than min_chunks chunks.
+    Chunk files go in work_dir (a temporary directory if None).
+    """
+    from ffmpeg_render import probe_media
+
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return render_parallel(input_path, segments, output_filename, is_video_input, do_wipe_text, log_callback,
+                                   audio_path_override, tmp, workers, duration, min_chunks, render_height)
+    audio_path = audio_path_override if audio_path_override and os.path.exists(audio_path_override) else input_path
+    if duration is None:
+        durations = [d for d in ((probe_media(input_path) or {}).get('duration') if is_video_input else None,
+                                 (probe_media(audio_path) or {}).get('duration')) if d]
+        duration = min(durations) if durations else None
+    if not duration:
+        raise RuntimeError("Could not determine media duration for parallel render.")
+
+    workers = workers or default_workers()
+    chunks = plan_chunks(segments, duration, workers)
+    if duration < config.PARALLEL_RENDER_MIN_SECONDS or len(chunks) < min_chunks:
+        log_callback(f"Parallel render: not splitting {duration:.1f}s of video ({len(chunks)} chunk).")
+        return 0
+    workers = min(workers, len(chunks))
+    # Cores are shared by every chunk encode of every concurrent render job
+    concurrent = workers * (config.STAGE_CONCURRENCY.get('encoding') or 1)
+    threads = config.ENCODER_THREADS or max(1, (os.cpu_count() or 1) // concurrent)
+    log_callback(f"Parallel render: {len(chunks)} chunks on {workers} workers "
+                 f"({threads} encoder threads each), {duration:.1f}s of video.")
+
+    start = time.time()
+    chunk_paths = [os.path.join(work_dir, f"chunk_{i:03d}.mp4") for i in range(len(chunks))]
+    render_chunks(input_path, segments, chunks, chunk_paths, is_video_input, do_wipe_text, workers, threads,
+                  log_callback, render_height=render_height)
+    join_chunks(chunk_paths, audio_path, duration, output_filename, work_dir)
+    elapsed = time.time() - start
+    frames = int(duration * config.VIDEO_FPS)
+    log_callback(f"Parallel render: {frames} frames in {elapsed:.1f}s ({frames / elapsed:.1f} fps overall)")
+    log_callback(f"Success! Lyrics video successfully generated: '{output_filename}'")
+    return len(chunks)
@@ -1,158 +1,505 @@
 import os
+import json
 import time
+import shutil
+import uuid
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import config # Import config settings
-from audio_processing import extract_audio, separate_vocals # Import audio functions
-from transcription import transcribe_audio, perform_forced_alignment # Import transcription functions
+from audio_processing import extract_audio, separate_vocals, RAW_AUDIO_SUFFIX, SAMPLE_RATE # Import audio functions
+from transcription import transcribe_audio, perform_forced_alignment, is_low_confidence, retranscribe_segments, model_key # Import transcription functions
+from long_form import transcribe_long_form # Parallel chunked transcription for long inputs
 from video_processing import generate_phrase_video, generate_karaoke_video # Import video functions
+from ffmpeg_render import render_with_ffmpeg # ASS subtitles burned in with one ffmpeg call
+from parallel_render import render_parallel # Chunked MoviePy rendering across processes
+from smart_render import render_smart # Re-encode lyric ranges only, stream-copy the rest
+from renditions import requested_heights, primary_height, rendition_filename, encode_renditions # Output resolution ladder
+from job_queue import stage_slot # Per-stage-class concurrency limits
+from result_cache import RESULT_CACHE, hash_file, make_key # Cross-job artifact cache
+from workspace import task_workspace # Per-task scratch directories
+from stage_history import STAGE_HISTORY, stage_variant # Stage timings for ETAs and scheduling
+from metrics import TaskProfile, task_profile, in_current_profile, span # Stage/step timing spans and peak RSS
 
-def run_pipeline(input_path, output_path, options, log_callback=print):
+CHECKPOINT_FILENAME = "checkpoint.json"
+# State entries that only live in memory for the current run (a resumed run reads the files instead)
+TRANSIENT_STATE_KEYS = ('vocals_audio',) # 16 kHz vocal stem straight from in-process Demucs
+
+# --- Stage Definitions ---
+class Stage:
+    """
+    One step of the pipeline. Stages read and update a shared state dict that
+    is checkpointed as JSON, except for the in-memory TRANSIENT_STATE_KEYS.
+    """
+    def __init__(self, name, func, depends_on=(), stage_class=None):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.stage_class = stage_class # Concurrency class for job_queue.stage_slot (None = unlimited)
+
+
+def _mark_cached(state, stage_name):
+    """Stages served from the result cache are not used as timing samples."""
+    state['cached_stages'] = sorted(set(state.get('cached_stages', [])) | {stage_name})
+
+# --- 1. Audio Extraction ---
+def stage_extract(state, log_callback):
+    input_path = state['input_path']
+    if config.ENABLE_RESULT_CACHE:
+        # Uploads are hashed while they stream in (see ingest.py)
+        state['input_hash'] = state['options'].get('input_hash') or hash_file(input_path)
+        log_callback(f"Input content hash: {state['input_hash'][:12]}")
+    input_hash = state.get('input_hash')
+
+    log_callback("Extracting base audio track...")
+    audio_path = os.path.join(state['task_dir'], "audio" + RAW_AUDIO_SUFFIX)
+    audio_key = make_key(input_hash, 'pcm16k') if input_hash else None
+    cached_audio = RESULT_CACHE.fetch_file(audio_key, RAW_AUDIO_SUFFIX, audio_path) if audio_key else None
+    if cached_audio:
+        extracted_audio_path = cached_audio
+        log_callback("Using cached 16 kHz audio.")
+        _mark_cached(state, 'extract')
+    else:
+        extracted_audio_path = extract_audio(input_path, audio_path, log_callback)
+        if extracted_audio_path and audio_key:
+            RESULT_CACHE.put_file(audio_key, extracted_audio_path, RAW_AUDIO_SUFFIX)
+    if not extracted_audio_path:
+        raise ValueError("Audio extraction failed.")
+
+    # Transcription defaults to the extracted audio; the video keeps the original audio track
+    state['audio_path'] = extracted_audio_path
+    state['audio_for_transcription'] = extracted_audio_path
+    state['final_audio'] = input_path
+
+
+# --- 2. Optional Vocal Separation ---
+def _run_separation(state, log_callback):
+    """Runs (or fetches from cache) Demucs separation. Returns the vocals path or None."""
+    input_hash = state.get('input_hash')
+    vocals_path = os.path.join(state['task_dir'], "vocals.wav")
+    vocals_key = make_key(input_hash, 'vocals', config.DEMUCS_MODEL) if input_hash else None
+    cached_vocals = RESULT_CACHE.fetch_file(vocals_key, '.wav', vocals_path) if vocals_key else None
+    if cached_vocals:
+        log_callback("Using cached separated vocals.")
+        _mark_cached(state, 'separate')
+        return cached_vocals
+
+    vocals_result, vocals_audio = separate_vocals(state['audio_path'], log_callback, work_dir=state['scratch_dir'])
+    if vocals_result:
+        shutil.move(vocals_result, vocals_path) # Keep with the task's checkpoint
+        vocals_result = vocals_path
+        if vocals_audio is not None:
+            state['vocals_audio'] = vocals_audio # Transcription and alignment skip re-reading the WAV
+        if vocals_key:
+            RESULT_CACHE.put_file(vocals_key, vocals_result, '.wav')
+    return vocals_result
+
+def _audio_for(state, audio_path):
+    """The in-memory vocal stem when audio_path is the task's vocals file and the stem is in memory, else audio_path."""
+    if state.get('vocals_audio') is not None and audio_path == os.path.join(state['task_dir'], "vocals.wav"):
+        return state['vocals_audio']
+    return audio_path
+
+def _use_vocals(state, vocals_result, log_callback, for_transcription=True):
+    if vocals_result:
+        if for_transcription:
+            state['audio_for_transcription'] = vocals_result # Transcribe vocals only
+        state['vocals_path'] = vocals_result
+        if config.REPLACE_AUDIO_WITH_VOCALS:
+            state['final_audio'] = vocals_result # Use vocals in final video
+            log_callback("Using separated vocal track for final video audio.")
+        else:
+            log_callback("Using original audio for final video (vocals used for transcription only).")
+    else:
+        log_callback("Vocal separation failed. Proceeding with original audio for transcription.")
+
+def stage_separate(state, log_callback):
+    options = state['options']
+    if not options.get('do_separate_vocals', False):
+        log_callback("Skipping vocal separation.")
+        return
+    if options.get('speculative_separation', False):
+        log_callback("Speculative separation selected: Demucs will run alongside transcription.")
+        return
+
+    log_callback("Vocal separation selected.")
+    _use_vocals(state, _run_separation(state, log_callback), log_callback)
+
+
+# --- 3. Transcription ---
+def _transcribe_speculative(state, model_name, do_wipe_text, log_callback):
+    """
+    Transcribes the original mix while Demucs separates vocals in the background,
+    then re-transcribes only the low-confidence segments on the vocal stem.
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="demucs") as executor:
+        # The profile is per thread: without it the Demucs spans would be missing from the task profile
+        separation_future = executor.submit(in_current_profile(_run_separation), state, log_callback)
+        log_callback("Transcribing original mix while vocals are separated...")
+        segments = transcribe_audio(state['audio_path'], model_name, log_callback, word_timestamps_needed=do_wipe_text)
+        log_callback("Mix transcription done. Waiting for vocal separation...")
+        vocals_result = separation_future.result()
+
+    if not vocals_result:
+        _use_vocals(state, None, log_callback)
+        return segments
+    if not segments:
+        log_callback("Mix transcription failed. Transcribing the vocal stem instead.")
+        _use_vocals(state, vocals_result, log_callback)
+        return transcribe_audio(_audio_for(state, vocals_result), model_name, log_callback, word_timestamps_needed=do_wipe_text)
+
+    low_confidence = [i for i, seg in enumerate(segments) if is_low_confidence(seg)]
+    log_callback(f"{len(low_confidence)} of {len(segments)} segments are low-confidence on the mix.")
+    if len(low_confidence) > len(segments) * config.SPECULATIVE_MAX_RETRANSCRIBE_FRACTION:
+        log_callback("Too many low-confidence segments; re-transcribing the full vocal stem.")
+        _use_vocals(state, vocals_result, log_callback)
+        vocal_segments = transcribe_audio(_audio_for(state, vocals_result), model_name, log_callback, word_timestamps_needed=do_wipe_text)
+        return vocal_segments or segments
+
+    if low_confidence:
+        segments = retranscribe_segments(_audio_for(state, vocals_result), segments, low_confidence, model_name, log_callback, word_timestamps_needed=do_wipe_text)
+        _use_vocals(state, vocals_result, log_callback)
+    else:
+        # Keep the mix result; alignment stays on the audio that was transcribed
+        _use_vocals(state, vocals_result, log_callback, for_transcription=False)
+    return segments
+
+def _use_long_form(audio_path):
+    """Long recordings of raw extracted audio are transcribed in parallel chunks."""
+    if not config.LONG_FORM_ENABLED or not audio_path.endswith(RAW_AUDIO_SUFFIX):
+        return False
+    duration = os.path.getsize(audio_path) / 4 / SAMPLE_RATE # float32 samples
+    return duration >= config.LONG_FORM_MIN_SECONDS
+
+def stage_transcribe(state, log_callback):
+    options = state['options']
+    model_name = options.get('model', config.WHISPER_MODEL)
+    do_wipe_text = options.get('do_wipe_text', False)
+    input_hash = state.get('input_hash')
+    speculative = (options.get('do_separate_vocals', False) and options.get('speculative_separation', False)
+                   and not state.get('vocals_path'))
+
+    log_callback(f"Starting transcription with '{model_name}' model...")
+    audio_source = 'speculative' if speculative else state['audio_for_transcription'] != state['audio_path']
+    # Keyed by the resolved (backend, model): an unprefixed name follows config.TRANSCRIPTION_BACKEND
+    segments_key = make_key(input_hash, 'segments', *model_key(model_name)[:2], audio_source, do_wipe_text) if input_hash else None
+    segments = RESULT_CACHE.get_json(segments_key) if segments_key else None
+    if segments:
+        log_callback(f"Using cached transcription ({len(segments)} segments).")
+        _mark_cached(state, 'transcribe')
+        if speculative:
+            # The final video may still need the vocal stem
+            _use_vocals(state, _run_separation(state, log_callback), log_callback)
+    else:
+        if speculative:
+            segments = _transcribe_speculative(state, model_name, do_wipe_text, log_callback)
+        elif _use_long_form(state['audio_for_transcription']):
+            segments = transcribe_long_form(
+                 state['audio_for_transcription'],
+                 model_name,
+                 log_callback,
+                 word_timestamps_needed = do_wipe_text
+            )
+        else:
+            segments = transcribe_audio(
+                 _audio_for(state, state['audio_for_transcription']),
+                 model_name,
+                 log_callback,
+                 # Only request word timestamps if doing wipe text
+                 word_timestamps_needed = do_wipe_text,
+                 batch_size = options.get('batch_size')
+            )
+        if segments and segments_key:
+            RESULT_CACHE.put_json(segments_key, segments)
+    if not segments:
+         raise ValueError("Transcription failed or produced no segments.")
+
+    state['segments'] = segments
+    state['segments_key'] = segments_key
+    # Detect language (needed for alignment)
+    state['language'] = segments[0].get('language', 'en') # Default to English
+
+
+# --- 4. Optional Forced Alignment ---
+def stage_align(state, log_callback):
+    if not state['options'].get('do_wipe_text', False):
+        log_callback("Skipping forced alignment.")
+        return
+
+    log_callback("Wipe text selected. Performing forced alignment...")
+    segments_key = state.get('segments_key')
+    aligned_key = make_key(segments_key, 'aligned', state['language']) if segments_key else None
+    aligned_segments = RESULT_CACHE.get_json(aligned_key) if aligned_key else None
+    if aligned_segments:
+        log_callback("Using cached forced alignment.")
+        _mark_cached(state, 'align')
+    else:
+        # Use the same audio path that was used for transcription
+        aligned_segments = perform_forced_alignment(_audio_for(state, state['audio_for_transcription']), state['segments'], state['language'], log_callback)
+        if aligned_segments and aligned_key:
+            RESULT_CACHE.put_json(aligned_key, aligned_segments)
+    if aligned_segments:
+        state['segments'] = aligned_segments # Use aligned segments if successful
+    else:
+        log_callback("Forced alignment failed. Proceeding with original Whisper timestamps for wipe text (may be inaccurate).")
+        # Keep original segments (which might have basic word timestamps if transcribe_audio provided them)
+
+
+# --- 5. Video Generation ---
+def _render_smart(state, render_kwargs, log_callback):
+    """Tries the keyframe-cut smart render for video inputs. Returns False to render the whole timeline."""
+    options = state['options']
+    if not options.get('is_video', False) or not options.get('smart_render', config.SMART_RENDER):
+        return False
+    kwargs = {k: v for k, v in render_kwargs.items() if k != 'is_video_input'}
+    try:
+        return render_smart(do_wipe_text=options.get('do_wipe_text', False),
+                            workers=options.get('render_workers'), **kwargs)
+    except Exception as e:
+        log_callback(f"Smart render failed ({e}); rendering the whole timeline.")
+        return False
+
+def _render_parallel(state, render_kwargs, log_callback):
+    """Tries the segment-parallel MoviePy render. Returns False to render in one process instead."""
+    options = state['options']
+    if not options.get('parallel_render', config.PARALLEL_RENDER):
+        return False
+    if not options.get('is_video', False) and config.AUDIO_ONLY_STILL_FRAMES:
+        return False # Audio-only inputs already take the cheaper still-frame path
+    try:
+        return render_parallel(do_wipe_text=options.get('do_wipe_text', False),
+                               workers=options.get('render_workers'), **render_kwargs) > 0
+    except Exception as e:
+        log_callback(f"Parallel render failed ({e}); rendering in one process.")
+        return False
+
+def stage_render(state, log_callback):
+    options = state['options']
+    if not options.get('render_video', True):
+        log_callback("Skipping video generation (transcript only).")
+        return
+    log_callback("Preparing video generation...")
+    # The generators clamp segment times in place; keep the checkpointed segments untouched
+    segments = json.loads(json.dumps(state['segments']))
+    render_kwargs = dict(
+        input_path=state['input_path'], # Pass original input for video base
+        segments=segments,
+        output_filename=state['output_path'],
+        is_video_input=options.get('is_video', False), # <<< Pass the correct flag
+        log_callback=log_callback,
+        audio_path_override=state['final_audio'], # Pass potentially separated audio
+        work_dir=state['scratch_dir'],
+        render_height=primary_height(options) # Tallest requested rendition
+    )
+    extra_heights = requested_heights(options)[1:]
+    if options.get('render_engine', config.RENDER_ENGINE) == 'ffmpeg':
+        log_callback("Starting ffmpeg/ASS video generation...")
+        # The renditions come out of the same ffmpeg command
+        render_with_ffmpeg(do_wipe_text=options.get('do_wipe_text', False),
+                           rendition_outputs=[(h, rendition_filename(state['output_path'], h)) for h in extra_heights],
+                           **render_kwargs)
+        extra_heights = []
+    elif _render_smart(state, render_kwargs, log_callback):
+        pass
+    elif _render_parallel(state, render_kwargs, log_callback):
+        pass
+    # <<< FIX: Correctly check do_wipe_text option >>>
+    elif options.get('do_wipe_text', False):
+        log_callback("Starting karaoke video generation (word-by-word)...")
+        generate_karaoke_video(**render_kwargs)
+    else:
+        log_callback("Starting phrase video generation...")
+        generate_phrase_video(**render_kwargs)
+    if extra_heights and os.path.exists(state['output_path']):
+        log_callback(f"Encoding renditions {extra_heights} from the main output...")
+        encode_renditions(state['output_path'], extra_heights, log_callback)
+    log_callback("Video generation complete.")
+
+
+STAGES = [
+    Stage('extract', stage_extract),
+    Stage('separate', stage_separate, depends_on=['extract'], stage_class='transcription'),
+    Stage('transcribe', stage_transcribe, depends_on=['separate'], stage_class='transcription'),
+    Stage('align', stage_align, depends_on=['transcribe'], stage_class='transcription'),
+    Stage('render', stage_render, depends_on=['align'], stage_class='encoding'),
+]
+
+def stage_order(stages=STAGES):
+    """Topologically sorts stages by their dependencies."""
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+    def visit(stage):
+        if stage.name in done: return
+        if stage.name in visiting:
+            raise ValueError(f"Pipeline stage cycle at '{stage.name}'")
+        visiting.add(stage.name)
+        for dep in stage.depends_on: visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+    for stage in stages: visit(stage)
+    return ordered
+
+
+# --- Transcript Output ---
+def format_timestamp(seconds):
+    """Convert seconds to MM:SS format"""
+    minutes = int(seconds // 60)
+    secs = int(seconds % 60)
+    return f"{minutes:02d}:{secs:02d}"
+
+def write_transcript(segments, transcript_path):
+    """Writes segments as '[MM:SS] text' lines."""
+    with open(transcript_path, 'w', encoding='utf-8') as f:
+        for seg in segments:
+            # Format: [timestamp] text
+            start_time = seg.get('start', 0)
+            text = seg.get('text', '').strip()
+            f.write(f"[{format_timestamp(start_time)}] {text}\n")
+    return transcript_path
+
+
+# --- Checkpoints ---
+def get_task_dir(task_id):
+    return os.path.join(config.TASKS_DIR, task_id)
+
+def remove_task_dir(task_id, log_callback=None):
+    """Deletes a task's checkpoint directory (audio, vocals, state), if it still exists."""
+    task_dir = get_task_dir(task_id)
+    if not os.path.isdir(task_dir):
+        return
+    try:
+        shutil.rmtree(task_dir)
+        if log_callback:
+            log_callback(f"Removed task directory: {task_dir}")
+    except OSError as e:
+        if log_callback:
+            log_callback(f"Error removing task directory {task_dir}: {e}")
+
+def load_checkpoint(task_dir):
+    path = os.path.join(task_dir, CHECKPOINT_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_checkpoint(task_dir, completed, state):
+    path = os.path.join(task_dir, CHECKPOINT_FILENAME)
+    tmp_path = path + ".tmp"
+    state = {key: value for key, value in state.items() if key not in TRANSIENT_STATE_KEYS}
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'completed': completed, 'state': state}, f, default=lambda v: v.tolist() if hasattr(v, 'tolist') else float(v))
+    os.replace(tmp_path, path)
+
+def _checkpoint_files_exist(state):
+    """A checkpoint is only reusable if the artifacts it points to are still on disk."""
+    for key in ('audio_path', 'audio_for_transcription'):
+        path = state.get(key)
+        if path and not os.path.exists(path):
+            return False
+    return True
+
+
+def media_seconds(state):
+    """Duration of the input: from the upload probe, else from the extracted audio's size."""
+    duration = state['options'].get('media_duration')
+    if not duration and state.get('audio_path') and os.path.exists(state['audio_path']):
+        duration = os.path.getsize(state['audio_path']) / (4 * SAMPLE_RATE) # float32 mono
+    return duration
+
+def stage_names():
+    return [stage.name for stage in stage_order()]
+
+def _run_stage(stage, state, log_callback):
+    """Runs a stage in its concurrency slot. Returns its run time, excluding the wait for the slot."""
+    with stage_slot(stage.stage_class, log_callback) if stage.stage_class else nullcontext():
+        run_start = time.time()
+        with span(stage.name, kind='stage'):
+            stage.func(state, log_callback)
+        return time.time() - run_start
+
+
+def run_pipeline(input_path, output_path, options, log_callback=print, task_id=None, progress_callback=None,
+                 profile=None, keep_checkpoint=True):
     """
     Runs the full processing pipeline: audio extraction, optional separation,
     transcription, optional alignment, and video generation.
+
+    Each stage's output is checkpointed under config.TASKS_DIR/<task_id>, so
+    calling this again with the same task_id resumes after the last completed
+    stage. The task directory is removed once the pipeline succeeds; after a
+    failure it is kept for a retry unless keep_checkpoint is False or no
+    task_id was given (nothing could resume it). The web app removes kept
+    directories when the task store expires the task.
+    Transient files go to a per-task scratch directory (see workspace.py),
+    so several tasks can run at the same time.
+    progress_callback, if given, is called as (stage_name, 'running' | 'done',
+    stages_done, stages_total) around every stage. Stage and sub-step timings
+    are collected in profile (a metrics.TaskProfile), if given.
     Returns the transcript segments for further use.
     """
     start_time = time.time()
     log_callback("Starting main processing pipeline...")
 
-    # --- Options ---
-    model_name = options.get('model', config.WHISPER_MODEL)
-    do_separate_vocals = options.get('do_separate_vocals', False)
-    do_wipe_text = options.get('do_wipe_text', False)
     # <<< FIX: Receive is_video directly from options >>>
     is_video = options.get('is_video', False)
     log_callback(f"Input type determined as: {'Video' if is_video else 'Audio'}")
 
-    temp_wav_path = "uploads/temp_audio.wav" # Define temp path
-    vocals_only_path = None # Path for separated vocals if created
-    final_audio_for_video = None # Path for audio to use in final video
+    if task_id is None:
+        task_id, keep_checkpoint = uuid.uuid4().hex, False
+    task_dir = get_task_dir(task_id)
+    os.makedirs(task_dir, exist_ok=True)
 
-    try:
-        # --- 1. Audio Extraction ---
-        log_callback("Extracting base audio track...")
-        extracted_wav_path = extract_audio(input_path, temp_wav_path, log_callback)
-        if not extracted_wav_path:
-            raise ValueError("Audio extraction failed.")
-        
-        # Default audio path is the extracted one
-        audio_path_for_transcription = extracted_wav_path
-        final_audio_for_video = input_path if is_video else extracted_wav_path # Default final audio
-
-
-        # --- 2. Optional Vocal Separation ---
-        if do_separate_vocals:
-            log_callback("Vocal separation selected.")
-            vocals_only_path_result = separate_vocals(extracted_wav_path, log_callback)
-            if vocals_only_path_result:
-                audio_path_for_transcription = vocals_only_path_result # Transcribe vocals only
-                vocals_only_path = vocals_only_path_result # Keep track for cleanup
-                if config.REPLACE_AUDIO_WITH_VOCALS:
-                     final_audio_for_video = vocals_only_path_result # Use vocals in final video
-                     log_callback("Using separated vocal track for final video audio.")
-                else:
-                     log_callback("Using original audio for final video (vocals used for transcription only).")
-
-            else:
-                log_callback("Vocal separation failed. Proceeding with original audio for transcription.")
-                # Keep audio_path_for_transcription as extracted_wav_path
-        else:
-            log_callback("Skipping vocal separation.")
-
-
-        # --- 3. Transcription ---
-        log_callback(f"Starting transcription with '{model_name}' model...")
-        segments = transcribe_audio(
-             audio_path_for_transcription,
-             model_name,
-             log_callback,
-             # Only request word timestamps if doing wipe text
-             word_timestamps_needed = do_wipe_text
-        )
-        if not segments:
-             raise ValueError("Transcription failed or produced no segments.")
-             
-        # Detect language (needed for alignment)
-        detected_language = segments[0].get('language', 'en') # Default to English
-
-
-        # --- 4. Optional Forced Alignment ---
-        if do_wipe_text:
-             log_callback("Wipe text selected. Performing forced alignment...")
-             # Use the same audio path that was used for transcription
-             aligned_segments = perform_forced_alignment(audio_path_for_transcription, segments, detected_language, log_callback)
-             if aligned_segments:
-                  segments = aligned_segments # Use aligned segments if successful
-             else:
-                  log_callback("Forced alignment failed. Proceeding with original Whisper timestamps for wipe text (may be inaccurate).")
-                  # Keep original segments (which might have basic word timestamps if transcribe_audio provided them)
-        else:
-            log_callback("Skipping forced alignment.")
-
-
-        # --- 5. Video Generation ---
-        log_callback("Preparing video generation...")
-        
-        # <<< FIX: Correctly check do_wipe_text option >>>
-        if do_wipe_text:
-            log_callback("Starting karaoke video generation (word-by-word)...")
-            generate_karaoke_video(
-                input_path=input_path, # Pass original input for video base
-                segments=segments,
-                output_filename=output_path,
-                is_video_input=is_video, # <<< Pass the correct flag
-                log_callback=log_callback,
-                audio_path_override=final_audio_for_video # Pass potentially separated audio
-            )
-        else:
-            log_callback("Starting phrase video generation...")
-            generate_phrase_video(
-                input_path=input_path, # Pass original input for video base
-                segments=segments,
-                output_filename=output_path,
-                is_video_input=is_video, # <<< Pass the correct flag
-                log_callback=log_callback,
-                audio_path_override=final_audio_for_video # Pass potentially separated audio
-            )
+    completed = []
+    state = {}
+    checkpoint = load_checkpoint(task_dir)
+    if checkpoint and _checkpoint_files_exist(checkpoint.get('state', {})):
+        completed = checkpoint.get('completed', [])
+        state = checkpoint.get('state', {})
+        if completed:
+            log_callback(f"Resuming from checkpoint. Completed stages: {', '.join(completed)}")
+    # Inputs always come from the caller so a retry can change the output location
+    state.update({'input_path': input_path, 'output_path': output_path, 'options': options, 'task_dir': task_dir})
 
-        log_callback("Video generation complete.")
+    succeeded = False
+    try:
+        with task_workspace(task_id, log_callback) as scratch_dir, task_profile(profile or TaskProfile()) as profile:
+            state['scratch_dir'] = scratch_dir
+            stages = stage_order()
+            report = progress_callback or (lambda *args: None)
+            for stage in stages:
+                if stage.name in completed:
+                    log_callback(f"Stage '{stage.name}' already completed, skipping.")
+                    continue
+                report(stage.name, 'running', len(completed), len(stages))
+                stage_start = time.time()
+                run_seconds = _run_stage(stage, state, log_callback)
+                if stage.name not in state.get('cached_stages', []):
+                    STAGE_HISTORY.record(stage.name, stage_variant(stage.name, options), media_seconds(state), run_seconds)
+                profile.cached_stages = list(state.get('cached_stages', []))
+                completed.append(stage.name)
+                save_checkpoint(task_dir, completed, state)
+                log_callback(f"Stage '{stage.name}' finished in {time.time() - stage_start:.2f} seconds.")
+                report(stage.name, 'done', len(completed), len(stages))
 
+        succeeded = True
         # Return segments for transcript access
-        return segments
+        return state['segments']
 
     except Exception as e:
         log_callback(f"ERROR in pipeline: {e}")
+        if keep_checkpoint:
+            log_callback(f"Checkpoint kept in {task_dir}; the task can be retried from stage after: {completed[-1] if completed else 'start'}.")
         # Re-raise the exception so the thread function catches it
         raise
     finally:
         # --- Cleanup ---
-        log_callback("Cleaning up temporary files...")
-        if os.path.exists(temp_wav_path):
-            try:
-                os.remove(temp_wav_path)
-                log_callback(f"Removed temporary file: {temp_wav_path}")
-            except OSError as e:
-                 log_callback(f"Error removing temporary file {temp_wav_path}: {e}")
-
-        # Clean up separated vocals file if it was created
-        if vocals_only_path and os.path.exists(vocals_only_path):
-             try:
-                 os.remove(vocals_only_path)
-                 log_callback(f"Removed separated vocals file: {vocals_only_path}")
-             except OSError as e:
-                  log_callback(f"Error removing separated vocals file {vocals_only_path}: {e}")
-
-        # Clean up Demucs output directory if it exists and is empty
-        if do_separate_vocals and os.path.exists(config.DEMUCS_OUTPUT_DIR):
-             try:
-                 if not os.listdir(config.DEMUCS_OUTPUT_DIR): # Only remove if empty
-                     os.rmdir(config.DEMUCS_OUTPUT_DIR)
-                     log_callback(f"Removed empty Demucs output directory: {config.DEMUCS_OUTPUT_DIR}")
-                 else:
-                     # It's safer not to automatically delete if unexpected files remain
-                     log_callback(f"Note: Demucs output directory {config.DEMUCS_OUTPUT_DIR} not empty, skipping removal.")
-             except OSError as e:
-                  log_callback(f"Error removing Demucs output directory {config.DEMUCS_OUTPUT_DIR}: {e}")
+        if succeeded or not keep_checkpoint:
+            log_callback("Cleaning up temporary files...")
+            remove_task_dir(task_id, log_callback)
 
         end_time = time.time()
         log_callback(f"Cleanup complete.")
         log_callback(f"Pipeline finished in {end_time - start_time:.2f} seconds.")
-
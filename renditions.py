@@ -0,0 +1,86 @@
+"""
+Output resolution ladder.
+
+A job renders its tallest requested rendition with the normal engines, and
+subtitles are composited only once. With the ffmpeg engine the smaller ones
+come out of the same command (the subtitled frames are split, then scaled and
+encoded per rendition; see ffmpeg_render.render_with_ffmpeg). The MoviePy
+engines write a single file, so encode_renditions derives the smaller ones
+from that output in one extra ffmpeg pass (one decode of the main output,
+split into a scale + encode per rendition). Renditions are stored next to
+the main output as <name>_<height>p.mp4.
+"""
+import os
+import time
+import subprocess
+import config
+from ffmpeg_render import probe_media
+from encoders import encoder_candidates, ffmpeg_args, log_encode_rate
+
+def requested_heights(options):
+    """The job's rendition heights (tallest first), limited to config.RENDITION_HEIGHTS."""
+    heights = options.get('renditions', config.RENDITIONS) or []
+    valid = {int(h) for h in heights if str(h).isdigit() and int(h) in config.RENDITION_HEIGHTS}
+    return sorted(valid, reverse=True)
+
+def primary_height(options):
+    """Height the main output is rendered at."""
+    heights = requested_heights(options)
+    return heights[0] if heights else config.RENDER_HEIGHT
+
+def parse_heights(value):
+    """'1080,720,480' (form field) -> [1080, 720, 480]; invalid entries are dropped."""
+    return [int(part) for part in str(value or '').replace(' ', '').split(',') if part.isdigit()]
+
+def rendition_filename(filename, height):
+    base, ext = os.path.splitext(filename)
+    return f"{base}_{height}p{ext or '.mp4'}"
+
+def encode_renditions(primary_path, heights, log_callback=print):
+    """
+    Writes the renditions below the primary output's height from one decode
+    of the primary. Heights at or above the primary's are skipped (no upscaling).
+    Returns the heights written.
+    """
+    info = probe_media(primary_path) or {}
+    source_height = info.get('height')
+    if not source_height:
+        log_callback("Renditions: could not read the main output's size; skipping.")
+        return []
+    targets = [h for h in heights if h < source_height]
+    skipped = [h for h in heights if h > source_height]
+    if skipped:
+        log_callback(f"Renditions: skipping {skipped} (taller than the {source_height}p output).")
+    if not targets:
+        return []
+
+    # [0:v]split=N[s0][s1]...; [s0]scale=-2:H0[v0]; ...
+    labels = "".join(f"[s{i}]" for i in range(len(targets)))
+    graph = [f"[0:v]split={len(targets)}{labels}"] + [f"[s{i}]scale=-2:{h}[v{i}]" for i, h in enumerate(targets)]
+    frames = int((info.get('duration') or 0) * (info.get('fps') or config.VIDEO_FPS))
+    for choice in encoder_candidates(concurrent_jobs=len(targets) * (config.STAGE_CONCURRENCY.get('encoding') or 1)):
+        command = ["ffmpeg", "-y", "-v", "error", "-nostats", "-i", primary_path, "-filter_complex", ";".join(graph)]
+        for i, h in enumerate(targets):
+            command += ["-map", f"[v{i}]", "-map", "0:a:0?", "-c:a", "copy"] + ffmpeg_args(choice) + \
+                       ["-pix_fmt", "yuv420p", "-movflags", "+faststart", rendition_filename(primary_path, h)]
+        start = time.time()
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode == 0:
+            log_encode_rate(log_callback, choice, frames * len(targets), time.time() - start)
+            log_callback(f"Renditions written: {', '.join(f'{h}p' for h in targets)}")
+            return targets
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        log_callback(f"Rendition encode with {choice['codec']} failed: {error}")
+    raise RuntimeError("Rendition encode failed with every encoder.")
+
+def list_renditions(output_path):
+    """[{'height', 'filename'}] for the main output and every rendition file next to it, tallest first."""
+    if not os.path.exists(output_path):
+        return []
+    main_height = (probe_media(output_path) or {}).get('height')
+    found = [{'height': main_height, 'filename': os.path.basename(output_path)}]
+    for height in config.RENDITION_HEIGHTS:
+        path = rendition_filename(output_path, height)
+        if height != main_height and os.path.exists(path):
+            found.append({'height': height, 'filename': os.path.basename(path)})
+    return sorted(found, key=lambda r: r['height'] or 0, reverse=True)
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import config
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_key(*parts):
+    """Combines an input hash and pipeline options into a single cache key."""
+    return hashlib.sha256("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+def _json_default(value):
+    # Alignment output can contain numpy scalars/arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return float(value)
+
+
+# --- Content-Addressed Result Cache ---
+class ResultCache:
+    """
+    On-disk cache of intermediate pipeline artifacts (files and JSON) keyed by
+    content hash. Entries are evicted least-recently-used first once the total
+    size exceeds max_bytes; a hit refreshes the entry's mtime.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, key[:2], f"{key}{suffix}")
+
+    def _lookup(self, key, suffix):
+        path = self._path(key, suffix)
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                try: os.utime(path, None) # Mark as recently used
+                except OSError: pass
+                return path
+            self.misses += 1
+            return None
+
+    def _store(self, key, suffix, write_fn):
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write_fn(tmp_path)
+        os.replace(tmp_path, path) # Atomic so readers never see a partial entry
+        self.evict_to_budget()
+        return path
+
+    # --- Files (WAV, vocals) ---
+    def fetch_file(self, key, suffix, dst):
+        """
+        Places the cached file for key at dst and returns dst, or None on a miss.
+        The hard link is made under the lock, so eviction by another job's put
+        can't delete the entry in between; a copy (cross-device) that loses
+        that race counts as a miss.
+        """
+        path = self._path(key, suffix)
+        with self._lock:
+            if not os.path.exists(path):
+                self.misses += 1
+                return None
+            try: os.utime(path, None) # Mark as recently used
+            except OSError: pass
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(path, dst)
+                self.hits += 1
+                return dst
+            except OSError:
+                pass
+        try:
+            shutil.copyfile(path, dst)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return dst
+
+    def put_file(self, key, src_path, suffix):
+        """Stores a copy of src_path under key and returns the cached path."""
+        return self._store(key, suffix, lambda tmp: shutil.copyfile(src_path, tmp))
+
+    # --- JSON (segments) ---
+    def get_json(self, key):
+        path = self._lookup(key, '.json')
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, key, data):
+        def write(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, default=_json_default)
+        return self._store(key, '.json', write)
+
+    # --- Eviction ---
+    def evict_to_budget(self):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith('.tmp'): continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                        entries.append((st.st_mtime, st.st_size, path))
+                    except OSError:
+                        continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'max_bytes': self.max_bytes,
+            }
+
+
+RESULT_CACHE = ResultCache(config.RESULT_CACHE_DIR, config.RESULT_CACHE_MAX_MB * 1024 * 1024)
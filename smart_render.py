@@ -0,0 +1,204 @@
+"""
+Smart render for video inputs: only the time ranges that show lyrics are
+decoded, composited and re-encoded; the ranges in between (intros, solos,
+outros) are stream-copied from the input.
+
+Rendered ranges are widened to the input's IDR frames, so every copied range
+starts a closed GOP and can be cut without re-encoding. Rendered ranges use
+the input's frame rate and size. The pieces are joined with the concat
+demuxer converting each one to Annex B (see parallel_render.join_chunks), so
+every piece carries its own SPS/PPS in-band and the output is tagged avc3.
+Our encoder's SPS/PPS bytes (settings, VUI, reference count) therefore don't
+have to match the input's; the decoding format does (codec, profile, pixel
+format, size, aspect, field order). A one-frame test encode checks that
+before anything is rendered, and the finished pieces are checked again.
+This needs an H.264 input that doesn't need downscaling; otherwise, or when
+the formats don't match, the caller renders the whole timeline.
+"""
+import os
+import json
+import time
+import bisect
+import tempfile
+import subprocess
+import config
+from ffmpeg_render import probe_media
+from encoders import encoder_candidates, ffmpeg_args
+from parallel_render import render_chunks, join_chunks, default_workers
+
+# --- Planning ---
+def idr_times(input_path):
+    """
+    Presentation times of the H.264 IDR frames. Packets flagged as keyframes
+    also include open-GOP I-frames, whose leading B-frames reference the
+    previous GOP and can't be decoded after a cut. filter_units drops every
+    packet without an IDR slice (NAL type 5), so nothing is decoded.
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-nostats", "-copyts", "-i", input_path, "-map", "0:v:0", "-c", "copy",
+             "-bsf:v", "filter_units=pass_types=5", "-f", "framecrc", "-"],
+            capture_output=True, text=True, check=True
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return []
+    time_base, times = None, []
+    for line in result.stdout.splitlines():
+        if line.startswith('#tb 0:'):
+            num, _, den = line.split(':', 1)[1].strip().partition('/')
+            time_base = float(num) / float(den)
+        elif line and not line.startswith('#') and time_base:
+            fields = [field.strip() for field in line.split(',')]
+            try:
+                times.append(int(fields[2]) * time_base) # stream, dts, pts, duration, size, crc
+            except (IndexError, ValueError):
+                continue
+    return sorted(times)
+
+def stream_signature(path):
+    """
+    The video stream parameters that must be identical for pieces joined by
+    stream copy: codec, profile, pixel format, size, aspect and field order.
+    SPS/PPS bytes and level may differ, since each piece keeps its own
+    parameter sets in-band. None if the file can't be probed.
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=codec_name,profile,pix_fmt,width,height,sample_aspect_ratio,field_order",
+             "-of", "json", path],
+            capture_output=True, text=True, check=True
+        )
+        streams = json.loads(result.stdout).get('streams', [])
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+    if not streams:
+        return None
+    stream = streams[0]
+    return tuple(stream.get(key) for key in ('codec_name', 'profile', 'pix_fmt', 'width', 'height',
+                                             'sample_aspect_ratio', 'field_order'))
+
+def encoder_signature(info, work_dir):
+    """stream_signature of a one-frame encode at the input's size and frame rate with the render encoder."""
+    choice = encoder_candidates()[0]
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        probe_path = os.path.join(tmp, "probe.mp4")
+        command = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi",
+                   "-i", f"color=c=black:s={info['width']}x{info['height']}:r={info['fps']}",
+                   "-frames:v", "1", "-pix_fmt", "yuv420p", *ffmpeg_args(choice), probe_path]
+        if subprocess.run(command, capture_output=True).returncode != 0:
+            return None
+        return stream_signature(probe_path)
+
+def plan_ranges(segments, keyframes, duration):
+    """
+    Splits [0, duration] into ('render' | 'copy', start, end) pieces. Every
+    segment's on-screen time is inside a 'render' piece; render pieces start
+    and end on keyframes (IDR frames, see idr_times) or the end of the video,
+    so copy pieces need no re-encode.
+    """
+    keyframes = [k for k in keyframes if 0 <= k < duration] or [0.0]
+    if keyframes[0] > 0:
+        keyframes.insert(0, 0.0)
+    wanted = []
+    for seg in segments:
+        if not seg.get('text', '').strip():
+            continue
+        start = max(0.0, seg.get('start', 0))
+        end = min(duration, seg.get('end', start + 2))
+        if end <= start:
+            continue
+        k_start = keyframes[bisect.bisect_right(keyframes, start) - 1]
+        next_idx = bisect.bisect_right(keyframes, end)
+        k_end = keyframes[next_idx] if next_idx < len(keyframes) else duration
+        if wanted and k_start <= wanted[-1][1]:
+            wanted[-1][1] = max(wanted[-1][1], k_end)
+        else:
+            wanted.append([k_start, k_end])
+
+    pieces, position = [], 0.0
+    for start, end in wanted:
+        if start > position:
+            pieces.append(('copy', position, start))
+        pieces.append(('render', start, end))
+        position = end
+    if position < duration:
+        pieces.append(('copy', position, duration))
+    return pieces
+
+def copy_range(input_path, start, end, output_path, frame_seconds):
+    """Stream-copies [start, end) of the video track; start is a keyframe."""
+    # Seek a fraction of a frame past the keyframe so float rounding can't land on the previous one
+    command = ["ffmpeg", "-y", "-v", "error", "-nostats", "-ss", f"{start + frame_seconds / 4:.6f}", "-i", input_path,
+               "-t", f"{end - start:.6f}", "-map", "0:v:0", "-c", "copy", "-an",
+               "-avoid_negative_ts", "make_zero", output_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        raise RuntimeError(f"Copying {start:.2f}-{end:.2f}s failed: {error}")
+
+
+# --- Smart Render ---
+def render_smart(input_path, segments, output_filename, do_wipe_text, log_callback=print,
+                 audio_path_override=None, work_dir=None, workers=None, render_height=None):
+    """
+    Renders a video input by re-encoding only the lyric ranges and copying the
+    rest. Returns False (without writing the output) when the input doesn't
+    qualify, too little of it could be copied to be worth it, or the rendered
+    pieces' stream parameters wouldn't match the copied ones. Pieces go in
+    work_dir (a temporary directory if None).
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return render_smart(input_path, segments, output_filename, do_wipe_text, log_callback,
+                                audio_path_override, tmp, workers, render_height)
+    info = probe_media(input_path) or {}
+    if info.get('video_codec') != 'h264' or not info.get('height') or info['height'] > (render_height or config.RENDER_HEIGHT) \
+            or info['width'] % 2 or not info.get('fps') or not info.get('duration'):
+        log_callback(f"Smart render: input not eligible (codec={info.get('video_codec')}, "
+                     f"height={info.get('height')}); rendering the whole timeline.")
+        return False
+
+    audio_path = audio_path_override if audio_path_override and os.path.exists(audio_path_override) else input_path
+    audio_duration = (probe_media(audio_path) or {}).get('duration') if audio_path != input_path else None
+    duration = min(d for d in (info['duration'], audio_duration) if d)
+    pieces = plan_ranges(segments, idr_times(input_path), duration)
+    copied = sum(end - start for kind, start, end in pieces if kind == 'copy')
+    if copied < duration * config.SMART_RENDER_MIN_COPY_FRACTION:
+        log_callback(f"Smart render: only {copied:.1f}s of {duration:.1f}s could be copied; rendering the whole timeline.")
+        return False
+    source_signature = stream_signature(input_path)
+    if any(kind == 'render' for kind, _, _ in pieces) and (
+            source_signature is None or encoder_signature(info, work_dir) != source_signature):
+        log_callback("Smart render: the encoder's output format (profile, pixel format, size) differs from the "
+                     "input's, so the pieces can't be joined; rendering the whole timeline.")
+        return False
+
+    render_pieces = [(start, end) for kind, start, end in pieces if kind == 'render']
+    log_callback(f"Smart render: re-encoding {duration - copied:.1f}s in {len(render_pieces)} ranges, "
+                 f"stream-copying {copied:.1f}s.")
+    start_time = time.time()
+    piece_paths = [os.path.join(work_dir, f"piece_{i:03d}.mp4") for i in range(len(pieces))]
+    for (kind, start, end), path in zip(pieces, piece_paths):
+        if kind == 'copy':
+            copy_range(os.path.abspath(input_path), start, end, path, 1.0 / info['fps'])
+
+    if render_pieces:
+        workers = min(workers or default_workers(), len(render_pieces))
+        concurrent = workers * (config.STAGE_CONCURRENCY.get('encoding') or 1)
+        threads = config.ENCODER_THREADS or max(1, (os.cpu_count() or 1) // concurrent)
+        render_paths = [path for (kind, _, _), path in zip(pieces, piece_paths) if kind == 'render']
+        # Rendered at the input's frame rate so the pieces join into one consistent stream
+        render_chunks(input_path, segments, render_pieces, render_paths, True, do_wipe_text, workers, threads,
+                      log_callback, fps=info['fps'], render_height=render_height)
+        # The encoder can differ from the probed one (e.g. the software fallback after a hardware failure)
+        mismatched = [path for path in render_paths if stream_signature(path) != source_signature]
+        if mismatched:
+            log_callback(f"Smart render: {len(mismatched)} rendered pieces have different stream parameters than "
+                         f"the input; rendering the whole timeline.")
+            return False
+
+    join_chunks(piece_paths, audio_path, duration, output_filename, work_dir, in_band_parameter_sets=True)
+    log_callback(f"Smart render finished in {time.time() - start_time:.1f}s")
+    log_callback(f"Success! Lyrics video successfully generated: '{output_filename}'")
+    return True
@@ -0,0 +1,150 @@
+"""
+Per-stage timing history and run-time prediction.
+
+Every stage that actually runs (not resumed from a checkpoint, not served from
+the result cache) records how long it took against the media duration and a
+variant key: the job options that change that stage's cost (Whisper model,
+render engine, karaoke, output height, ...). A prediction fits
+seconds = fixed + rate * media_seconds by least squares over the newest
+samples of the same stage and variant, falls back to the stage's other
+variants, and finally to config.STAGE_DEFAULT_RATES. Predictions are made
+once per job (when it is queued) and stored with the task.
+"""
+import os
+import time
+import sqlite3
+import threading
+import config
+from renditions import primary_height
+
+def stage_variant(stage, options):
+    """The part of the job options that changes the cost of stage."""
+    if stage == 'separate':
+        if not options.get('do_separate_vocals'):
+            return 'off'
+        return 'speculative' if options.get('speculative_separation') else 'demucs'
+    if stage == 'transcribe':
+        model = str(options.get('model', config.WHISPER_MODEL))
+        speculative = options.get('do_separate_vocals') and options.get('speculative_separation')
+        return f"{model}|speculative" if speculative else model
+    if stage == 'align':
+        return 'on' if options.get('do_wipe_text') else 'off'
+    if stage == 'render':
+        if not options.get('render_video', True):
+            return 'off'
+        parts = [options.get('render_engine', config.RENDER_ENGINE),
+                 'karaoke' if options.get('do_wipe_text') else 'phrase',
+                 'video' if options.get('is_video') else 'audio',
+                 f"{primary_height(options)}p"]
+        parts += [flag for flag in ('parallel_render', 'smart_render') if options.get(flag)]
+        return '|'.join(parts)
+    return ''
+
+def fit(samples):
+    """(fixed, rate) for seconds = fixed + rate * media_seconds, from [(media_seconds, seconds)]."""
+    samples = [(x, y) for x, y in samples if x and x > 0]
+    if not samples:
+        return None
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if n >= 3 and var_x > 0:
+        rate = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+        fixed = mean_y - rate * mean_x
+        if rate >= 0 and fixed >= 0:
+            return fixed, rate
+    # Too few or too similar samples (or a nonsensical line): plain throughput
+    return 0.0, sum(y for _, y in samples) / sum(x for x, _ in samples)
+
+
+class StageHistory:
+    def __init__(self, path, sample_limit):
+        self.path = path
+        self.sample_limit = sample_limit
+        self._local = threading.local()
+        self._fits = {} # (stage, variant) -> (fixed, rate) or None; dropped when a sample is recorded
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS stage_timings (
+                stage TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                media_seconds REAL NOT NULL,
+                seconds REAL NOT NULL,
+                recorded REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS stage_timings_by_variant ON stage_timings (stage, variant, recorded);
+        """)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, stage, variant, media_seconds, seconds):
+        if not media_seconds or media_seconds <= 0:
+            return
+        connection = self._connection()
+        connection.execute("INSERT INTO stage_timings VALUES (?, ?, ?, ?, ?)",
+                           (stage, variant, float(media_seconds), float(seconds), time.time()))
+        # Keep a bounded history per variant
+        connection.execute("""DELETE FROM stage_timings WHERE rowid IN (
+                                  SELECT rowid FROM stage_timings WHERE stage = ? AND variant = ?
+                                  ORDER BY recorded DESC LIMIT -1 OFFSET ?)""",
+                           (stage, variant, self.sample_limit))
+        with self._lock:
+            self._fits.pop((stage, variant), None)
+            self._fits.pop((stage, None), None)
+
+    def _fit(self, stage, variant):
+        """Fit for one variant, or for all of the stage's samples when variant is None."""
+        key = (stage, variant)
+        with self._lock:
+            if key in self._fits:
+                return self._fits[key]
+        if variant is None:
+            rows = self._connection().execute(
+                "SELECT media_seconds, seconds FROM stage_timings WHERE stage = ? ORDER BY recorded DESC LIMIT ?",
+                (stage, self.sample_limit)).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT media_seconds, seconds FROM stage_timings WHERE stage = ? AND variant = ? "
+                "ORDER BY recorded DESC LIMIT ?", (stage, variant, self.sample_limit)).fetchall()
+        result = fit(rows)
+        with self._lock:
+            self._fits[key] = result
+        return result
+
+    def predict(self, stage, variant, media_seconds):
+        """Predicted seconds for one stage run."""
+        if variant == 'off':
+            return 0.0 # Skipped stages; other variants' samples say nothing about them
+        model = self._fit(stage, variant) or self._fit(stage, None)
+        if model is None:
+            return config.STAGE_DEFAULT_RATES.get(stage, 1.0) * media_seconds
+        fixed, rate = model
+        return fixed + rate * media_seconds
+
+    def predict_job(self, options, media_seconds, stages):
+        """{stage: predicted seconds} in pipeline order, or None when the media duration is unknown."""
+        if not media_seconds:
+            return None
+        return {stage: round(self.predict(stage, stage_variant(stage, options), media_seconds), 1) for stage in stages}
+
+    def stats(self):
+        rows = self._connection().execute(
+            "SELECT stage, variant, COUNT(*) FROM stage_timings GROUP BY stage, variant ORDER BY stage, variant").fetchall()
+        report = {}
+        for stage, variant, count in rows:
+            fixed, rate = self._fit(stage, variant)
+            report[f"{stage}:{variant}" if variant else stage] = {
+                'samples': count, 'fixed_seconds': round(fixed, 2), 'seconds_per_media_second': round(rate, 3)}
+        return report
+
+
+STAGE_HISTORY = StageHistory(config.STAGE_HISTORY_PATH, config.STAGE_HISTORY_SIZE)
@@ -0,0 +1,70 @@
+"""
+Change notification for task status, used by the /events Server-Sent Events stream.
+
+Writers call notify(task_id) after changing a task (new log line, status,
+stage); stream handlers subscribe to their task and block in wait() until it
+changed or the heartbeat timeout passes, then send only what is new since
+their cursor. A change to one task only wakes the streams of that task.
+"""
+import json
+import threading
+from contextlib import contextmanager
+
+TERMINAL_STATUSES = ('complete', 'failed', 'cancelled', 'not_found')
+
+class TaskNotifier:
+    """
+    Per-task version counters, each with its own condition on a shared lock:
+    wait() returns once the task's version moves past the caller's. Counters
+    only exist while a stream is subscribed, so notify() is a dict lookup for
+    tasks nobody is watching.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {} # task_id -> {'condition', 'version', 'subscribers'}
+
+    @contextmanager
+    def subscribe(self, task_id):
+        """Keeps the task's counter for the duration of the block, so no change is missed between waits."""
+        with self._lock:
+            entry = self._tasks.setdefault(task_id, {'condition': threading.Condition(self._lock),
+                                                     'version': 0, 'subscribers': 0})
+            entry['subscribers'] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry['subscribers'] -= 1
+                if entry['subscribers'] == 0:
+                    del self._tasks[task_id]
+
+    def notify(self, task_id):
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is not None:
+                entry['version'] += 1
+                entry['condition'].notify_all()
+
+    def wait(self, task_id, last_version, timeout):
+        """
+        Blocks until the task's version differs from last_version or timeout
+        passes. Returns the current version. Call inside subscribe(task_id).
+        """
+        with self._lock:
+            entry = self._tasks[task_id]
+            entry['condition'].wait_for(lambda: entry['version'] != last_version, timeout)
+            return entry['version']
+
+
+def sse_message(event, data, event_id=None):
+    """Formats one Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+TASK_EVENTS = TaskNotifier()
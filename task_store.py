@@ -0,0 +1,318 @@
+"""
+Task status storage for the web app.
+
+A task record is a small dict of fields ('status', 'output_filename',
+'segments', ...) plus an append-only log and, for retryable tasks, the job
+tuple (input_path, output_path, options). Log lines are numbered from 0; only
+the newest config.TASK_LOG_MAX_LINES are kept, but numbering continues, so a
+log cursor stays valid after old lines are dropped. Finished tasks are removed
+config.TASK_TTL_SECONDS after their last update; the store's on_expire callback
+is then called with each removed task_id (e.g. to delete its checkpoint files).
+
+MemoryTaskStore lives in one process. SQLiteTaskStore keeps tasks in a WAL-mode
+database file, so they survive a restart and several web workers can share them.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+import config
+from result_cache import _json_default
+
+FINISHED_STATUSES = ('complete', 'failed', 'cancelled')
+
+def _apply(record, fields):
+    """Merges fields into record; a None value removes the field."""
+    for key, value in fields.items():
+        if value is None:
+            record.pop(key, None)
+        else:
+            record[key] = value
+
+def _notify_expired(on_expire, task_ids):
+    if on_expire is None:
+        return
+    for task_id in task_ids:
+        try:
+            on_expire(task_id)
+        except Exception as e:
+            print(f"[TaskStore] Cleanup of expired task {task_id} failed: {e}")
+
+
+# --- In-Memory Backend ---
+class MemoryTaskStore:
+    shared = False # Only visible to this process
+
+    def __init__(self, ttl_seconds, log_max_lines, on_expire=None):
+        self.ttl_seconds = ttl_seconds
+        self.log_max_lines = log_max_lines
+        self.on_expire = on_expire
+        self._lock = threading.Lock()
+        self._tasks = {} # task_id -> {'fields', 'log', 'log_count', 'job', 'updated'}
+        self._by_status = {} # status -> set of task_ids
+        self._last_expiry = time.time()
+
+    def _index(self, task_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        if old_status is not None:
+            self._by_status.get(old_status, set()).discard(task_id)
+        if new_status is not None:
+            self._by_status.setdefault(new_status, set()).add(task_id)
+
+    def create(self, task_id, fields):
+        self.maybe_expire()
+        with self._lock:
+            fields = dict(fields)
+            self._tasks[task_id] = {'fields': fields, 'log': deque(maxlen=self.log_max_lines), 'log_count': 0,
+                                    'job': None, 'updated': time.time()}
+            self._index(task_id, None, fields.get('status'))
+
+    def exists(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def get(self, task_id):
+        """A copy of the task's fields (without the log), or None."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task['fields']) if task else None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return False
+            old_status = task['fields'].get('status')
+            _apply(task['fields'], fields)
+            task['updated'] = time.time()
+            self._index(task_id, old_status, task['fields'].get('status'))
+            return True
+
+    def append_log(self, task_id, message):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return False
+            task['log'].append(message)
+            task['log_count'] += 1
+            task['updated'] = time.time()
+            return True
+
+    def read_log(self, task_id, since=0):
+        """(lines from cursor `since` on, next cursor). Lines already dropped by the cap are skipped."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return [], 0
+            first = task['log_count'] - len(task['log'])
+            return list(task['log'])[max(since - first, 0):], task['log_count']
+
+    def set_job(self, task_id, job):
+        with self._lock:
+            if task_id in self._tasks:
+                self._tasks[task_id]['job'] = job
+
+    def get_job(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return task['job'] if task else None
+
+    def delete(self, task_id):
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task:
+                self._index(task_id, task['fields'].get('status'), None)
+
+    def ids_with_status(self, status):
+        with self._lock:
+            return sorted(self._by_status.get(status, ()))
+
+    def expire(self):
+        """Removes finished tasks not updated for ttl_seconds. Returns the number removed."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._last_expiry = time.time()
+            expired = [task_id for status in FINISHED_STATUSES for task_id in self._by_status.get(status, ())
+                       if self._tasks[task_id]['updated'] < cutoff]
+            for task_id in expired:
+                task = self._tasks.pop(task_id)
+                self._index(task_id, task['fields'].get('status'), None)
+        _notify_expired(self.on_expire, expired)
+        return len(expired)
+
+    def maybe_expire(self):
+        if time.time() - self._last_expiry >= config.TASK_EXPIRY_INTERVAL_SECONDS:
+            self.expire()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'tasks': len(self._tasks),
+                    'by_status': {status: len(ids) for status, ids in self._by_status.items() if ids}}
+
+
+# --- SQLite Backend ---
+class SQLiteTaskStore:
+    shared = True # Other processes using the same file see the same tasks
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            status TEXT,
+            fields TEXT NOT NULL,
+            job TEXT,
+            log_count INTEGER NOT NULL DEFAULT 0,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, updated);
+        CREATE TABLE IF NOT EXISTS task_log (
+            task_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            line TEXT NOT NULL,
+            PRIMARY KEY (task_id, seq)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, ttl_seconds, log_max_lines, on_expire=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.log_max_lines = log_max_lines
+        self.on_expire = on_expire
+        self._local = threading.local() # One connection per thread
+        self._last_expiry = time.time()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; writes open their own BEGIN IMMEDIATE transaction
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _write(self, fn):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def create(self, task_id, fields):
+        self.maybe_expire()
+        fields = dict(fields)
+        status = fields.pop('status', None)
+        self._write(lambda c: (
+            c.execute("DELETE FROM task_log WHERE task_id = ?", (task_id,)),
+            c.execute("INSERT OR REPLACE INTO tasks (task_id, status, fields, log_count, updated) VALUES (?, ?, ?, 0, ?)",
+                      (task_id, status, json.dumps(fields, default=_json_default), time.time()))))
+
+    def exists(self, task_id):
+        return self._connection().execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone() is not None
+
+    def get(self, task_id):
+        row = self._connection().execute("SELECT status, fields FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        fields = json.loads(row[1])
+        if row[0] is not None:
+            fields['status'] = row[0]
+        return fields
+
+    def update(self, task_id, **fields):
+        def update_row(c):
+            row = c.execute("SELECT status, fields FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return False
+            record = json.loads(row[1])
+            record['status'] = row[0]
+            _apply(record, fields)
+            status = record.pop('status', None)
+            c.execute("UPDATE tasks SET status = ?, fields = ?, updated = ? WHERE task_id = ?",
+                      (status, json.dumps(record, default=_json_default), time.time(), task_id))
+            return True
+        return self._write(update_row)
+
+    def append_log(self, task_id, message):
+        def append(c):
+            row = c.execute("SELECT log_count FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return False
+            seq = row[0]
+            c.execute("INSERT INTO task_log (task_id, seq, line) VALUES (?, ?, ?)", (task_id, seq, str(message)))
+            c.execute("UPDATE tasks SET log_count = ?, updated = ? WHERE task_id = ?", (seq + 1, time.time(), task_id))
+            if seq >= self.log_max_lines:
+                c.execute("DELETE FROM task_log WHERE task_id = ? AND seq <= ?", (task_id, seq - self.log_max_lines))
+            return True
+        return self._write(append)
+
+    def read_log(self, task_id, since=0):
+        """(lines from cursor `since` on, next cursor). Lines already dropped by the cap are skipped."""
+        connection = self._connection()
+        row = connection.execute("SELECT log_count FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return [], 0
+        lines = connection.execute("SELECT line FROM task_log WHERE task_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                                   (task_id, max(since, 0), row[0])).fetchall()
+        return [line for (line,) in lines], row[0]
+
+    def set_job(self, task_id, job):
+        self._write(lambda c: c.execute("UPDATE tasks SET job = ? WHERE task_id = ?",
+                                        (json.dumps(job, default=_json_default), task_id)))
+
+    def get_job(self, task_id):
+        row = self._connection().execute("SELECT job FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return tuple(json.loads(row[0])) if row and row[0] else None
+
+    def delete(self, task_id):
+        self._write(lambda c: (c.execute("DELETE FROM task_log WHERE task_id = ?", (task_id,)),
+                               c.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))))
+
+    def ids_with_status(self, status):
+        rows = self._connection().execute("SELECT task_id FROM tasks WHERE status = ? ORDER BY task_id", (status,))
+        return [task_id for (task_id,) in rows.fetchall()]
+
+    def expire(self):
+        """Removes finished tasks not updated for ttl_seconds. Returns the number removed."""
+        self._last_expiry = time.time()
+        cutoff = time.time() - self.ttl_seconds
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        def remove(c):
+            expired = [task_id for (task_id,) in c.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND updated < ?",
+                (*FINISHED_STATUSES, cutoff)).fetchall()]
+            for task_id in expired:
+                c.execute("DELETE FROM task_log WHERE task_id = ?", (task_id,))
+                c.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            return expired
+        expired = self._write(remove)
+        _notify_expired(self.on_expire, expired)
+        return len(expired)
+
+    def maybe_expire(self):
+        if time.time() - self._last_expiry >= config.TASK_EXPIRY_INTERVAL_SECONDS:
+            self.expire()
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return {'backend': 'sqlite', 'path': self.path, 'tasks': sum(count for _, count in rows),
+                'by_status': {status: count for status, count in rows}}
+
+
+def open_task_store(backend=None, on_expire=None):
+    """Creates the store selected by config.TASK_STORE ('sqlite' or 'memory')."""
+    backend = backend or config.TASK_STORE
+    if backend == 'memory':
+        return MemoryTaskStore(config.TASK_TTL_SECONDS, config.TASK_LOG_MAX_LINES, on_expire)
+    if backend == 'sqlite':
+        return SQLiteTaskStore(config.TASK_DB_PATH, config.TASK_TTL_SECONDS, config.TASK_LOG_MAX_LINES, on_expire)
+    raise ValueError(f"Unknown task store backend: {backend}")
@@ -0,0 +1,160 @@
+import os
+import re
+import threading
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+import config
+
+# --- Colors ---
+def parse_color(color):
+    """
+    Parses the color strings used in config (ImageMagick style) into an RGBA tuple:
+    named colors ('white'), 'grayNN' (NN percent), '#rrggbb', 'rgb(r, g, b)'
+    and 'rgba(r, g, b, a)' with a as 0-1 float or 0-255 int.
+    """
+    if color is None:
+        return None
+    if isinstance(color, (tuple, list)):
+        return tuple(color) + (255,) * (4 - len(color))
+    text = color.strip().lower()
+    gray = re.fullmatch(r'gr[ae]y(\d{1,3})', text)
+    if gray:
+        level = int(round(int(gray.group(1)) * 255 / 100))
+        return (level, level, level, 255)
+    rgba = re.fullmatch(r'rgba\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*([\d.]+)\s*\)', text)
+    if rgba:
+        r, g, b = (int(rgba.group(i)) for i in range(1, 4))
+        a = float(rgba.group(4))
+        alpha = int(round(a * 255)) if a <= 1.0 else int(a) # 0-1 fraction or 0-255
+        return (r, g, b, max(0, min(255, alpha)))
+    return ImageColor.getcolor(text, 'RGBA')
+
+
+# --- Fonts ---
+def _font_candidates(font_name):
+    candidates = list(config.FONT_FILES.get(font_name, []))
+    candidates += [font_name, f"{font_name}.ttf"]
+    return candidates
+
+@lru_cache(maxsize=32)
+def load_font(font_name, size):
+    """Resolves an ImageMagick-style font name (e.g. 'Arial-Bold') to a FreeType font."""
+    for candidate in _font_candidates(font_name):
+        for path in [candidate] + [os.path.join(d, candidate) for d in config.FONT_DIRS]:
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+    return ImageFont.load_default(size=size)
+
+
+# --- Glyph Atlas ---
+class GlyphAtlas:
+    """
+    Rasterizes each character once per (font, size, color) and composes lines of
+    text from the cached glyph masks with numpy, without spawning ImageMagick.
+    """
+
+    def __init__(self, font_name, size, color):
+        self.font = load_font(font_name, size)
+        self.size = size
+        self.color = parse_color(color)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent
+        self._glyphs = {} # char -> (alpha mask uint8 (h, w), advance float)
+        self._lock = threading.Lock()
+
+    def glyph(self, ch):
+        cached = self._glyphs.get(ch)
+        if cached is not None:
+            return cached
+        advance = self.font.getlength(ch)
+        # Draw with some slack so bold/italic overhangs are not clipped at the advance width
+        pad = self.size // 4
+        canvas = Image.new('L', (int(np.ceil(advance)) + 2 * pad, self.line_height), 0)
+        ImageDraw.Draw(canvas).text((pad, 0), ch, font=self.font, fill=255)
+        entry = (np.asarray(canvas, dtype=np.uint8), advance, pad)
+        with self._lock:
+            self._glyphs[ch] = entry
+        return entry
+
+    def measure(self, text):
+        """Width of a single line in pixels."""
+        return int(np.ceil(sum(self.glyph(ch)[1] for ch in text)))
+
+    def render_mask(self, text):
+        """Alpha mask (h, w) uint8 for one line of text."""
+        width = max(1, self.measure(text))
+        pad = self.size // 4
+        mask = np.zeros((self.line_height, width + 2 * pad), dtype=np.uint8)
+        x = 0.0
+        for ch in text:
+            glyph, advance, gpad = self.glyph(ch)
+            left = int(round(x)) + pad - gpad
+            right = min(left + glyph.shape[1], mask.shape[1])
+            np.maximum(mask[:, left:right], glyph[:, :right - left], out=mask[:, left:right])
+            x += advance
+        return mask[:, pad:pad + width] # Trim the slack so the line box matches the text advance
+
+    def wrap(self, text, max_width):
+        """Greedy word wrap to max_width pixels."""
+        lines, current = [], ""
+        for word in text.split():
+            candidate = f"{current} {word}" if current else word
+            if current and self.measure(candidate) > max_width:
+                lines.append(current)
+                current = word
+            else:
+                current = candidate
+        if current:
+            lines.append(current)
+        return lines or [""]
+
+
+@lru_cache(maxsize=64)
+def get_atlas(font_name, size, color):
+    return GlyphAtlas(font_name, size, color)
+
+
+# --- Text Images ---
+def render_text_rgba(text, font_name, size, color, bg_color=None, box_width=None, padding=None):
+    """
+    Renders text to an RGBA uint8 array (h, w, 4).
+    Without box_width the image is tight around one line (like TextClip 'label');
+    with box_width, text is word-wrapped and centered in a box of that width
+    (like TextClip 'caption'). bg_color fills the whole box.
+    """
+    atlas = get_atlas(font_name, size, color)
+    padding = (size // 8) if padding is None else padding
+    if box_width:
+        lines = atlas.wrap(text, max(1, int(box_width) - 2 * padding))
+        width = int(box_width)
+    else:
+        lines = [text]
+        width = atlas.measure(text) + 2 * padding
+    height = atlas.line_height * len(lines) + 2 * padding
+
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    for i, line in enumerate(lines):
+        mask = atlas.render_mask(line)
+        y = padding + i * atlas.line_height
+        x = max(0, (width - mask.shape[1]) // 2)
+        w = min(mask.shape[1], width - x)
+        alpha[y:y + mask.shape[0], x:x + w] = mask[:, :w]
+
+    # Composite text color over the (possibly translucent) background
+    fg = np.array(atlas.color, dtype=np.float32)
+    a = (alpha.astype(np.float32) / 255.0 * fg[3] / 255.0)[:, :, None]
+    if bg_color is not None:
+        bg = np.array(parse_color(bg_color), dtype=np.float32)
+        bg_a = bg[3] / 255.0
+        out_a = a + bg_a * (1 - a)
+        rgb = (fg[:3] * a + bg[:3] * bg_a * (1 - a)) / np.maximum(out_a, 1e-6)
+    else:
+        out_a = a
+        rgb = np.broadcast_to(fg[:3], a.shape[:2] + (3,))
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[:, :, :3] = np.clip(rgb, 0, 255).astype(np.uint8)
+    rgba[:, :, 3] = np.clip(out_a[:, :, 0] * 255.0, 0, 255).astype(np.uint8)
+    return rgba
@@ -1,33 +1,229 @@
+import os
 import whisper
 import whisperx # For forced alignment
 import torch # For checking device
+import numpy as np
+import config
+from model_registry import ModelRegistry
+from metrics import timed
+from audio_processing import open_audio
+
+def get_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def set_torch_threads(threads=None):
+    """Sets torch's CPU thread count (process-wide, so only called at startup). Default: config.TORCH_THREADS."""
+    threads = config.TORCH_THREADS if threads is None else threads
+    if threads:
+        torch.set_num_threads(threads)
+
+# --- Transcription Backends ---
+# Every backend returns segments in openai-whisper's dict shape
+# (start/end/text/avg_logprob/no_speech_prob/..., plus 'words' when requested),
+# which is what the pipeline and the video generators consume.
+class WhisperBackend:
+    """openai-whisper (PyTorch)."""
+    name = "whisper"
+
+    def load(self, model_name, device):
+        return whisper.load_model(model_name, device=device)
+
+    def transcribe(self, model, audio, word_timestamps=False, batch_size=None):
+        # openai-whisper decodes one 30 s window at a time; batch_size is ignored
+        result = model.transcribe(audio, language='en', fp16=False, word_timestamps=word_timestamps)
+        return result.get('segments', [])
+
+
+class FasterWhisperBackend:
+    """faster-whisper (CTranslate2), int8-quantized by default for CPU hosts."""
+    name = "faster-whisper"
+
+    def load(self, model_name, device):
+        from faster_whisper import WhisperModel # Imported lazily; faster-whisper is optional
+        from faster_whisper.utils import download_model
+        compute_type = config.FASTER_WHISPER_COMPUTE_TYPE if device == "cpu" else "float16"
+        model_path = model_name if os.path.isdir(model_name) else download_model(model_name)
+        model = WhisperModel(model_path, device=device, compute_type=compute_type, cpu_threads=config.FASTER_WHISPER_CPU_THREADS)
+        model.model_path = model_path # The registry sizes CTranslate2 models from their files on disk
+        return model
+
+    def transcribe(self, model, audio, word_timestamps=False, batch_size=None):
+        if batch_size:
+            # Batched decoding of VAD chunks (faster-whisper >= 1.1)
+            from faster_whisper import BatchedInferencePipeline
+            batched = BatchedInferencePipeline(model=model)
+            segments_iter, _info = batched.transcribe(audio, language='en', word_timestamps=word_timestamps, batch_size=batch_size)
+        else:
+            segments_iter, _info = model.transcribe(audio, language='en', word_timestamps=word_timestamps)
+        segments = []
+        for seg in segments_iter: # Generator: decoding happens while iterating
+            segment = {
+                'id': seg.id,
+                'seek': seg.seek,
+                'start': seg.start,
+                'end': seg.end,
+                'text': seg.text,
+                'tokens': list(seg.tokens),
+                'temperature': seg.temperature,
+                'avg_logprob': seg.avg_logprob,
+                'compression_ratio': seg.compression_ratio,
+                'no_speech_prob': seg.no_speech_prob,
+            }
+            if word_timestamps:
+                segment['words'] = [
+                    {'word': w.word, 'start': w.start, 'end': w.end, 'probability': w.probability}
+                    for w in (seg.words or [])
+                ]
+            segments.append(segment)
+        return segments
+
+
+BACKENDS = {backend.name: backend for backend in (WhisperBackend(), FasterWhisperBackend())}
+
+def resolve_model(model_name):
+    """
+    Splits a model spec into (backend, model_name). The 'model' form field may
+    name a backend explicitly ("faster-whisper:small.en"); otherwise
+    config.TRANSCRIPTION_BACKEND is used.
+    """
+    backend_name = config.TRANSCRIPTION_BACKEND
+    if ':' in model_name:
+        backend_name, model_name = model_name.split(':', 1)
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{backend_name}'. Available: {', '.join(BACKENDS)}")
+    return BACKENDS[backend_name], model_name
+
+def model_key(model_name, device=None):
+    """Registry key for a model spec: (backend name, model name, device)."""
+    backend, bare_name = resolve_model(model_name)
+    return (backend.name, bare_name, device or get_device())
+
+# --- Shared Transcription Model Registry ---
+# Whisper installs kv-cache hooks on the model during decoding, so a model
+# instance must only be used by one thread at a time (exclusive_use=True).
+WHISPER_MODELS = ModelRegistry(
+    "whisper",
+    lambda backend_name, model_name, device: BACKENDS[backend_name].load(model_name, device),
+    memory_budget_mb=config.WHISPER_MODEL_MEMORY_BUDGET_MB,
+    exclusive_use=True,
+)
+
+# --- Shared WhisperX Alignment Model Registry ---
+# whisperx.load_align_model returns (model, metadata); the pair is cached per (language, device).
+ALIGN_MODELS = ModelRegistry(
+    "align",
+    lambda language_code, device: whisperx.load_align_model(language_code=language_code, device=device),
+    max_entries=config.ALIGN_MODEL_CACHE_SIZE,
+)
+
+def warm_up_whisper_model(model_name=None, log_callback=print):
+    """Loads a Whisper model into the registry so the first job doesn't pay for it."""
+    model_name = model_name or config.WHISPER_MODEL
+    try:
+        WHISPER_MODELS.preload(model_key(model_name), log_callback)
+    except Exception as e:
+        log_callback(f"Warning: Could not warm up Whisper model '{model_name}': {e}")
 
 # --- Transcription Function ---
 # <<< FIX: Added word_timestamps_needed=False as an argument >>>
-def transcribe_audio(wav_path, model_name, log_callback=print, word_timestamps_needed=False):
+@timed('whisper')
+def transcribe_audio(audio_path, model_name, log_callback=print, word_timestamps_needed=False, batch_size=None):
     """
-    Transcribes a WAV file using Whisper. Optionally requests word timestamps
-    directly from Whisper if word_timestamps_needed is True.
+    Transcribes audio with the backend selected by model_name (see resolve_model).
+    audio_path may be raw extracted audio (memory-mapped, no decode), any audio
+    file, or a 16 kHz float32 array. Optionally requests word timestamps
+    directly from Whisper if word_timestamps_needed is True. batch_size enables
+    batched decoding on backends that support it.
     """
     try:
         log_callback(f"Loading Whisper model '{model_name}'...")
         # Determine device
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        log_callback(f"Whisper model loaded onto {device}.") # Log device
-        model = whisper.load_model(model_name, device=device)
+        key = model_key(model_name)
+        backend = BACKENDS[key[0]]
+        with WHISPER_MODELS.acquire(key, log_callback) as model:
+            log_callback(f"Whisper model ready on {key[2]} ({backend.name} backend).") # Log device
 
-        log_callback("Starting transcription...")
-        # <<< FIX: Pass word_timestamps=word_timestamps_needed >>>
-        result = model.transcribe(wav_path, language='en', fp16=False, word_timestamps=word_timestamps_needed)
+            log_callback("Starting transcription...")
+            # <<< FIX: Pass word_timestamps=word_timestamps_needed >>>
+            audio = open_audio(audio_path) if isinstance(audio_path, str) else audio_path
+            segments = backend.transcribe(model, audio, word_timestamps=word_timestamps_needed, batch_size=batch_size)
 
-        segments = result.get('segments', [])
         log_callback(f"Transcription complete. Found {len(segments)} segments.")
         return segments
     except Exception as e:
         log_callback(f"An error occurred during transcription: {e}")
         return []
 
+# --- Selective Re-transcription ---
+def is_low_confidence(segment):
+    """Whisper's own confidence signals: low average log-probability or likely no speech."""
+    return (segment.get('avg_logprob', 0.0) < config.SPECULATIVE_MIN_AVG_LOGPROB or
+            segment.get('no_speech_prob', 0.0) > config.SPECULATIVE_MAX_NO_SPEECH_PROB)
+
+@timed('whisper')
+def retranscribe_segments(audio_path, segments, indices, model_name, log_callback=print, word_timestamps_needed=False):
+    """
+    Re-transcribes only segments[i] for i in indices using a different audio
+    source (e.g. the separated vocal stem, as a path or a 16 kHz float32
+    array). Each segment's time range is cut out of the audio, transcribed,
+    and its timestamps shifted back to the global timeline. Returns a new segments list; segments whose replacement
+    fails or comes back empty are kept as they were.
+    """
+    if not indices:
+        return segments
+    try:
+        audio = open_audio(audio_path) if isinstance(audio_path, str) else audio_path # 16 kHz mono float32
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+    except Exception as e:
+        log_callback(f"Could not load audio for re-transcription: {e}")
+        return segments
+
+    sample_rate = whisper.audio.SAMPLE_RATE
+    pad = 0.25 # Seconds of context on either side of the segment
+    result_segments = list(segments)
+    key = model_key(model_name)
+    backend = BACKENDS[key[0]]
+    with WHISPER_MODELS.acquire(key, log_callback) as model:
+        for i in sorted(indices, reverse=True): # Reverse so replacements don't shift later indices
+            seg = segments[i]
+            clip_start = max(0.0, seg.get('start', 0.0) - pad)
+            clip_end = min(len(audio) / sample_rate, seg.get('end', clip_start) + pad)
+            clip = np.array(audio[int(clip_start * sample_rate):int(clip_end * sample_rate)], dtype=np.float32)
+            if len(clip) == 0:
+                continue
+            try:
+                clip_segments = backend.transcribe(model, clip, word_timestamps=word_timestamps_needed)
+            except Exception as e:
+                log_callback(f"Re-transcription of segment {i} failed: {e}")
+                continue
+            replacements = [r for r in clip_segments if r.get('text', '').strip()]
+            if not replacements:
+                continue
+            for r in replacements:
+                r['start'] = r.get('start', 0.0) + clip_start
+                r['end'] = r.get('end', 0.0) + clip_start
+                for w in r.get('words', []) or []:
+                    if 'start' in w: w['start'] += clip_start
+                    if 'end' in w: w['end'] += clip_start
+            result_segments[i:i + 1] = replacements
+    for idx, seg in enumerate(result_segments):
+        seg['id'] = idx
+    log_callback(f"Re-transcribed {len(indices)} low-confidence segments on the vocal stem.")
+    return result_segments
+
+def preload_align_models(languages=None, log_callback=print):
+    """Loads alignment models for the given languages (default: config.PRELOAD_ALIGN_LANGUAGES)."""
+    languages = config.PRELOAD_ALIGN_LANGUAGES if languages is None else languages
+    device = get_device()
+    for language_code in languages:
+        try:
+            ALIGN_MODELS.preload((language_code, device), log_callback)
+        except Exception as e:
+            log_callback(f"Warning: Could not preload alignment model for '{language_code}': {e}")
+
 # --- Forced Alignment Function ---
+@timed('alignment')
 def perform_forced_alignment(audio_path, segments, detected_language, log_callback=print):
     """
     Performs forced alignment using WhisperX to get accurate word timestamps.
@@ -38,17 +234,18 @@ def perform_forced_alignment(audio_path, segments, detected_language, log_callba
 
     try:
         log_callback("Starting forced alignment with WhisperX...")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = get_device()
         batch_size = 16 # According to WhisperX docs
 
-        # 1. Load Alignment Model & Metadata
+        # 1. Load Alignment Model & Metadata (cached per language)
         log_callback(f"Loading WhisperX alignment model on {device}...")
-        model_a, metadata = whisperx.load_align_model(language_code=detected_language, device=device)
+        model_a, metadata = ALIGN_MODELS.get((detected_language, device), log_callback)
         log_callback("Alignment model loaded.")
 
         # 2. Align whisper output
         log_callback("Aligning segments...")
-        result_aligned = whisperx.align(segments, model_a, metadata, audio_path, device, return_char_alignments=False)
+        audio = open_audio(audio_path) if isinstance(audio_path, str) else audio_path
+        result_aligned = whisperx.align(segments, model_a, metadata, audio, device, return_char_alignments=False)
         aligned_segments = result_aligned.get("segments")
 
         if not aligned_segments:
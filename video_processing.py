@@ -3,9 +3,136 @@ import numpy as np
 import os
 import config # Import config for style constants
 import math # Import math for ceiling function
+import time
+import subprocess
+import tempfile
+from PIL import Image
+from encoders import encoder_candidates, ffmpeg_args, moviepy_kwargs, describe, log_encode_rate
+from ffmpeg_render import render_size, canvas_size
+from text_render import render_text_rgba # Glyph-atlas text rasterizer
+from metrics import timed
+
+# --- Text Clip Factory ---
+@timed('text_clip')
+def make_text_clip(text, fontsize, font, color, bg_color=None, box_width=None):
+    """
+    Creates a text clip with either the glyph-atlas renderer (no ImageMagick
+    process per clip) or MoviePy's TextClip, depending on config.TEXT_RENDERER.
+    With box_width the text wraps inside a box of that width ('caption'),
+    otherwise the clip is tight around a single line ('label').
+    """
+    if config.TEXT_RENDERER == "atlas":
+        rgba = render_text_rgba(text, font, int(fontsize), color, bg_color=bg_color, box_width=box_width)
+        return mp.ImageClip(rgba, transparent=True) # Alpha channel becomes the clip mask
+
+    text_kwargs = {"fontsize": fontsize, "font": font, "color": color}
+    if bg_color:
+        text_kwargs["bg_color"] = bg_color
+    if box_width:
+        text_kwargs.update(size=(box_width, None), method='caption') # Allow wrapping for phrase video
+    else:
+        text_kwargs["method"] = "label"
+    return mp.TextClip(text, **text_kwargs)
+
+# --- Still-Frame Fast Path (audio-only inputs) ---
+def write_still_video(final_clip, change_times, audio_path, output_filename, work_dir=None, log_callback=print):
+    """
+    Encodes a clip whose picture only changes at change_times (text on a static
+    background): renders one frame per change point, snapped to the output frame
+    grid so each still matches the frame the full render would produce, and
+    encodes them with the ffmpeg concat demuxer as variable frame rate video.
+    Returns True on success, False to fall back to the regular writer.
+    The stills go in work_dir (a temporary directory if None).
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return write_still_video(final_clip, change_times, audio_path, output_filename, tmp, log_callback)
+    fps = config.VIDEO_FPS
+    duration = final_clip.duration
+    if final_clip.audio is not None and final_clip.audio.duration:
+        duration = min(duration, final_clip.audio.duration)
+    total_frames = int(math.ceil(duration * fps))
+    if total_frames <= 0:
+        return False
+    # Also take the frame after each change point: clip-relative timing can round a change to the next frame
+    first_frames = {int(math.ceil(t * fps - 1e-6)) for t in change_times if 0 < t < duration}
+    frame_indices = sorted({0} | first_frames | {i + 1 for i in first_frames})
+    frame_indices = [i for i in frame_indices if i < total_frames]
+
+    still_dir = work_dir
+    list_path = os.path.join(still_dir, 'stills.ffconcat')
+    log_callback(f"Audio-only fast path: rendering {len(frame_indices)} stills instead of {total_frames} frames...")
+    try:
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write("ffconcat version 1.0\n")
+            for n, frame_idx in enumerate(frame_indices):
+                name = f"still_{n:05d}.png"
+                Image.fromarray(final_clip.get_frame(frame_idx / fps)).save(os.path.join(still_dir, name), compress_level=1)
+                next_idx = frame_indices[n + 1] if n + 1 < len(frame_indices) else total_frames
+                f.write(f"file '{name}'\nduration {(next_idx - frame_idx) / fps:.6f}\n")
+            f.write(f"file '{name}'\n") # The concat demuxer ignores the last entry's duration
+    except Exception as e:
+        log_callback(f"Warning: Could not render stills ({e}); using the full render.")
+        return False
+
+    command = ["ffmpeg", "-y", "-v", "error", "-nostats", "-f", "concat", "-safe", "0", "-i", list_path]
+    if final_clip.audio is not None and audio_path:
+        command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac"]
+    command += ["-vsync", "vfr", "-pix_fmt", "yuv420p", "-t", f"{duration:.3f}", "-movflags", "+faststart"]
+    for choice in encoder_candidates():
+        start = time.time()
+        result = subprocess.run(command + ffmpeg_args(choice) + [output_filename], capture_output=True, text=True)
+        if result.returncode == 0:
+            log_encode_rate(log_callback, choice, len(frame_indices), time.time() - start)
+            log_callback(f"Success! Lyrics video successfully generated from stills: '{output_filename}'")
+            return True
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        log_callback(f"Still-frame encode with {choice['codec']} failed: {error}")
+    return False
+
+def write_clip(final_clip, output_filename, temp_audiofile, log_callback=print):
+    """
+    Writes a MoviePy clip with the encoder chosen by the startup probe (see
+    encoders.py), falling back to libx264 if it fails. Logs the encode fps.
+    """
+    candidates = encoder_candidates()
+    for n, choice in enumerate(candidates):
+        log_callback(f"Encoding with {describe(choice)}")
+        start = time.time()
+        try:
+            final_clip.write_videofile(
+                output_filename, audio_codec="aac", fps=config.VIDEO_FPS,
+                temp_audiofile=temp_audiofile, remove_temp=True, logger='bar', **moviepy_kwargs(choice)
+            )
+        except Exception as e:
+            if n == len(candidates) - 1:
+                raise
+            log_callback(f"Encoder {choice['codec']} failed: {e}")
+            log_callback("Trying again with the software encoder...")
+            continue
+        log_encode_rate(log_callback, choice, int(math.ceil(final_clip.duration * config.VIDEO_FPS)), time.time() - start)
+        return choice
+
+def open_video_clip(input_path, log_callback=print, max_height=None):
+    """
+    Opens the input video. Inputs taller than max_height (config.RENDER_HEIGHT)
+    are downscaled by the ffmpeg reader (scale filter) instead of resizing
+    every frame with PIL in Python.
+    """
+    max_height = max_height or config.RENDER_HEIGHT
+    clip = mp.VideoFileClip(input_path)
+    if clip.size and clip.size[1] > max_height:
+        width, height = render_size(*clip.size, max_height)
+        log_callback(f"Downscaling video from {clip.size[1]}p to {height}p (in the ffmpeg reader)...")
+        clip.close()
+        clip = mp.VideoFileClip(input_path, target_resolution=(height, width))
+    return clip
+
+def _audio_source(input_path, audio_path_override):
+    return audio_path_override if audio_path_override and os.path.exists(audio_path_override) else input_path
 
 # --- generate_phrase_video Function (Remains the same) ---
-def generate_phrase_video(input_path, segments, output_filename, is_video_input, log_callback=print, audio_path_override=None):
+def generate_phrase_video(input_path, segments, output_filename, is_video_input, log_callback=print, audio_path_override=None, work_dir=None, time_range=None, render_height=None):
 
     if not segments:
         log_callback("No segments to process. Skipping video generation.")
@@ -17,14 +144,19 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
 
     if is_video_input:
         try:
-            base_clip = mp.VideoFileClip(input_path)
+            base_clip = open_video_clip(input_path, log_callback, render_height)
             # <<< FIX: Ensure duration is read correctly >>>
             base_clip_duration = base_clip.duration if base_clip.duration is not None else 0
+            if time_range: # Chunk of a parallel render (see parallel_render.py)
+                base_clip = base_clip.without_audio().subclip(*time_range)
+                base_clip_duration = base_clip.duration
         except Exception as e:
             log_callback(f"Error loading base video clip: {e}")
             return
 
-        if audio_path_override and os.path.exists(audio_path_override):
+        if time_range:
+             log_callback("Rendering video only; audio is added after the chunks are joined.")
+        elif audio_path_override and os.path.exists(audio_path_override):
              log_callback(f"Overriding video audio with: {os.path.basename(audio_path_override)}")
              try: final_audio_clip = mp.AudioFileClip(audio_path_override)
              except Exception as e:
@@ -36,27 +168,28 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
              final_audio_clip = base_clip.audio if base_clip and hasattr(base_clip, 'audio') else None
 
 
-        # Downscale for performance
-        if base_clip and base_clip.size and base_clip.size[1] > 720:
-            log_callback(f"Downscaling video from {base_clip.size[1]}p to 720p...")
-            base_clip = base_clip.resize(height=720)
-        media_size = base_clip.size if base_clip else (1280, 720) # Fallback size
+        media_size = base_clip.size if base_clip else canvas_size(render_height) # Fallback size
 
     else: # Audio input
         try:
-            if audio_path_override and os.path.exists(audio_path_override):
+            if time_range:
+                 log_callback("Rendering video only; audio is added after the chunks are joined.")
+            elif audio_path_override and os.path.exists(audio_path_override):
                  log_callback(f"Using override audio: {os.path.basename(audio_path_override)}")
                  final_audio_clip = mp.AudioFileClip(audio_path_override)
             else:
                  log_callback("Using original input audio.")
                  final_audio_clip = mp.AudioFileClip(input_path)
 
-            base_clip_duration = final_audio_clip.duration if final_audio_clip else 0
+            if time_range:
+                 base_clip_duration = time_range[1] - time_range[0]
+            else:
+                 base_clip_duration = final_audio_clip.duration if final_audio_clip else 0
             if base_clip_duration <= 0:
                  log_callback("Error: Audio clip has zero or negative duration.")
                  return
 
-            media_size = (1280, 720)
+            media_size = canvas_size(render_height)
             base_clip = mp.ColorClip(size=media_size, color=[0, 0, 0], duration=base_clip_duration)
         except Exception as e:
              log_callback(f"Error loading audio clip or creating base ColorClip: {e}")
@@ -71,6 +204,7 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
     last_segment_end = 0 # <<< FIX: Initialize last_segment_end for accurate timing calc >>>
     for i, seg in enumerate(segments):
         start_time = seg.get('start', last_segment_end) # <<< Use last_segment_end as default
+        start_time = max(0, start_time) # Chunk renders: a segment crossing the chunk start is shown from 0
         text = seg.get('text', "").strip()
 
         # <<< FIX: More robust duration calculation >>>
@@ -98,14 +232,13 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
         relative_pos = False if not is_video_input else True
 
         try:
-            txt_clip = mp.TextClip(
+            txt_clip = make_text_clip(
                 text,
                 fontsize=dynamic_font_size, # Use dynamic font here
                 color=config.FONT_COLOR,
                 font=config.FONT_FAMILY,
                 bg_color=config.FONT_BACKGROUND,
-                size=(media_size[0] * 0.9, None),
-                method='caption' # Allow wrapping for phrase video
+                box_width=media_size[0] * 0.9 # Allow wrapping for phrase video
             ).set_duration(duration).set_start(start_time).set_position(position, relative=relative_pos)
 
             text_clips.append(txt_clip)
@@ -147,20 +280,16 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
         final_clip = final_clip.set_audio(None)
 
     # Write the final video file
+    # Per-task temp audio path so concurrent renders don't share 'temp-audio.m4a'
+    temp_audiofile = os.path.join(work_dir, 'temp-audio.m4a') if work_dir else 'temp-audio.m4a'
     try:
-        log_callback("Writing final video file... (Using hardware acceleration)")
-        final_clip.write_videofile(
-            output_filename, codec="h264_videotoolbox", audio_codec="aac", fps=24,
-            temp_audiofile='temp-audio.m4a', remove_temp=True, preset="fast", threads=8, logger='bar'
-        )
-        log_callback(f"Success! Lyrics video successfully generated: '{output_filename}'")
-    except Exception as e:
-        log_callback(f"Hardware acceleration failed: {e}")
-        log_callback("Trying again with software encoder (this will be much slower)...")
-        final_clip.write_videofile(
-            output_filename, codec="libx264", audio_codec="aac", fps=24,
-            temp_audiofile='temp-audio.m4a', remove_temp=True, preset="fast", threads=8, logger='bar'
-        )
+        if not is_video_input and not time_range and config.AUDIO_ONLY_STILL_FRAMES and text_clips:
+            change_times = [t for tc in text_clips for t in (tc.start, tc.end)]
+            if write_still_video(final_clip, change_times, _audio_source(input_path, audio_path_override),
+                                 output_filename, work_dir, log_callback):
+                return
+        log_callback("Writing final video file...")
+        write_clip(final_clip, output_filename, temp_audiofile, log_callback)
         log_callback(f"Success! Lyrics video successfully generated: '{output_filename}'")
     finally:
         if 'base_clip' in locals() and base_clip and hasattr(base_clip, 'close'): base_clip.close()
@@ -171,6 +300,7 @@ def generate_phrase_video(input_path, segments, output_filename, is_video_input,
 
 
 # --- UPDATED create_karaoke_clip Function: Simplified Positioning ---
+@timed('karaoke_clip') # Includes its two make_text_clip calls
 def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print):
     """
     Creates tuple of (base_clip, highlight_clip_with_mask) for one segment (single line).
@@ -194,13 +324,11 @@ def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print)
     base_text_kwargs = {
         "fontsize": fixed_font_size,
         "font": config.KARAOKE_FONT,
-        "method": "label",
         "color": config.BG_COLOR,
     }
     highlight_text_kwargs = {
         "fontsize": fixed_font_size,
         "font": config.KARAOKE_FONT,
-        "method": "label",
         "color": config.FONT_COLOR,
         "bg_color": config.FONT_BACKGROUND
     }
@@ -212,7 +340,7 @@ def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print)
     # --- Create Base Text ---
     try:
         # Create without position to get natural size
-        base_clip = mp.TextClip(phrase, **base_text_kwargs).set_duration(seg_duration)
+        base_clip = make_text_clip(phrase, **base_text_kwargs).set_duration(seg_duration)
         base_clip_size = base_clip.size # Store natural size
         log_callback(f"Karaoke: Base clip natural size={base_clip.size}")
     except Exception as clip_err:
@@ -222,7 +350,7 @@ def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print)
     # --- Create Highlighted Text ---
     try:
         # Create without position
-        highlight_clip = mp.TextClip(phrase, **highlight_text_kwargs).set_duration(seg_duration)
+        highlight_clip = make_text_clip(phrase, **highlight_text_kwargs).set_duration(seg_duration)
         log_callback(f"Karaoke: Highlight clip natural size={highlight_clip.size}")
     except Exception as clip_err:
          log_callback(f"Warning: Could not create highlight karaoke text clip for '{phrase[:30]}...': {clip_err}")
@@ -272,18 +400,29 @@ def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print)
              final_composite = mp.CompositeVideoClip([base_clip, highlight_clip]) # Fallback composite
         else:
             # --- Animation mask ---
+            # Precompute the highlighted width for every output frame: searchsorted over the
+            # word start times replaces the per-frame Python loop, and the masks are built
+            # once per distinct width (one per word at most) and reused across frames.
+            clip_width_pixels, clip_height_pixels = base_clip_size # Use natural size for calculation
+            word_starts = np.array([start for start, _ in word_timings], dtype=np.float64)
+            word_widths = np.array([int(clip_width_pixels * char_end / total_chars) if total_chars else 0
+                                    for _, char_end in word_timings], dtype=np.int64)
+            word_widths = np.clip(np.concatenate(([0], word_widths)), 0, clip_width_pixels) # index 0: before the first word
+            n_frames = max(1, int(np.ceil(seg_duration * config.VIDEO_FPS)) + 1)
+            frame_times = np.arange(n_frames) / config.VIDEO_FPS
+            frame_widths = word_widths[np.searchsorted(word_starts, frame_times, side='right')]
+            mask_cache = {}
+
             def make_frame(t):
-                chars_to_highlight = 0
-                for relative_w_start, char_end_index in word_timings:
-                    if t >= relative_w_start: chars_to_highlight = char_end_index
-                    else: break
-                if total_chars == 0: width_percent = 0
-                else: width_percent = chars_to_highlight / total_chars
-                clip_width_pixels = base_clip_size[0] # Use natural size for calculation
-                width = int(clip_width_pixels * width_percent)
-                width = np.clip(width, 0, clip_width_pixels)
-                mask = np.zeros((base_clip_size[1], clip_width_pixels), dtype=np.uint8)
-                mask[:, :width] = 255
+                # Frame k covers [k/fps, (k+1)/fps), as in the per-frame path (no rounding up half a frame early)
+                frame_idx = min(max(int(math.floor(t * config.VIDEO_FPS + 1e-6)), 0), n_frames - 1)
+                width = int(frame_widths[frame_idx])
+                mask = mask_cache.get(width)
+                if mask is None:
+                    mask = np.zeros((clip_height_pixels, clip_width_pixels), dtype=np.uint8)
+                    mask[:, :width] = 255
+                    mask.setflags(write=False) # Shared between frames
+                    mask_cache[width] = mask
                 return mask
 
             try:
@@ -321,7 +460,7 @@ def create_karaoke_clip(segment, media_size, is_video_input, log_callback=print)
 
 
 # --- generate_karaoke_video Function (No changes needed here) ---
-def generate_karaoke_video(input_path, segments, output_filename, is_video_input, log_callback=print, audio_path_override=None):
+def generate_karaoke_video(input_path, segments, output_filename, is_video_input, log_callback=print, audio_path_override=None, work_dir=None, time_range=None, render_height=None):
     if not segments:
         log_callback("No segments to process. Skipping karaoke video generation.")
         return
@@ -334,15 +473,20 @@ def generate_karaoke_video(input_path, segments, output_filename, is_video_input
     if is_video_input:
         log_callback("Karaoke: Processing VIDEO input.")
         try:
-            base_clip_layer = mp.VideoFileClip(input_path)
+            base_clip_layer = open_video_clip(input_path, log_callback, render_height)
             # <<< FIX: Ensure duration is read correctly >>>
             base_clip_duration = base_clip_layer.duration if base_clip_layer.duration is not None else 0
+            if time_range: # Chunk of a parallel render (see parallel_render.py)
+                base_clip_layer = base_clip_layer.without_audio().subclip(*time_range)
+                base_clip_duration = base_clip_layer.duration
             log_callback(f"Karaoke: Loaded VIDEO base layer. Duration={base_clip_duration:.2f}s, Size={base_clip_layer.size}")
         except Exception as e:
             log_callback(f"Error loading base video clip: {e}")
             return
 
-        if audio_path_override and os.path.exists(audio_path_override):
+        if time_range:
+             log_callback("Rendering video only; audio is added after the chunks are joined.")
+        elif audio_path_override and os.path.exists(audio_path_override):
              log_callback(f"Overriding video audio with: {os.path.basename(audio_path_override)}")
              try: final_audio_clip = mp.AudioFileClip(audio_path_override)
              except Exception as e:
@@ -353,29 +497,30 @@ def generate_karaoke_video(input_path, segments, output_filename, is_video_input
              log_callback("Using original video audio.")
              final_audio_clip = base_clip_layer.audio if base_clip_layer and hasattr(base_clip_layer, 'audio') else None
 
-        # Downscale for performance
-        if base_clip_layer and base_clip_layer.size and base_clip_layer.size[1] > 720:
-            log_callback(f"Downscaling video from {base_clip_layer.size[1]}p to 720p...")
-            base_clip_layer = base_clip_layer.resize(height=720)
-        media_size = base_clip_layer.size if base_clip_layer else (1280, 720)
+        media_size = base_clip_layer.size if base_clip_layer else canvas_size(render_height)
         log_callback(f"Karaoke: Video media size set to {media_size}")
 
     else: # Audio input
         log_callback("Karaoke: Processing AUDIO input.")
         try:
-            if audio_path_override and os.path.exists(audio_path_override):
+            if time_range:
+                 log_callback("Rendering video only; audio is added after the chunks are joined.")
+            elif audio_path_override and os.path.exists(audio_path_override):
                  log_callback(f"Using override audio: {os.path.basename(audio_path_override)}")
                  final_audio_clip = mp.AudioFileClip(audio_path_override)
             else:
                  log_callback("Using original input audio.")
                  final_audio_clip = mp.AudioFileClip(input_path)
 
-            base_clip_duration = final_audio_clip.duration if final_audio_clip else 0
+            if time_range:
+                 base_clip_duration = time_range[1] - time_range[0]
+            else:
+                 base_clip_duration = final_audio_clip.duration if final_audio_clip else 0
             if base_clip_duration <= 0:
                  log_callback("Error: Audio clip has zero or negative duration.")
                  return
 
-            media_size = (1280, 720)
+            media_size = canvas_size(render_height)
             base_clip_layer = mp.ColorClip(size=media_size, color=[0, 0, 0], duration=base_clip_duration)
             log_callback(f"Karaoke: Created COLOR base layer. Size={media_size}, Duration={base_clip_duration:.2f}s")
         except Exception as e:
@@ -458,21 +603,18 @@ def generate_karaoke_video(input_path, segments, output_filename, is_video_input
         final_clip = final_clip.set_audio(None)
 
     # Write the final video file
+    # Per-task temp audio path so concurrent renders don't share 'temp-audio.m4a'
+    temp_audiofile = os.path.join(work_dir, 'temp-audio.m4a') if work_dir else 'temp-audio.m4a'
     try:
-        log_callback("Writing final karaoke video file... (Using hardware acceleration, may be slow)")
-        final_clip.write_videofile(
-            output_filename, codec="h264_videotoolbox", audio_codec="aac", fps=24,
-            temp_audiofile='temp-audio.m4a', remove_temp=True, preset="fast", threads=8, logger='bar'
-        )
-        log_callback(f"Success! Karaoke video successfully generated: '{output_filename}'")
-    except Exception as e:
-        log_callback(f"Hardware acceleration failed: {e}")
-        log_callback("Trying again with software encoder (this will be much slower)...")
-        final_clip.write_videofile(
-            output_filename, codec="libx264", audio_codec="aac", fps=24,
-            temp_audiofile='temp-audio.m4a', remove_temp=True, preset="fast",
-            threads=8, logger='bar'
-        )
+        if not is_video_input and not time_range and config.AUDIO_ONLY_STILL_FRAMES and text_clips:
+            # The wipe only moves at word starts (see create_karaoke_clip)
+            change_times = [t for clip in text_clips for t in (clip.start, clip.end)]
+            change_times += [w['start'] for seg in segments for w in seg.get('words', []) if w.get('start') is not None]
+            if write_still_video(final_clip, change_times, _audio_source(input_path, audio_path_override),
+                                 output_filename, work_dir, log_callback):
+                return
+        log_callback("Writing final karaoke video file...")
+        write_clip(final_clip, output_filename, temp_audiofile, log_callback)
         log_callback(f"Success! Karaoke video successfully generated: '{output_filename}'")
     finally:
         # Close clips
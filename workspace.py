@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+import config
+
+def scratch_root():
+    """
+    Base directory for per-task scratch space: config.SCRATCH_DIR if set,
+    otherwise tmpfs (/dev/shm) when available and enabled, else the system temp dir.
+    """
+    if config.SCRATCH_DIR:
+        return config.SCRATCH_DIR
+    if config.USE_TMPFS_SCRATCH and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+@contextmanager
+def task_workspace(task_id, log_callback=print):
+    """
+    Creates a private scratch directory for one task (Demucs output, encoder temp
+    audio, ...) and removes it afterwards, so concurrent jobs never share file names.
+    """
+    root = scratch_root()
+    os.makedirs(root, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=f"lyrassist_{task_id[:8]}_", dir=root)
+    log_callback(f"Using scratch directory: {work_dir}")
+    try:
+        yield work_dir
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)